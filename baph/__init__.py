@@ -1,10 +1,31 @@
-def setup():
+def setup(profile=None):
+  """
+  Configures logging and populates the app registry. With profile (or
+  the BAPH_IMPORT_PROFILE environment variable), the import time of each
+  module and app is reported to stderr
+  """
+  import os
+  import sys
   from baph.apps import apps
+  from baph.apps.profiling import ImportProfiler, PROFILE_ENV_VARIABLE
   from baph.conf import settings
   from baph.utils.log import configure_logging
 
-  configure_logging(settings.LOGGING_CONFIG, settings.LOGGING)
-  apps.populate(settings.INSTALLED_APPS)
+  if profile is None:
+    profile = bool(os.environ.get(PROFILE_ENV_VARIABLE))
+  profiler = ImportProfiler()
+  if profile:
+    profiler.start()
+  try:
+    configure_logging(settings.LOGGING_CONFIG, settings.LOGGING)
+    apps.populate(settings.INSTALLED_APPS,
+                  lazy_models=getattr(settings, 'BAPH_LAZY_MODELS', False))
+  finally:
+    profiler.stop()
+  if profile:
+    sys.stderr.write('%s\n' % profiler.get_report(
+      app_timings=apps.app_timings))
+  return profiler
 
 def replace_settings_class():
   from django import conf
@@ -14,15 +35,13 @@ def replace_settings_class():
 def apply_patches():
   import os
   from importlib import import_module
+  from baph.utils.bytecode import exec_file
 
   patch_dir = os.path.join(os.path.dirname(__file__), 'patches')
   for mod_name in os.listdir(patch_dir):
     filename = os.path.join(patch_dir, mod_name)
-    with open(filename, 'rt') as fp:
-      src = fp.read()
-    code = compile(src, filename, 'exec')
     mod = import_module(mod_name)
-    exec(code, mod.__dict__)
+    exec_file(filename, mod.__dict__, 'patch: %s' % mod_name)
 
 replace_settings_class()
 apply_patches()
\ No newline at end of file
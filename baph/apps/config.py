@@ -48,6 +48,10 @@ class AppConfig(object):
     # None to prevent accidental access before import_models() runs.
     self.models = None
 
+    # Name of the models module, when its import has been deferred by
+    # defer_models(), until the first model lookup.
+    self.deferred_models_module = None
+
   def __repr__(self):
     return '<%s: %s>' % (self.__class__.__name__, self.label)
 
@@ -167,6 +171,7 @@ class AppConfig(object):
     Raises LookupError if no model exists with this name.
     """
     self.check_models_ready()
+    self.import_deferred_models()
     try:
       return self.models[model_name.lower()]
     except KeyError:
@@ -188,6 +193,7 @@ class AppConfig(object):
     Keyword arguments aren't documented; they're a private API.
     """
     self.check_models_ready()
+    self.import_deferred_models()
     for model in self.models.values():
       if model._meta.auto_created and not include_auto_created:
         continue
@@ -206,6 +212,28 @@ class AppConfig(object):
       models_module_name = '%s.%s' % (self.name, MODELS_MODULE_NAME)
       self.models_module = import_module(models_module_name)
 
+  def defer_models(self, all_models):
+    """
+    Like import_models, but only registers the classes defined in the
+    models module, which is imported when one of them is first used
+    """
+    from baph.apps.lazy import defer_module
+    self.models = all_models
+
+    if module_has_submodule(self.module, MODELS_MODULE_NAME):
+      models_module_name = '%s.%s' % (self.name, MODELS_MODULE_NAME)
+      if defer_module(models_module_name):
+        self.deferred_models_module = models_module_name
+      else:
+        self.models_module = import_module(models_module_name)
+
+  def import_deferred_models(self):
+    if self.deferred_models_module is None:
+      return
+    models_module_name = self.deferred_models_module
+    self.deferred_models_module = None
+    self.models_module = import_module(models_module_name)
+
   def ready(self):
     """
     Override this method in subclasses to run code when Django starts.
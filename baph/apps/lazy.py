@@ -0,0 +1,175 @@
+"""
+Lazy model loading.
+
+With BAPH_LAZY_MODELS enabled, setup() doesn't import the models module
+of each installed app. Instead, the module source is scanned for class
+definitions, and each class name is registered against the module which
+defines it. The module is imported the first time one of its classes is
+looked up by name: through get_model(), or through the declarative class
+registry (which is how string references in relationships are resolved).
+Listing models (get_models(), get_apps()) or iterating the declarative
+class registry imports everything.
+
+Lookups made while a class is being declared don't import anything, so
+a class name defined in several modules only imports the module which
+is being declared.
+
+Scan results are stored in the preconfig index, keyed by the source
+files' mtimes, so unchanged apps are only parsed once.
+"""
+import ast
+from contextlib import contextmanager
+from importlib import import_module
+import os
+import pkgutil
+import sys
+import threading
+from weakref import WeakValueDictionary
+
+from baph.core.preconfig.index import cached_lookup
+
+
+# declarative class name -> names of the modules which define it
+deferred_classes = {}
+# depth of nested suspend_loading() blocks, per thread
+_suspended = threading.local()
+
+
+def lazy_models_enabled():
+  from django.conf import settings
+  return getattr(settings, 'BAPH_LAZY_MODELS', False)
+
+def get_source_files(module_name):
+  """
+  Returns the source files which make up a module (for a package, every
+  module directly inside it), or None if the source isn't available
+  """
+  loader = pkgutil.get_loader(module_name)
+  if loader is None:
+    return None
+  filename = loader.get_filename(module_name)
+  if not filename.endswith('.py'):
+    return None
+  if not loader.is_package(module_name):
+    return [filename]
+  path = os.path.dirname(filename)
+  return [os.path.join(path, name) for name in sorted(os.listdir(path))
+          if name.endswith('.py')]
+
+def scan_class_names(files):
+  " returns the names of the classes defined at the top level of files "
+  names = []
+  for filename in files:
+    with open(filename, 'rb') as fp:
+      tree = ast.parse(fp.read(), filename)
+    names.extend(node.name for node in tree.body
+                 if isinstance(node, ast.ClassDef))
+  return names
+
+def defer_module(module_name):
+  """
+  Registers the classes defined in module_name, to be imported on first
+  lookup. Returns False if the module can't be scanned, in which case
+  it should be imported immediately
+  """
+  files = get_source_files(module_name)
+  if files is None:
+    return False
+  dirs = files + [os.path.dirname(files[0])]
+  names = cached_lookup(('classes', module_name, files), dirs,
+                        lambda: scan_class_names(files))
+  for name in names:
+    module_names = deferred_classes.setdefault(name, [])
+    if module_name not in module_names:
+      module_names.append(module_name)
+  return True
+
+def loading_suspended():
+  return getattr(_suspended, 'depth', 0) > 0
+
+@contextmanager
+def suspend_loading():
+  " registry lookups inside the block don't import deferred modules "
+  _suspended.depth = getattr(_suspended, 'depth', 0) + 1
+  try:
+    yield
+  finally:
+    _suspended.depth -= 1
+
+def load_deferred_class(name, is_loaded=None):
+  """
+  Imports the modules defining the deferred class name, in the order
+  they were deferred, until is_loaded() returns True. Returns False if
+  the class isn't deferred, or its modules are already imported (or are
+  being imported)
+  """
+  if loading_suspended():
+    return False
+  module_names = deferred_classes.get(name)
+  imported = False
+  while module_names:
+    module_name = module_names.pop(0)
+    if module_name in sys.modules:
+      continue
+    import_module(module_name)
+    imported = True
+    if is_loaded is not None and is_loaded():
+      break
+  if not module_names:
+    deferred_classes.pop(name, None)
+  return imported
+
+def load_deferred_classes():
+  " imports all deferred modules "
+  if loading_suspended():
+    return
+  module_names = set()
+  for names in deferred_classes.values():
+    module_names.update(names)
+  deferred_classes.clear()
+  for module_name in sorted(module_names):
+    if module_name not in sys.modules:
+      import_module(module_name)
+
+
+class LazyClassRegistry(WeakValueDictionary):
+  """
+  A declarative class registry which imports deferred modules on lookup
+  misses, and imports all deferred modules before it is iterated
+  """
+  def _is_loaded(self, key):
+    return lambda: WeakValueDictionary.__contains__(self, key)
+
+  def __contains__(self, key):
+    if WeakValueDictionary.__contains__(self, key):
+      return True
+    return load_deferred_class(key, self._is_loaded(key)) \
+      and WeakValueDictionary.__contains__(self, key)
+
+  def __getitem__(self, key):
+    if not WeakValueDictionary.__contains__(self, key):
+      load_deferred_class(key, self._is_loaded(key))
+    return WeakValueDictionary.__getitem__(self, key)
+
+  def get(self, key, default=None):
+    if key in self:
+      return WeakValueDictionary.get(self, key, default)
+    return default
+
+  def __len__(self):
+    load_deferred_classes()
+    return WeakValueDictionary.__len__(self)
+
+
+def _loading_all(name):
+  method = getattr(WeakValueDictionary, name)
+  def wrapper(self, *args, **kwargs):
+    load_deferred_classes()
+    return method(self, *args, **kwargs)
+  wrapper.__name__ = name
+  return wrapper
+
+for name in ('__iter__', 'keys', 'values', 'items', 'iterkeys', 'itervalues',
+             'iteritems', 'valuerefs', 'itervaluerefs', 'copy'):
+  setattr(LazyClassRegistry, name, _loading_all(name))
+del name
@@ -0,0 +1,100 @@
+"""
+Import-time profiling for :func:`baph.setup`.
+
+While active, an :class:`ImportProfiler` wraps ``__import__`` and records
+the time taken to load each new module, both cumulative (including the
+modules it imported in turn) and its own. Set BAPH_IMPORT_PROFILE to
+print a report, with a per-app breakdown, to stderr once setup() is done.
+
+The profiler keeps a single import stack, so it should only be active
+while one thread is importing (as is the case during setup).
+"""
+import __builtin__
+from collections import OrderedDict
+import sys
+import time
+
+
+PROFILE_ENV_VARIABLE = 'BAPH_IMPORT_PROFILE'
+
+
+class ImportProfiler(object):
+  def __init__(self):
+    # module name -> (cumulative seconds, own seconds), in load order
+    self.timings = OrderedDict()
+    self._stack = []
+    self._known = set()
+    self._import = None
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.stop()
+
+  def start(self):
+    self._known = set(sys.modules)
+    self._import = __builtin__.__import__
+    __builtin__.__import__ = self.profiled_import
+
+  def stop(self):
+    if self._import is not None:
+      __builtin__.__import__ = self._import
+      self._import = None
+
+  def profiled_import(self, *args, **kwargs):
+    count = len(sys.modules)
+    self._stack.append(0.0)
+    start = time.time()
+    try:
+      return self._import(*args, **kwargs)
+    finally:
+      elapsed = time.time() - start
+      nested = self._stack.pop()
+      if len(sys.modules) != count:
+        # something was loaded by this import, or the ones it triggered
+        self.record(elapsed, elapsed - nested)
+        if self._stack:
+          self._stack[-1] += elapsed
+
+  def record(self, cumulative, own):
+    """
+    Attributes the timing to the modules loaded since the last record.
+    Nested imports finish first and claim their own modules, so these are
+    the modules loaded directly by the current import. When that is more
+    than one (a package and its submodule), the innermost one is used
+    """
+    new = [name for name, mod in sys.modules.items()
+           if name not in self._known and mod is not None]
+    self._known.update(sys.modules)
+    if new:
+      self.timings[max(new, key=len)] = (cumulative, own)
+
+  def get_app_modules(self, app_name):
+    prefix = app_name + '.'
+    return [name for name in self.timings
+            if name == app_name or name.startswith(prefix)]
+
+  def get_report(self, limit=25, app_timings=None):
+    """
+    Returns a summary of the slowest imports, and of the time spent on
+    each app, if app_timings (as recorded by Apps.populate) is given
+    """
+    lines = ['%-56s %12s %10s' % ('module', 'cumul. (ms)', 'own (ms)')]
+    ranked = sorted(self.timings.items(), key=lambda item: -item[1][0])
+    for name, (cumulative, own) in ranked[:limit]:
+      lines.append('%-56s %12.2f %10.2f' % (name, cumulative * 1000,
+                                            own * 1000))
+    total = sum(own for cumulative, own in self.timings.values())
+    lines.append('%-56s %12s %10.2f' % ('total (%d modules)'
+                 % len(self.timings), '', total * 1000))
+    if app_timings:
+      lines.append('')
+      lines.append('%-40s %10s %12s %8s' % ('app', 'app (ms)', 'models (ms)',
+                                             'modules'))
+      for label, (name, config_time, models_time) in app_timings.items():
+        lines.append('%-40s %10.2f %12.2f %8d' % (
+          label, config_time * 1000, models_time * 1000,
+          len(self.get_app_modules(name))))
+    return '\n'.join(lines)
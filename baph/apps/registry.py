@@ -1,4 +1,5 @@
 import threading
+import time
 from collections import Counter, OrderedDict, defaultdict
 
 from functools32 import lru_cache
@@ -12,12 +13,21 @@ class Apps(object):
     self.app_configs = OrderedDict()
     self.stored_app_configs = []
     self.apps_ready = self.models_ready = self.ready = False
+    self.lazy_models = False
+    # app label -> (app name, seconds to load the app, seconds to load
+    # its models)
+    self.app_timings = OrderedDict()
     self._lock = threading.Lock()
 
     if installed_apps is not None:
       self.populate(installed_apps)
 
-  def populate(self, installed_apps=None):
+  def populate(self, installed_apps=None, lazy_models=False):
+    """
+    Loads the app configs and models of installed_apps. With lazy_models,
+    the models modules are only imported when first used (see
+    baph.apps.lazy)
+    """
     if self.ready:
       return
 
@@ -32,10 +42,13 @@ class Apps(object):
 
       # Load app configs and app modules.
       for entry in installed_apps:
+        start = time.time()
         if isinstance(entry, AppConfig):
           app_config = entry
         else:
           app_config = AppConfig.create(entry)
+        self.app_timings[app_config.label] = (
+          app_config.name, time.time() - start, 0.0)
         if app_config.label in self.app_configs:
           raise RuntimeError(
             "Application labels aren't unique, "
@@ -56,9 +69,17 @@ class Apps(object):
       self.apps_ready = True
 
       # Load models.
+      self.lazy_models = lazy_models
       for app_config in self.app_configs.values():
         all_models = self.all_models[app_config.label]
-        app_config.import_models(all_models)
+        start = time.time()
+        if lazy_models:
+          app_config.defer_models(all_models)
+        else:
+          app_config.import_models(all_models)
+        name, config_time, _ = self.app_timings[app_config.label]
+        self.app_timings[app_config.label] = (
+          name, config_time, time.time() - start)
 
       self.clear_cache()
       self.models_ready = True
@@ -4,4 +4,9 @@ from baph.apps import AppConfig
 class AuthConfig(AppConfig):
   name = 'baph.auth'
   verbose_name = 'Baph Auth'
-  label = 'baph_auth'
\ No newline at end of file
+  label = 'baph_auth'
+
+  def ready(self):
+    from baph.auth.cache import check_user_cache, user_cache_enabled
+    if user_cache_enabled():
+      check_user_cache()
@@ -1,5 +1,6 @@
 import django.core.validators
 
+from baph.auth.cache import get_cached_user, user_cache_enabled
 from baph.auth.models import User, Organization
 from baph.auth.registration import settings as auth_settings
 from baph.db.orm import ORM
@@ -42,6 +43,8 @@ class MultiSQLAlchemyBackend(object):
         else: return user
 
     def get_user(self, user_id):
+        if user_cache_enabled():
+            return get_cached_user(user_id)
         session = orm.sessionmaker()
         return session.query(User).get(user_id)
 
@@ -0,0 +1,226 @@
+"""
+Cached user resolution for authenticated requests.
+
+When ``BAPH_AUTH_USER_CACHE`` (and ``CACHE_ENABLED``) is set, the user for
+a request is resolved from a snapshot of its column values, permission
+context and permissions, stored in the user model's cache. The snapshot is
+stored under an asset key of the user, so :meth:`CacheMixin.kill_cache`
+invalidates it whenever the user changes. The user model must support the
+``asset`` cache mode, ie.::
+
+    class Meta:
+        cache_alias = 'default'
+        cache_detail_fields = ['id']
+        cache_modes = ['detail', 'asset']
+
+Changes to groups, group memberships, permissions and organizations bump
+a single permission version when their session commits, which invalidates
+the permissions of every cached snapshot.
+"""
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.session import Session
+
+from baph.auth.mixins import UserPermissionMixin
+from baph.db import ORM
+
+
+orm = ORM.get()
+
+# columns which are never stored in snapshots
+SNAPSHOT_EXCLUDED_FIELDS = ('password',)
+# session.info key set when a flush changed permissions
+PERMISSION_CHANGES_KEY = 'baph_auth_permission_changes'
+
+
+def user_cache_enabled():
+    return (getattr(settings, 'BAPH_AUTH_USER_CACHE', False)
+            and getattr(settings, 'CACHE_ENABLED', False))
+
+def check_user_cache():
+    """
+    Raises ImproperlyConfigured if the user model can't store snapshots
+    """
+    from baph.auth.models import User
+    if not User._meta.cache_alias:
+        raise ImproperlyConfigured('BAPH_AUTH_USER_CACHE requires a '
+                                   'cache_alias for %s' % User.__name__)
+    try:
+        User.validate_cache_mode('asset')
+    except ValueError as e:
+        raise ImproperlyConfigured('BAPH_AUTH_USER_CACHE requires asset '
+                                   'keys for %s: %s' % (User.__name__, e))
+
+def get_user_cache_key(user_id):
+    from baph.auth.models import User
+    return User.build_cache_key('asset', 'auth', id=user_id)
+
+def get_permission_version_key():
+    from baph.auth.models import User
+    return '%s:permission_version' % User._meta.base_model_name_plural
+
+def bump_permission_version():
+    from baph.auth.models import User
+    cache = User.get_cache()
+    key = get_permission_version_key()
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the key does not exist
+        cache.set(key, int(time.time()))
+
+def record_permission_change(mapper, connection, target):
+    """
+    Mapper event handler for the models which affect user permissions.
+    The version is bumped once the session commits, so concurrent requests
+    can't cache snapshots of uncommitted (or rolled back) permissions
+    """
+    if not user_cache_enabled():
+        return
+    session = object_session(target)
+    if session is None:
+        bump_permission_version()
+        return
+    session.info[PERMISSION_CHANGES_KEY] = True
+
+@event.listens_for(Session, 'after_commit')
+def bump_committed_permission_version(session):
+    if session.info.pop(PERMISSION_CHANGES_KEY, False):
+        bump_permission_version()
+
+@event.listens_for(Session, 'after_rollback')
+def discard_permission_changes(session):
+    session.info.pop(PERMISSION_CHANGES_KEY, None)
+
+def build_user_snapshot(user, permission_version):
+    """
+    Returns a picklable summary of user, used by :class:`CachedUser`
+    """
+    data = {}
+    for attr in inspect(type(user)).column_attrs:
+        if attr.key not in SNAPSHOT_EXCLUDED_FIELDS:
+            data[attr.key] = getattr(user, attr.key)
+    # context keys are '<model name>.<attribute>'
+    context = dict((key, value) for key, value in user.get_context().items()
+                   if key.rsplit('.', 1)[-1] not in SNAPSHOT_EXCLUDED_FIELDS)
+    return {
+        'data': data,
+        'context': context,
+        'permissions': user.get_all_permissions(),
+        'permission_version': permission_version,
+        }
+
+def get_cached_user(user_id):
+    """
+    Returns a :class:`CachedUser` for user_id if a current snapshot is
+    cached. Otherwise, the user is loaded from the database, its snapshot
+    is cached, and the user instance is returned. Returns None if the
+    user does not exist
+    """
+    from baph.auth.models import User
+    cache = User.get_cache()
+    cache_key = get_user_cache_key(user_id)
+    version_key = get_permission_version_key()
+
+    values = cache.get_many([cache_key, version_key])
+    version = values.get(version_key)
+    if version is None:
+        version = int(time.time())
+        cache.set(version_key, version)
+    snapshot = values.get(cache_key)
+    if snapshot is not None and snapshot['permission_version'] == version:
+        return CachedUser(snapshot)
+
+    session = orm.sessionmaker()
+    user = session.query(User).get(user_id)
+    if user is None:
+        return None
+    cache.set(cache_key, build_user_snapshot(user, version))
+    return user
+
+
+class CachedUser(UserPermissionMixin):
+    """
+    A stand-in for an authenticated user, built from a cached snapshot.
+    Column values, the permission context and permissions are read from
+    the snapshot. Any other attribute loads the user from the database,
+    after which all attributes are read from the loaded instance.
+
+    A CachedUser is not a User instance, and can't be assigned to
+    relationships or added to a session: use :meth:`get_instance` for
+    that. It compares equal to CachedUsers and Users with the same id
+    (User doesn't define equality, so ``user == cached`` uses this
+    comparison too), and hashes by id
+    """
+    def __init__(self, snapshot):
+        self.__dict__['_snapshot'] = snapshot
+        self.__dict__['_instance'] = None
+
+    def get_instance(self):
+        " returns the User, loading it on first use "
+        if self._instance is None:
+            from baph.auth.models import User
+            session = orm.sessionmaker()
+            self.__dict__['_instance'] = session.query(User) \
+                .get(self._snapshot['data']['id'])
+        return self._instance
+
+    def __getattr__(self, key):
+        if key == '_sa_instance_state':
+            # never load the user implicitly when handed to the ORM
+            raise AttributeError('%r is not a mapped instance; use '
+                                 'get_instance()' % self)
+        if self._instance is None:
+            data = self._snapshot['data']
+            if key in data:
+                return data[key]
+            if key.startswith('_'):
+                # private attributes are either local, or class attributes
+                from baph.auth.models import User
+                return getattr(User, key)
+        return getattr(self.get_instance(), key)
+
+    def __setattr__(self, key, value):
+        if key.startswith('_'):
+            # private attributes, ie. the permission cache, stay local
+            self.__dict__[key] = value
+        else:
+            setattr(self.get_instance(), key, value)
+
+    def __eq__(self, other):
+        from baph.auth.models import User
+        if not isinstance(other, (CachedUser, User)):
+            return NotImplemented
+        return other.id == self.id
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return '<CachedUser(%s)>' % self.id
+
+    @property
+    def pk(self):
+        return self.id
+
+    def is_anonymous(self):
+        return False
+
+    def is_authenticated(self):
+        return True
+
+    def get_context(self, depth=0):
+        return dict(self._snapshot['context'])
+
+    def get_all_permissions(self):
+        return self._snapshot['permissions']
@@ -1,5 +1,7 @@
 from __future__ import unicode_literals
 import getpass
+import hashlib
+import json
 import locale
 import unicodedata
 
@@ -13,7 +15,9 @@ try:
     from django.utils.text import slugify
 except:
     from django.template.defaultfilters import slugify
+from sqlalchemy import event, inspect
 from sqlalchemy.ext.declarative import has_inherited_table
+from sqlalchemy.orm import mapper
 
 from baph.auth import models as auth_app #, get_user_model
 from baph.db.models import get_models
@@ -82,69 +86,173 @@ def _get_all_permissions(opts):
 
     return perms
         
-def create_permissions(app, created_models, verbosity, db=DEFAULT_DB_ALIAS,
-                       **kwargs):
+# meta options which affect the generated permissions
+PERMISSION_META_ATTRS = ('permission_resources', 'permission_handler',
+                         'permission_parents', 'permission_full_parents',
+                         'permission_limiters', 'permission_terminator')
+
+# generated permissions, per model. These depend on the relationships of
+# other models, so they are reset when new mappers are configured
+_permission_cache = {}
+
+@event.listens_for(mapper, 'after_configured')
+def reset_permission_cache():
+    _permission_cache.clear()
+
+def get_model_permissions(model):
+    """
+    Returns the permissions for a single model, memoized per model
+    """
+    if model not in _permission_cache:
+        _permission_cache[model] = _get_all_permissions(model._meta)
+    return _permission_cache[model]
+
+def get_registered_classes():
+    " returns the set of all classes in the declarative registry "
+    return set(v for k, v in orm.Base._decl_class_registry.items()
+               if not k.startswith('_'))
+
+def get_app_models(app, registered=None):
+    """
+    Returns (name, class) pairs for all models defined in the given
+    app's models module
+    """
+    if registered is None:
+        registered = get_registered_classes()
+    registry = orm.Base._decl_class_registry
     app_models = []
     for k, v in vars(app).items():
-        if k not in orm.Base._decl_class_registry:
+        if k not in registry:
             continue
-        if v not in orm.Base._decl_class_registry.values():
+        if v not in registered:
             continue
         if hasattr(app, '__package__') and app.__package__ + '.models' != v.__module__:
             continue
         app_models.append( (k,v) )
-    if not app_models:
-        return
+    return app_models
 
-    try:
-        Permission = getattr(auth_app, 'Permission')
-    except:
-        return
-
-    searched_perms = list()
-    ctypes = set()
-    searched_codenames = set()
-    for k, klass in sorted(app_models, key=lambda x: x[0]):
-        if klass.__mapper__.polymorphic_on is not None:
-            if has_inherited_table(klass):
-                # ignore polymorphic subclasses
+def get_permission_models(apps):
+    """
+    Returns all models in the given apps which generate permissions
+    """
+    registered = get_registered_classes()
+    models = []
+    for app in apps:
+        app_models = get_app_models(app, registered)
+        for k, klass in sorted(app_models, key=lambda x: x[0]):
+            if klass.__mapper__.polymorphic_on is not None:
+                if has_inherited_table(klass):
+                    # ignore polymorphic subclasses
+                    continue
+            elif klass.__subclasses__():
+                # ignore base if subclass is present
                 continue
-        elif klass.__subclasses__():
-            # ignore base if subclass is present
-            continue
-        if not klass._meta.permission_resources:
-            # no resource types
-            continue
-
-        ctypes.update(klass._meta.permission_resources)
-        for perm in _get_all_permissions(klass._meta):
-            if perm['codename'] in searched_codenames:
+            if not klass._meta.permission_resources:
+                # no resource types
                 continue
-            searched_perms.append(perm)
-            searched_codenames.add(perm['codename'])
-
-    if not ctypes:
-        return
-    #connection = connections[db]
-    session = orm.sessionmaker()
+            models.append(klass)
+    return models
 
-    all_perms = session.query(Permission.codename) \
-                       .filter(Permission.resource.in_(ctypes)) \
-                       .all()
-    all_perms = set([perm[0] for perm in all_perms])
+def get_permissions(apps):
+    """
+    Returns a list of permission dicts for all models in the given apps,
+    unique by codename
+    """
+    perms = []
+    codenames = set()
+    for klass in get_permission_models(apps):
+        for perm in get_model_permissions(klass):
+            if perm['codename'] in codenames:
+                continue
+            perms.append(perm)
+            codenames.add(perm['codename'])
+    return perms
 
-    perms = [
-        perm for perm in searched_perms
-        if perm['codename'] not in all_perms
-        ]
+def sync_permissions(perms, verbosity=1):
+    """
+    Inserts any of the given permissions which don't exist yet, using a
+    single query for existing codenames and a single executemany insert.
+    Returns the list of inserted permissions
+    """
+    try:
+        Permission = getattr(auth_app, 'Permission')
+    except:
+        return []
+    if not perms:
+        return []
 
-    session.execute(Permission.__table__.insert(), perms)
-    session.flush()
+    session = orm.sessionmaker()
+    existing = set(row[0] for row in session.query(Permission.codename))
+    new_perms = [perm for perm in perms if perm['codename'] not in existing]
+    if new_perms:
+        session.execute(Permission.__table__.insert(), new_perms)
+        session.flush()
 
     if verbosity >= 2:
-        for perm in perms:
+        for perm in new_perms:
             print("Adding permission '%s:%s'" % (perm['resource'],
                                                  perm['codename']))
+    return new_perms
+
+def create_permissions(app, created_models, verbosity, db=DEFAULT_DB_ALIAS,
+                       **kwargs):
+    return sync_permissions(get_permissions([app]), verbosity)
+
+def get_permission_fingerprint():
+    """
+    Returns a hash of all model metadata which can affect permission
+    generation: permission options, model names (used in codenames and
+    keys), primary keys, column attributes with their foreign keys, and
+    relationships
+    """
+    data = []
+    for klass in sorted(get_registered_classes(), key=lambda x: x.__name__):
+        mapper_ = inspect(klass)
+        columns = []
+        for prop in mapper_.column_attrs:
+            columns.append((prop.key, [
+                (getattr(col, 'name', None),
+                 sorted(fk.target_fullname
+                        for fk in getattr(col, 'foreign_keys', ())))
+                for col in prop.columns]))
+        rels = []
+        for rel in mapper_.relationships:
+            rels.append((rel.key, rel.direction.name, rel.mapper.class_.__name__,
+                         [(l.name, r.name) for l, r in rel.local_remote_pairs]))
+        data.append({
+            'name': klass.__name__,
+            'model_name': klass._meta.model_name,
+            'meta': dict((attr, getattr(klass._meta, attr, None))
+                         for attr in PERMISSION_META_ATTRS),
+            'pk': [col.name for col in mapper_.primary_key],
+            'columns': sorted(columns),
+            'relationships': sorted(rels),
+            })
+    raw = json.dumps(data, sort_keys=True, default=repr)
+    return hashlib.sha1(raw.encode('utf8')).hexdigest()
+
+def write_permission_manifest(path, perms):
+    " writes a manifest of generated permissions, for use during deploys "
+    manifest = {
+        'fingerprint': get_permission_fingerprint(),
+        'permissions': perms,
+        }
+    with open(path, 'w') as fp:
+        json.dump(manifest, fp, indent=1, sort_keys=True)
+
+def read_permission_manifest(path):
+    """
+    Returns the permissions stored in a manifest, or None if the manifest
+    is missing or the models have changed since it was generated
+    """
+    try:
+        with open(path) as fp:
+            manifest = json.load(fp)
+    except (IOError, ValueError):
+        return None
+    if manifest.get('fingerprint') != get_permission_fingerprint():
+        return None
+    return manifest['permissions']
 
 '''
 def create_superuser(app, created_models, verbosity, db, **kwargs):
@@ -7,7 +7,8 @@ from django.core.management import call_command
 from django.core.management.color import no_style
 from django.utils.importlib import import_module
 
-from baph.auth.management import create_permissions
+from baph.auth.management import (get_permissions, read_permission_manifest,
+  sync_permissions, write_permission_manifest)
 from baph.auth.models import Permission, PermissionAssociation
 from baph.core.management.new_base import BaseCommand, CommandError
 from baph.db.models import get_apps
@@ -23,18 +24,48 @@ class Command(BaseCommand):
       default=False,
       help='Flushes all existing permissions before population',
     )
+    parser.add_argument(
+      '--manifest', action='store', dest='manifest', default=None,
+      help='Path to a permission manifest. If the manifest matches the '
+           'current models, permissions are read from it instead of being '
+           'regenerated',
+    )
+    parser.add_argument(
+      '--write-manifest', action='store_true', dest='write_manifest',
+      default=False,
+      help='Regenerate permissions and write them to the --manifest path',
+    )
 
   def handle(self, **options):
     verbosity = int(options.get('verbosity', 1))
     interactive = options.get('interactive')
     flush = options.get('flush')
+    manifest = options.get('manifest')
+    write_manifest = options.get('write_manifest')
     self.style = no_style()
 
+    if write_manifest and not manifest:
+      raise CommandError('--write-manifest requires --manifest')
+
+    perms = None
+    if manifest and not write_manifest:
+      perms = read_permission_manifest(manifest)
+      if perms is None:
+        self.stderr.write('Permission manifest %s is missing or out of date; '
+                          'regenerating permissions' % manifest)
+    if perms is None:
+      perms = get_permissions(get_apps())
+    if write_manifest:
+      write_permission_manifest(manifest, perms)
+      if verbosity >= 1:
+        self.stdout.write('Wrote %d permissions to %s' % (len(perms), manifest))
+
     session = orm.sessionmaker()
     if flush:
       # clear existing permissions
       session.execute(Permission.__table__.delete())
-    for app in get_apps():
-      create_permissions(app, [], verbosity)
+    new_perms = sync_permissions(perms, verbosity)
     session.commit()
     session.close()
+    if verbosity >= 1:
+      self.stdout.write('Added %d permissions' % len(new_perms))
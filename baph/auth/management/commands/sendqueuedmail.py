@@ -0,0 +1,55 @@
+import time
+
+from baph.auth.registration import settings as auth_settings
+from baph.auth.registration.models import QueuedEmail
+from baph.core.management.new_base import BaseCommand
+
+
+class Command(BaseCommand):
+  help = ('Sends the emails in the outbound queue (see BAPH_EMAIL_QUEUE). '
+          'Several workers may run at once.')
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      '--batch-size', action='store', dest='batch_size', type=int,
+      default=auth_settings.BAPH_EMAIL_QUEUE_BATCH_SIZE,
+      help='The number of emails sent over each connection',
+    )
+    parser.add_argument(
+      '--loop', action='store_true', dest='loop', default=False,
+      help='Keep polling the queue instead of exiting once it is empty',
+    )
+    parser.add_argument(
+      '--interval', action='store', dest='interval', type=float, default=5,
+      help='Seconds to wait between polls of an empty queue with --loop',
+    )
+
+  def handle(self, **options):
+    verbosity = int(options.get('verbosity', 1))
+    batch_size = options.get('batch_size')
+    loop = options.get('loop')
+    interval = options.get('interval')
+
+    total_sent = total_failed = 0
+    while True:
+      sent, failed = QueuedEmail.send_pending(batch_size)
+      total_sent += sent
+      total_failed += failed
+      if verbosity >= 2 and (sent or failed):
+        self.stdout.write('Sent %d queued emails (%d failed)'
+                          % (sent, failed))
+      if sent + failed >= batch_size:
+        # the batch was full, there may be more pending
+        continue
+      if not loop:
+        break
+      time.sleep(interval)
+
+    if verbosity >= 1:
+      self.stdout.write('Sent %d queued emails (%d failed)'
+                        % (total_sent, total_failed))
+    abandoned = QueuedEmail.get_failed().count()
+    if abandoned:
+      max_attempts = auth_settings.BAPH_EMAIL_QUEUE_MAX_ATTEMPTS
+      self.stderr.write('%d queued emails failed %d times and will not be '
+                        'retried' % (abandoned, max_attempts))
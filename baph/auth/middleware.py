@@ -9,7 +9,13 @@ def get_user(request):
   return request._cached_user
 
 def set_lazy_user(request):
+  """
+  Sets request.user to an object which resolves the user on first use. With
+  BAPH_AUTH_USER_CACHE enabled, the user resolves to a CachedUser, which
+  only queries the database for attributes missing from its snapshot
+  """
   request.user = SimpleLazyObject(lambda: get_user(request))
+  return request.user
 
 class AuthenticationMiddleware(object):
   def process_request(self, request):
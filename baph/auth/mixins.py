@@ -2,6 +2,7 @@ import json
 import logging
 
 from django.conf import settings
+from functools32 import lru_cache
 from sqlalchemy import *
 from sqlalchemy import inspect
 from sqlalchemy.ext.declarative.clsregistry import _class_resolver
@@ -9,7 +10,8 @@ from sqlalchemy.orm import lazyload
 
 from baph.db import ORM
 from baph.db.models.loading import cache
-from baph.db.models.utils import class_resolver, column_to_attr, key_to_value
+from baph.db.models.utils import (chunked, class_resolver, column_to_attr,
+    key_to_value, keys_to_values)
 
 
 logger = logging.getLogger('authorization')
@@ -46,6 +48,112 @@ def string_to_model(string):
         # this string doesn't match a resource
         return None
 
+def get_permission_signature(perms):
+    """
+    Returns a hashable summary of the filterable permissions in perms. This
+    acts as the permission version when caching compiled filters, so users
+    with identical permissions share compiled expressions
+    """
+    return tuple(sorted(set((p.key, p.value, p.opcode, p._deny)
+                            for p in perms if p.key)))
+
+def get_join_target(cls, target):
+    """
+    Returns the relation of cls which leads to target, or target itself
+    (for a join on the foreign keys) if cls has no such relation. Raises
+    an exception if more than one relation leads to target
+    """
+    props = [prop for prop in inspect(cls).relationships
+             if issubclass(prop.mapper.class_, target)]
+    if len(props) > 1:
+        raise Exception('%s has more than one relation to %s (%s); '
+                        'translate the filter key to a relation path '
+                        'instead' % (cls.__name__, target.__name__,
+                                     ', '.join(sorted(p.key for p in props))))
+    if props:
+        return getattr(cls, props[0].key)
+    return target
+
+def resolve_filter_column(resource, key, joins, seen):
+    """
+    Resolves a (possibly dotted) permission key into a column. Relations
+    traversed from the resource class are appended to joins. Keys which
+    filter_translations maps to another class ('Class.key') also add a
+    join to that class, before the relations traversed from it. Keys
+    may also be translated to a relation path of the resource class
+    ('relation.key'), which is required when it has several relations
+    to the same class
+    """
+    from baph.db.orm import Base
+    cls = Base._decl_class_registry[resource]
+    lookup = resource
+    if key in cls._meta.filter_translations:
+        translation = cls._meta.filter_translations[key]
+        prefix, rest = translation.split('.', 1)
+        if prefix in Base._decl_class_registry:
+            lookup, key = prefix, rest
+        else:
+            key = translation
+    cls_ = Base._decl_class_registry[lookup]
+    if cls_ is not cls and (cls_, None) not in seen:
+        seen.add((cls_, None))
+        joins.append(get_join_target(cls, cls_))
+
+    frags = key.split('.')
+    attr = frags.pop()
+    for frag in frags:
+        if (cls_, frag) not in seen:
+            seen.add((cls_, frag))
+            joins.append(getattr(cls_, frag))
+        cls_ = cls_.get_related_class(frag)
+    return getattr(cls_, attr)
+
+@lru_cache(maxsize=1024)
+def compile_resource_filters(resource, signature):
+    """
+    Compiles a permission signature (see get_permission_signature) into a
+    single filter expression, and the joins required by dotted keys.
+    Single-key permissions sharing a key are merged into one IN clause
+    """
+    joins = []
+    seen = set()
+    merged = {}
+    filters = []
+    for key, value, opcode, deny in signature:
+        keys = key.split(',')
+        if opcode == 'in':
+            # range filter
+            values = [json.loads(value)]
+        else:
+            # exact filter
+            values = value.split(',')
+
+        if len(keys) == 1:
+            values = values[0] if opcode == 'in' else values[:1]
+            merged.setdefault((key, deny), []).extend(values)
+            continue
+
+        clauses = []
+        for key_, value_ in zip(keys, values):
+            col = resolve_filter_column(resource, key_, joins, seen)
+            if opcode == 'in':
+                clauses.append(col.in_(value_))
+            else:
+                clauses.append(col==value_)
+        filters.append((and_(*clauses), deny))
+
+    for (key, deny), values in sorted(merged.items()):
+        col = resolve_filter_column(resource, key, joins, seen)
+        values = sorted(set(values))
+        if len(values) == 1:
+            filters.append((col==values[0], deny))
+        else:
+            filters.append((col.in_(values), deny))
+
+    final_filters = [not_(f) for f, deny in filters if deny]
+    final_filters.append(or_(*[f for f, deny in filters if not deny]))
+    return (and_(*final_filters), tuple(joins))
+
 class PermissionStruct:
     def __init__(self, **entries): 
         self.__dict__.update(entries)
@@ -203,8 +311,7 @@ class UserPermissionMixin(object):
         else:
             # if we have all 'protected' fks, we can evaluate without a
             # load. otherwise, we need to load to validate
-            for rel in cls._meta.permission_parents:
-                fk = tuple(getattr(cls, rel).property.local_columns)[0].name
+            for rel, fk in cls.get_permission_parent_keys():
                 if not any (key in filters for key in (rel, fk)):
                     requires_load = True
         
@@ -218,6 +325,273 @@ class UserPermissionMixin(object):
                 session.expunge(obj)
         return self.has_obj_perm(resource, action, obj)
 
+    def has_perms(self, resource, action, items):
+        """
+        Bulk version of has_perm/has_obj_perm. items is a list of filter
+        dicts and/or model instances; returns a list of booleans aligned
+        with items. Permission handler parents and dotted permission keys
+        are resolved with one query per relation hop, rather than per item,
+        and all items are evaluated against a single compiled permission set
+        """
+        if not items:
+            return []
+        if not self.is_authenticated():
+            return [False] * len(items)
+
+        perms = self.get_resource_permissions(resource, action)
+        if not perms:
+            return [False] * len(items)
+
+        orm = ORM.get()
+        cls_name = tuple(perms)[0].resource
+        cls = orm.Base._decl_class_registry[cls_name]
+        objs = self.get_perm_objects(cls, action, items)
+        return self.has_obj_perms(resource, action, objs)
+
+    def get_perm_objects(self, cls, action, items, chunk_size=500):
+        """
+        Converts a list of filter dicts and/or instances into a list of
+        instances, as has_perm would. Filters which include all permission
+        parent keys are evaluated against transient instances. Filters on
+        the primary key alone are loaded with one IN query per chunk, and
+        any other filter loads its first match, as has_perm does
+        """
+        orm = ORM.get()
+        session = orm.sessionmaker()
+        parent_keys = cls.get_permission_parent_keys()
+        pk_cols = inspect(cls).primary_key
+        pk_attr = column_to_attr(cls, pk_cols[0]) \
+            if len(pk_cols) == 1 else None
+
+        objs = list(items)
+        by_pk = {}
+        by_filter = {}
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            if action != 'add' and not all(
+                    any(key in item for key in keys) for keys in parent_keys):
+                objs[i] = None
+                if pk_attr is not None and item.keys() == [pk_attr.key]:
+                    by_pk.setdefault(unicode(item[pk_attr.key]), []).append(i)
+                else:
+                    # identical filters are only loaded once
+                    key = tuple(sorted(item.items()))
+                    try:
+                        hash(key)
+                    except TypeError:
+                        key = i
+                    by_filter.setdefault(key, (item, []))[1].append(i)
+                continue
+            obj = cls(**item)
+            if obj in session:
+                session.expunge(obj)
+            objs[i] = obj
+
+        for chunk in chunked(sorted(by_pk), chunk_size):
+            query = session.query(cls).filter(pk_attr.in_(chunk))
+            for obj in query:
+                for i in by_pk.get(unicode(getattr(obj, pk_attr.key)), []):
+                    objs[i] = obj
+
+        for filters, indexes in by_filter.values():
+            obj = session.query(cls).filter_by(**filters).first()
+            for i in indexes:
+                objs[i] = obj
+        return objs
+
+    def has_obj_perms(self, resource, action, objs):
+        """
+        Bulk version of has_obj_perm; returns a list of booleans aligned
+        with objs. Missing objects (None) are denied
+        """
+        results = [False] * len(objs)
+        by_type = {}
+        for i, obj in enumerate(objs):
+            if obj is not None:
+                by_type.setdefault(type(obj), []).append(i)
+
+        for obj_cls, indexes in by_type.items():
+            handler = obj_cls._meta.permission_handler
+            if handler:
+                # permissions for these objects are based off parent objects
+                parents = keys_to_values([objs[i] for i in indexes], handler,
+                                         raw=True)
+                parent_action = action if action == 'view' else 'edit'
+                by_resource = {}
+                for i, parent in zip(indexes, parents):
+                    if not parent:
+                        # nothing to check perms against, assume True
+                        results[i] = True
+                        continue
+                    by_resource.setdefault(type(parent).resource_name, []) \
+                        .append((i, parent))
+                for parent_res, pairs in by_resource.items():
+                    allowed = self.has_obj_perms(parent_res, parent_action,
+                                                 [p for i, p in pairs])
+                    for (i, parent), value in zip(pairs, allowed):
+                        results[i] = value
+                continue
+
+            compiled = self.compile_perm_map(resource, action, obj_cls)
+            if compiled is None:
+                continue
+            perm_map = compiled[0]
+            cls_objs = [objs[i] for i in indexes]
+
+            # resolve every key required by the permission set in bulk
+            key_values = {}
+            for (k, deny), allowed_values in perm_map.items():
+                if allowed_values == set([None]) or k in key_values:
+                    continue
+                pieces = [keys_to_values(cls_objs, key) for key in k.split(',')]
+                key_values[k] = zip(*pieces)
+
+            for n, i in enumerate(indexes):
+                values = dict((k, v[n]) for k, v in key_values.items())
+                results[i] = self.evaluate_perm_map(compiled, action, values)
+        return results
+
+    def compile_perm_map(self, resource, action, obj_cls):
+        """
+        Collects the permissions for a resource/action into a tuple of
+        (perm_map, explicit keys, boolean matches), which can be evaluated
+        against any number of objects of type obj_cls. Returns None if
+        the user has no valid permissions, or a boolean deny applies
+        """
+        ctx = self.get_context()
+        logger.debug('perm context: %s' % ctx)
+
+        perms = self.get_resource_permissions(resource, action)
+        if not perms:
+            # user has no valid permissions for this resource/action pair
+            logger.debug('[INVALID] user has no valid permissions')
+            return None
+
+        perm_map = {}
+        explicit = []
+        matches = {
+            'explicit_allow': [],
+            'explicit_deny': [],
+            'general_allow': [],
+            'general_deny': [],
+        }
+
+        for p in perms:
+            logger.debug('matched perm: %s' % p.codename)
+            logger.debug('  explicit: %s' % p._explicit)
+            logger.debug('  deny: %s' % p._deny)
+            logger.debug('  opcode: %s' % p.opcode)
+            logger.debug('  key: %r' % p.key)
+
+            mode1 = 'explicit' if p._explicit else 'general'
+            mode2 = 'deny' if p._deny else 'allow'
+            mode = '%s_%s' % (mode1, mode2)
+
+            if not p.key:
+                # this is a boolean permission (not a key/value filter)
+                if p._deny:
+                    return None
+                matches[mode].append(p.key)
+                continue
+
+            if p._explicit:
+                explicit.append(p.key)
+            if not (p.key, p._deny) in perm_map:
+                perm_map[(p.key, p._deny)] = set()
+
+            if p.opcode == 'in':
+                # this is a json-encoded list of values
+                values = json.loads(p.value)
+            else:
+                # this is a single value
+                values = [p.value]
+
+            # replace context variables
+            values = [str(value) % ctx for value in values]
+            logger.debug('  values: %r' % (values,))
+            perm_map[(p.key, p._deny)].update(values)
+
+        if action == 'add':
+            # add defaults for backref columns on parent objects
+            for p in obj_cls._meta.permission_parents:
+                logger.debug('checking permission parent: %r' % p)
+                attr = getattr(obj_cls, p)
+                prop = attr.property
+                col = prop.local_remote_pairs[0][0]
+                col_attr = column_to_attr(obj_cls, col)
+                logger.debug('  attr: %r' % col_attr.key)
+                if not (col_attr.key, False) in perm_map:
+                    perm_map[(col_attr.key, False)] = set([None])
+
+        return (perm_map, explicit, matches)
+
+    def evaluate_perm_map(self, compiled, action, key_values):
+        """
+        Evaluates a compiled permission set (from compile_perm_map)
+        against a single object. key_values maps each restricted permission
+        key to a tuple of the object's values for the key's components
+        """
+        perm_map, explicit, matches = compiled
+        matches = dict((mode, list(keys)) for mode, keys in matches.items())
+        errors = dict((mode, []) for mode in matches)
+
+        for (k, deny), allowed_values in perm_map.items():
+            logger.debug('testing perm key: %r' % k)
+            logger.debug('  allowed values: %r' % allowed_values)
+
+            mode1 = 'explicit' if k in explicit else 'general'
+            mode2 = 'deny' if deny else 'allow'
+            mode = '%s_%s' % (mode1, mode2)
+
+            if allowed_values == set([None]):
+                # no restriction on allowed values
+                logger.debug('  permission has no restrictions on values, ignoring')
+                continue
+
+            key_pieces = key_values[k]
+            if None in key_pieces:
+                # this object lacks the values required to form a key
+                # so this permission is irrelevant to the current obj
+                logger.debug('  object lacks all necessary keys, ignoring')
+                continue
+
+            value = ','.join(key_pieces)
+            if not value:
+                # no value to check
+                logger.debug('  object has no value to check, ignoring')
+                continue
+            logger.debug('  supplied value: %r' % value)
+
+            if str(value) in allowed_values:
+                # the provided value is one of the allowed values
+                matches[mode].append(k)
+            else:
+                # the provided value was not found in the allowed values
+                errors[mode].append(k)
+
+        if matches['explicit_deny']:
+            logger.debug('[DENY] explicit "deny" permission found')
+            return False
+        elif matches['explicit_allow']:
+            logger.debug('[ALLOW] explicit "allow" permission found')
+            return True
+        elif matches['general_deny']:
+            logger.debug('[DENY] "deny" permission found with no explicit override')
+            return False
+        elif not matches['general_allow']:
+            logger.debug('[DENY] no general "allow" permissions found')
+            return False
+        elif action != 'add':
+            logger.debug('[ALLOW] found general "allow" permission on non-add action')
+            return True
+        elif errors['general_allow']:
+            logger.debug('[DENY] add permission with negative match on "allow" permission')
+            return False
+        else:
+            logger.debug('[ALLOW] add permission with general "allow" and no negative matches')
+            return True
+
     def has_obj_perm(self, resource, action, obj):
       logger.debug('\nhas_obj_perm "%s %s" called for user %s'
           % (action, resource, self.id))
@@ -235,143 +609,27 @@ class UserPermissionMixin(object):
           action = 'edit'
         return self.has_obj_perm(parent_res, action, parent_obj)
 
-      ctx = self.get_context()
-      logger.debug('perm context: %s' % ctx)
-
-      perms = self.get_resource_permissions(resource, action)
-      if not perms:
-        # user has no valid permissions for this resource/action pair
-        logger.debug('[INVALID] user has no valid permissions')
+      compiled = self.compile_perm_map(resource, action, type(obj))
+      if compiled is None:
         return False
 
-      perm_map = {}
-      explicit = []
-
-      matches = {
-        'explicit_allow': [],
-        'explicit_deny': [],
-        'general_allow': [],
-        'general_deny': [],
-      }
-      errors = {
-        'explicit_allow': [],
-        'explicit_deny': [],
-        'general_allow': [],
-        'general_deny': [],
-      }
-
-      for p in perms:
-        logger.debug('matched perm: %s' % p.codename)
-        logger.debug('  explicit: %s' % p._explicit)
-        logger.debug('  deny: %s' % p._deny)
-        logger.debug('  opcode: %s' % p.opcode)
-        logger.debug('  key: %r' % p.key)
-
-        mode1 = 'explicit' if p._explicit else 'general'
-        mode2 = 'deny' if p._deny else 'allow'
-        mode = '%s_%s' % (mode1, mode2)
-
-        if not p.key:
-          # this is a boolean permission (not a key/value filter)
-          if p._deny:
-            return False
-          matches[mode].append(p.key)
-          continue
-
-        if p._explicit:
-          explicit.append(p.key)
-        if not (p.key, p._deny) in perm_map:
-          perm_map[(p.key, p._deny)] = set()
-
-        if p.opcode == 'in':
-          # this is a json-encoded list of values
-          values = json.loads(p.value)
-        else:
-          # this is a single value
-          values = [p.value]
-
-        # replace context variables
-        logger.debug('  values: %r' % (values,))
-        values = [str(value) % ctx for value in values]
-        logger.debug('  values: %r' % (values,))
-        perm_map[(p.key, p._deny)].update(values)
-
-      if action == 'add':
-        # add defaults for backref columns on parent objects
-        for p in type(obj)._meta.permission_parents:
-          logger.debug('checking permission parent: %r' % p)
-          attr = getattr(type(obj), p)
-          prop = attr.property
-          col = prop.local_remote_pairs[0][0]
-          col_attr = column_to_attr(type(obj), col)
-          logger.debug('  attr: %r' % col_attr.key)
-          if not (col_attr.key, False) in perm_map:
-            perm_map[(col_attr.key, False)] = set([None])
-      
-      for (k, deny), allowed_values in perm_map.items():
-        logger.debug('testing perm key: %r' % k)
-        logger.debug('  allowed values: %r' % allowed_values)
-        status = 'INVALID' if deny else 'VALID'
-
-        mode1 = 'explicit' if k in explicit else 'general'
-        mode2 = 'deny' if deny else 'allow'
-        mode = '%s_%s' % (mode1, mode2)
-
+      key_values = {}
+      for (k, deny), allowed_values in compiled[0].items():
         if allowed_values == set([None]):
-          # no restriction on allowed values
-          logger.debug('  permission has no restrictions on values, ignoring')
-          continue
-
-        keys = k.split(',')
-        key_pieces = [key_to_value(obj, key) for key in keys]
-
-        if None in key_pieces:
-          # this object lacks the values required to form a key
-          # so this permission is irrelevant to the current obj
-          logger.debug('  object lacks all necessary keys, ignoring')
           continue
-
-        value = ','.join(key_pieces)
-        if not value:
-          # no value to check
-          logger.debug('  object has no value to check, ignoring')
-          continue
-        logger.debug('  supplied value: %r' % value)
-
-        if str(value) in allowed_values:
-          # the provided value is one of the allowed values
-          matches[mode].append(k)
-        else:
-          # the provided value was not found in the allowed values
-          errors[mode].append(k)
-
-      if matches['explicit_deny']:
-        logger.debug('[DENY] explicit "deny" permission found')
-        return False
-      elif matches['explicit_allow']:
-        logger.debug('[ALLOW] explicit "allow" permission found')
-        return True
-      elif matches['general_deny']:
-        logger.debug('[DENY] "deny" permission found with no explicit override')
-        return False
-      elif not matches['general_allow']:
-        logger.debug('[DENY] no general "allow" permissions found')
-        return False
-      elif action != 'add':
-        logger.debug('[ALLOW] found general "allow" permission on non-add action')
-        return True
-      elif errors['general_allow']:
-        logger.debug('[DENY] add permission with negative match on "allow" permission')
-        return False
-      else:
-        logger.debug('[ALLOW] add permission with general "allow" and no negative matches')
-        return True
+        key_values[k] = tuple(key_to_value(obj, key) for key in k.split(','))
+      return self.evaluate_perm_map(compiled, action, key_values)
 
 
-    def get_resource_filters(self, resource, action='view'):
+    def get_resource_filters(self, resource, action='view', with_joins=False):
         """
         Returns resource filters in a format appropriate for 
         applying to an existing query
+
+        If with_joins is True, a (filters, joins) tuple is returned, where
+        joins are the relations (or, for translated keys, classes) which
+        must be joined (in order) for the filters on dotted keys to apply
+        without a cartesian product
         """
         orm = ORM.get()
         cls = orm.Base._decl_class_registry[resource]
@@ -380,57 +638,20 @@ class UserPermissionMixin(object):
             parent_cls = cls.get_related_class(cls._meta.permission_handler)
             if action != 'view':
                 action = 'edit'
-            return self.get_resource_filters(parent_cls.resource_name, action)
+            result = self.get_resource_filters(parent_cls.resource_name,
+                                               action, with_joins)
+            if not with_joins or result is False:
+                return result
+            filters, joins = result
+            handler = getattr(cls, cls._meta.permission_handler)
+            return (filters, (handler,) + joins)
 
-        ctx = self.get_context()
         perms = self.get_resource_permissions(resource, action)
         if not perms:
             return False
 
-        allow_filters = []
-        deny_filters = []
-        for p in perms:
-            if not p.key:
-                # this is a boolean permission, so cannot be applied as a filter
-                continue
-
-            keys = p.key.split(',')
-            if p.opcode == 'in':
-                # range filter
-                values = [json.loads(p.value)]
-            else:
-                # exact filter
-                values = p.value.split(',')
-
-            data = zip(keys, values)
-            
-            filters = []
-            for key, value in data:
-                if key in cls._meta.filter_translations:
-                    lookup, key = cls._meta.filter_translations[key].split('.',1)
-                else:
-                    lookup = resource
-                cls_ = orm.Base._decl_class_registry[lookup]
-
-                frags = key.split('.')
-                attr = frags.pop()
-                for frag in frags:
-                    cls_ = cls_.get_related_class(frag)
-
-                col = getattr(cls_, attr)
-                if p.opcode == 'in':
-                    filters.append(col.in_(value))
-                else:
-                    filters.append(col==value)
-            if len(filters) == 1:
-                filter_ = filters[0]
-            else:
-                filter_ = and_(*filters)
-            if p._deny:
-                deny_filters.append(not_(filter_))
-            else:
-                allow_filters.append(filter_)
-
-        final_filters = deny_filters[:]
-        final_filters.append(or_(*allow_filters))
-        return [and_(*final_filters)]
\ No newline at end of file
+        signature = get_permission_signature(perms)
+        filter_, joins = compile_resource_filters(resource, signature)
+        if with_joins:
+            return ([filter_], joins)
+        return [filter_]
@@ -1,3 +1,6 @@
+from sqlalchemy import event
+
+from baph.auth.cache import record_permission_change
 from .permission import Permission
 print 'Permission imported'
 from .organization import Organization
@@ -9,3 +12,8 @@ print 'User imported'
 from .usergroup import UserGroup
 from .permissionassociation import PermissionAssociation
 from .oauth_ import OAuthConsumer, OAuthNonce
+
+
+for cls in (Organization, Group, UserGroup, Permission, PermissionAssociation):
+    for identifier in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(cls, identifier, record_permission_change)
@@ -1,10 +1,14 @@
+import hashlib
+
 from django.conf import settings
 from oauth import oauth
 from sqlalchemy import (Column, DateTime, ForeignKey, Integer, String,
-                        UniqueConstraint)
-from sqlalchemy.orm import relationship
+                        UniqueConstraint, event, select)
+from sqlalchemy.orm import attributes, relationship
 
+from baph.auth.models.organization import Organization
 from baph.auth.models.user import User
+from baph.core.cache.utils import get_cache
 from baph.db import ORM
 
 
@@ -32,6 +36,15 @@ class OAuthConsumer(Base):
         '''
         return oauth.OAuthConsumer(self.key, self.secret)
 
+    @staticmethod
+    def get_cache_key(key):
+        '''Returns the cache key under which the consumers with the given
+        consumer key are cached (see ``OAUTH_CONSUMER_CACHE``).
+        '''
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return 'oauth_consumer_%s' % hashlib.sha1(key).hexdigest()
+
 
 class OAuthNonce(Base):
     __tablename__ = 'auth_oauth_nonce'
@@ -44,3 +57,44 @@ class OAuthNonce(Base):
     token_key = Column(String(32))
     consumer_key = Column(String(MAX_KEY_LEN), nullable=False)
     key = Column(String(255), nullable=False)
+
+
+@event.listens_for(OAuthConsumer, 'after_insert')
+@event.listens_for(OAuthConsumer, 'after_update')
+@event.listens_for(OAuthConsumer, 'after_delete')
+def kill_consumer_cache(mapper, connection, target):
+    cache_alias = getattr(settings, 'OAUTH_CONSUMER_CACHE', None)
+    if not cache_alias:
+        return
+    history = attributes.get_history(target, 'key')
+    keys = set(history.added) | set(history.unchanged) | set(history.deleted)
+    keys.discard(None)
+    if keys:
+        get_cache(cache_alias).delete_many(
+            [OAuthConsumer.get_cache_key(key) for key in keys])
+
+def kill_user_consumer_cache(connection, user):
+    '''Removes the cached consumers of user, which include its organization
+    and superuser status (see ``OAUTH_CONSUMER_CACHE``).
+    '''
+    cache_alias = getattr(settings, 'OAUTH_CONSUMER_CACHE', None)
+    if not cache_alias:
+        return
+    keys = set(row[0] for row in connection.execute(
+        select([OAuthConsumer.key]).where(OAuthConsumer.id == user.id)))
+    keys.discard(None)
+    if keys:
+        get_cache(cache_alias).delete_many(
+            [OAuthConsumer.get_cache_key(key) for key in keys])
+
+@event.listens_for(User, 'after_update', propagate=True)
+def user_updated(mapper, connection, target):
+    for key in (Organization.get_column_key(), 'is_superuser'):
+        if attributes.get_history(target, key).has_changes():
+            kill_user_consumer_cache(connection, target)
+            return
+
+@event.listens_for(User, 'before_delete', propagate=True)
+def user_deleted(mapper, connection, target):
+    # before the consumers can be removed by the database
+    kill_user_consumer_cache(connection, target)
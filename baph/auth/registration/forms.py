@@ -13,6 +13,7 @@ from django.contrib.auth import authenticate
 from django.utils.translation import ugettext_lazy as _
 from sqlalchemy.orm import joinedload
 
+from baph.auth.cache import CachedUser
 from baph.auth.models import User, Organization
 from baph.auth.registration import settings
 from baph.auth.registration.managers import SignupManager
@@ -210,6 +211,9 @@ class ChangeEmailForm(forms.Form):
 
         """
         super(ChangeEmailForm, self).__init__(*args, **kwargs)
+        if isinstance(user, CachedUser):
+            # the email change is saved on the user instance
+            user = user.get_instance()
         if not isinstance(user, User):
             raise TypeError, "user must be an instance of %s" % User._meta.model_name
         else: self.user = user
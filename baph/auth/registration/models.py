@@ -1,8 +1,10 @@
 import datetime
+import logging
+import uuid
 
 from coffin.shortcuts import render_to_string
 from django.conf import settings as django_settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection, send_mail
 from sqlalchemy import *
 from sqlalchemy.orm import relationship, backref, joinedload
 
@@ -11,10 +13,23 @@ from baph.auth.registration import settings
 from baph.auth.registration.utils import get_protocol
 from baph.auth.utils import generate_sha1
 from baph.db import ORM
+from baph.db.types import Json
 
 
 orm = ORM.get()
 Base = orm.Base
+logger = logging.getLogger(__name__)
+
+
+def render_email(subject_template, message_template, context):
+    """
+    Renders an email, returning the subject (on a single line) and message.
+
+    """
+    subject = render_to_string(subject_template, context)
+    subject = ''.join(subject.splitlines())
+    message = render_to_string(message_template, context)
+    return subject, message
 
 class UserRegistration(Base):
     __tablename__ = 'baph_auth_user_registration'
@@ -53,6 +68,40 @@ class UserRegistration(Base):
             return True
         return False
 
+    def get_email_context(self, **kwargs):
+        """
+        Returns the template context shared by registration emails. The
+        user and organization are included by id, so the context can be
+        stored with queued emails.
+
+        """
+        context = {'user_id': self.user_id,
+                   'org_id': Organization.get_current_id(),
+                   'without_usernames': settings.BAPH_AUTH_WITHOUT_USERNAMES,
+                   'protocol': get_protocol(),
+                   }
+        context.update(kwargs)
+        return context
+
+    def send_email(self, subject_template, message_template, recipient,
+                   context):
+        """
+        Sends an email to ``recipient``, or adds it to the outbound queue
+        if ``BAPH_EMAIL_QUEUE`` is enabled.
+
+        """
+        if settings.BAPH_EMAIL_QUEUE:
+            QueuedEmail.enqueue(subject_template, message_template,
+                                recipient, context)
+            return
+        context = dict(context, user=self.user, org=Organization.get_current())
+        subject, message = render_email(subject_template, message_template,
+                                        context)
+        send_mail(subject,
+                  message,
+                  django_settings.DEFAULT_FROM_EMAIL,
+                  [recipient, ])
+
     def send_activation_email(self):
         """
         Sends a activation email to the user.
@@ -61,24 +110,12 @@ class UserRegistration(Base):
         user.
 
         """
-        context = {'user': self.user,
-                  'without_usernames': settings.BAPH_AUTH_WITHOUT_USERNAMES,
-                  'protocol': get_protocol(),
-                  'activation_days': settings.BAPH_ACTIVATION_DAYS,
-                  'activation_key': self.activation_key,
-                  'org': Organization.get_current(),
-                  }
-
-        subject = render_to_string('registration/emails/activation_email_subject.txt',
-                                   context)
-        subject = ''.join(subject.splitlines())
-
-        message = render_to_string('registration/emails/activation_email_message.txt',
-                                   context)
-        send_mail(subject,
-                  message,
-                  django_settings.DEFAULT_FROM_EMAIL,
-                  [self.user.email, ])
+        context = self.get_email_context(
+            activation_days=settings.BAPH_ACTIVATION_DAYS,
+            activation_key=self.activation_key)
+        self.send_email('registration/emails/activation_email_subject.txt',
+                        'registration/emails/activation_email_message.txt',
+                        self.user.email, context)
 
     def send_confirmation_email(self):
         """
@@ -92,39 +129,22 @@ class UserRegistration(Base):
         a request is made to change this email address.
 
         """
-        context = {'user': self.user,
-                  'without_usernames': settings.BAPH_AUTH_WITHOUT_USERNAMES,
-                  'new_email': self.email_unconfirmed,
-                  'protocol': get_protocol(),
-                  'confirmation_key': self.email_confirmation_key,
-                  'org': Organization.get_current(),
-                  }
+        context = self.get_email_context(
+            new_email=self.email_unconfirmed,
+            confirmation_key=self.email_confirmation_key)
 
         # Email to the old address, if present
-        subject_old = render_to_string(
-            'registration/emails/confirmation_email_subject_old.txt', context)
-        subject_old = ''.join(subject_old.splitlines())
-
-        message_old = render_to_string(
-            'registration/emails/confirmation_email_message_old.txt', context)
         if self.user.email:
-            send_mail(subject_old,
-                      message_old,
-                      django_settings.DEFAULT_FROM_EMAIL,
-                    [self.user.email])
+            self.send_email(
+                'registration/emails/confirmation_email_subject_old.txt',
+                'registration/emails/confirmation_email_message_old.txt',
+                self.user.email, context)
 
         # Email to the new address
-        subject_new = render_to_string(
-            'registration/emails/confirmation_email_subject_new.txt', context)
-        subject_new = ''.join(subject_new.splitlines())
-
-        message_new = render_to_string(
-            'registration/emails/confirmation_email_message_new.txt', context)
-
-        send_mail(subject_new,
-                  message_new,
-                  django_settings.DEFAULT_FROM_EMAIL,
-                  [self.email_unconfirmed, ])
+        self.send_email(
+            'registration/emails/confirmation_email_subject_new.txt',
+            'registration/emails/confirmation_email_message_new.txt',
+            self.email_unconfirmed, context)
 
     def change_email(self, email):
         """
@@ -154,3 +174,213 @@ class UserRegistration(Base):
         session = orm.sessionmaker()
         session.add(self)
         session.commit()
+
+
+class QueuedEmail(Base):
+    """
+    An email in the outbound queue. Queued emails are rendered and sent by
+    the ``sendqueuedmail`` command, outside of the request which created
+    them. Failed emails are retried with an exponential backoff, up to
+    ``BAPH_EMAIL_QUEUE_MAX_ATTEMPTS`` times.
+
+    Workers claim a batch of emails before sending it, so concurrent
+    workers never send the same email. A claim expires after
+    ``BAPH_EMAIL_QUEUE_CLAIM_TIMEOUT`` seconds, so emails claimed by a
+    worker which died are picked up again.
+
+    """
+    __tablename__ = 'baph_auth_queued_email'
+    __table_args__ = (
+        Index('idx_queued_email_pending', 'sent', 'next_attempt'),
+        )
+    id = Column(Integer, primary_key=True)
+    subject_template = Column(String(255), nullable=False)
+    message_template = Column(String(255), nullable=False)
+    recipient = Column(String(255), nullable=False)
+    context = Column(Json)
+    created = Column(DateTime, default=datetime.datetime.now, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt = Column(DateTime, default=datetime.datetime.now,
+                          nullable=False)
+    sent = Column(DateTime)
+    last_error = Column(Text)
+    claimed_by = Column(String(32), index=True)
+    claimed_until = Column(DateTime)
+
+    @classmethod
+    def enqueue(cls, subject_template, message_template, recipient, context):
+        email = cls(subject_template=subject_template,
+                    message_template=message_template,
+                    recipient=recipient,
+                    context=context)
+        session = orm.sessionmaker()
+        session.add(email)
+        session.commit()
+        return email
+
+    @classmethod
+    def get_pending_filters(cls, now):
+        """
+        Returns the filters matching unsent, unclaimed emails which are due
+        to be (re)tried.
+
+        """
+        return and_(cls.sent == None,
+                    cls.next_attempt <= now,
+                    cls.attempts < settings.BAPH_EMAIL_QUEUE_MAX_ATTEMPTS,
+                    or_(cls.claimed_until == None, cls.claimed_until < now))
+
+    @classmethod
+    def claim_pending(cls, limit=None):
+        """
+        Claims up to ``limit`` pending emails, and returns them. The claim
+        is made by a single conditional UPDATE, so emails claimed by another
+        worker in the meantime are skipped.
+
+        """
+        session = orm.sessionmaker()
+        now = datetime.datetime.now()
+        filters = cls.get_pending_filters(now)
+        query = session.query(cls.id) \
+            .filter(filters) \
+            .order_by(cls.next_attempt, cls.id) \
+            .limit(limit or settings.BAPH_EMAIL_QUEUE_BATCH_SIZE)
+        ids = [id for (id,) in query]
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        timeout = datetime.timedelta(
+            seconds=settings.BAPH_EMAIL_QUEUE_CLAIM_TIMEOUT)
+        session.query(cls) \
+            .filter(cls.id.in_(ids)) \
+            .filter(filters) \
+            .update({cls.claimed_by: token, cls.claimed_until: now + timeout},
+                    synchronize_session=False)
+        session.commit()
+        return session.query(cls) \
+            .filter(cls.claimed_by == token) \
+            .order_by(cls.next_attempt, cls.id) \
+            .all()
+
+    @classmethod
+    def get_failed(cls):
+        """
+        Returns a query for the unsent emails which have used all of their
+        attempts, and will not be retried.
+
+        """
+        session = orm.sessionmaker()
+        return session.query(cls) \
+            .filter(cls.sent == None) \
+            .filter(cls.attempts >= settings.BAPH_EMAIL_QUEUE_MAX_ATTEMPTS)
+
+    def get_context(self):
+        """
+        Returns the template context, with the user and organization ids
+        resolved into objects.
+
+        """
+        session = orm.sessionmaker()
+        context = dict(self.context or {})
+        user_id = context.get('user_id')
+        org_id = context.get('org_id')
+        context['user'] = session.query(User).get(user_id) if user_id else None
+        context['org'] = session.query(Organization).get(org_id) \
+            if org_id else None
+        return context
+
+    def build_message(self, connection=None):
+        subject, message = render_email(self.subject_template,
+                                        self.message_template,
+                                        self.get_context())
+        return EmailMessage(subject, message,
+                            django_settings.DEFAULT_FROM_EMAIL,
+                            [self.recipient], connection=connection)
+
+    def release(self):
+        self.claimed_by = None
+        self.claimed_until = None
+
+    def mark_sent(self):
+        self.sent = datetime.datetime.now()
+        self.release()
+
+    def save_result(self, token):
+        """
+        Writes the result of a send attempt, if the claim made with ``token``
+        is still held. If the claim expired and the email was claimed by
+        another worker, the result is discarded and False is returned.
+
+        """
+        cls = type(self)
+        session = orm.sessionmaker()
+        values = dict((getattr(cls, key), getattr(self, key))
+                      for key in ('sent', 'attempts', 'last_error',
+                                  'next_attempt', 'claimed_by',
+                                  'claimed_until'))
+        id = self.id
+        session.expire(self)
+        rows = session.query(cls) \
+            .filter(cls.id == id) \
+            .filter(cls.claimed_by == token) \
+            .update(values, synchronize_session=False)
+        session.commit()
+        return rows > 0
+
+    def mark_failed(self, error):
+        self.attempts += 1
+        self.last_error = error
+        self.release()
+        if self.attempts >= settings.BAPH_EMAIL_QUEUE_MAX_ATTEMPTS:
+            logger.error('Giving up on queued email %s to %s after %d '
+                         'attempts: %s' % (self.id, self.recipient,
+                                           self.attempts, error))
+            return
+        delay = settings.BAPH_EMAIL_QUEUE_RETRY_DELAY * 2 ** (self.attempts - 1)
+        self.next_attempt = datetime.datetime.now() \
+            + datetime.timedelta(seconds=delay)
+
+    @classmethod
+    def send_pending(cls, limit=None, connection=None):
+        """
+        Claims, renders and sends a batch of pending emails over a single
+        connection. Each result is committed as soon as it is known, unless
+        the claim has been taken over by another worker. Sending stops when
+        the claim expires. Returns the number of emails sent and failed.
+
+        """
+        emails = cls.claim_pending(limit)
+        if not emails:
+            return 0, 0
+        connection = connection or get_connection()
+        sent = failed = 0
+        connection.open()
+        try:
+            for email in emails:
+                token = email.claimed_by
+                if email.claimed_until <= datetime.datetime.now():
+                    # the rest of the batch may be claimed by another worker
+                    logger.warning('Claim on queued emails expired after '
+                                   'sending %d of %d' % (sent + failed,
+                                                         len(emails)))
+                    break
+                try:
+                    email.build_message(connection).send()
+                except Exception as e:
+                    logger.warning('Unable to send queued email %s to %s: %s'
+                                   % (email.id, email.recipient, e))
+                    email.mark_failed('%s: %s' % (type(e).__name__, e))
+                    failed += 1
+                    # the connection may be broken. closing it makes the
+                    # next send open a new one
+                    connection.close()
+                else:
+                    email.mark_sent()
+                    sent += 1
+                if not email.save_result(token):
+                    logger.warning('Queued email %s was claimed by another '
+                                   'worker; its result was discarded'
+                                   % email.id)
+        finally:
+            connection.close()
+        return sent, failed
@@ -108,3 +108,27 @@ BAPH_PROFILE_LIST_TEMPLATE = getattr(
     settings, 'BAPH_PROFILE_LIST_TEMPLATE', 'BAPH/profile_list.html')
 
 BAPH_HIDE_EMAIL = getattr(settings, 'BAPH_HIDE_EMAIL', False)
+
+# when enabled, registration emails are stored in the outbound queue
+# and sent by the ``sendqueuedmail`` command, instead of during the request
+BAPH_EMAIL_QUEUE = getattr(settings, 'BAPH_EMAIL_QUEUE', False)
+
+BAPH_EMAIL_QUEUE_BATCH_SIZE = getattr(settings,
+                                      'BAPH_EMAIL_QUEUE_BATCH_SIZE',
+                                      100)
+
+BAPH_EMAIL_QUEUE_MAX_ATTEMPTS = getattr(settings,
+                                        'BAPH_EMAIL_QUEUE_MAX_ATTEMPTS',
+                                        5)
+
+# seconds before the first retry of a failed email, doubled for each
+# further attempt
+BAPH_EMAIL_QUEUE_RETRY_DELAY = getattr(settings,
+                                       'BAPH_EMAIL_QUEUE_RETRY_DELAY',
+                                       60)
+
+# seconds a worker may hold a batch of queued emails before other workers
+# consider it abandoned and send it themselves
+BAPH_EMAIL_QUEUE_CLAIM_TIMEOUT = getattr(settings,
+                                         'BAPH_EMAIL_QUEUE_CLAIM_TIMEOUT',
+                                         300)
@@ -1,15 +1,20 @@
 from __future__ import unicode_literals
+import asyncore
 import datetime
 import hashlib
 import re
+import smtpd
+import threading
+import time
 
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.sites.models import Site
 from django.core import mail
 from django.conf import settings
+from django.test.utils import override_settings
 
-from baph.auth.models import User
-from baph.auth.registration.models import UserRegistration
+from baph.auth.models import Organization, User
+from baph.auth.registration.models import QueuedEmail, UserRegistration
 from baph.auth.registration import settings as auth_settings
 from baph.db.orm import ORM
 from baph.test import TestCase
@@ -84,3 +89,186 @@ class SignupModelTests(TestCase):
         new_user = UserRegistration.objects.create_user(**self.user_info)
         self.failUnlessEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].to, [self.user_info['email']])
+
+
+
+class SMTPStandIn(smtpd.SMTPServer):
+    """
+    A local SMTP server which records the messages it receives, or rejects
+    them with a temporary error while ``reject`` is set.
+
+    """
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.reject = False
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        while self.running:
+            asyncore.loop(timeout=0.05, count=1)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.close()
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if self.reject:
+            return b'451 Try again later'
+        self.messages.append((rcpttos, data))
+
+
+class QueuedEmailTests(TestCase):
+    """ Test the outbound email queue against a local SMTP server """
+    user_info = {'username': 'alice',
+                 'password': 'swordfish',
+                 'email': 'alice@example.com'}
+
+    @classmethod
+    def setUpClass(cls):
+        super(QueuedEmailTests, cls).setUpClass()
+        orm.Base.metadata.create_all(orm.engine)
+
+    def setUp(self):
+        self.server = SMTPStandIn()
+        self.settings_override = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=self.server.port)
+        self.settings_override.enable()
+        self.queue_enabled = auth_settings.BAPH_EMAIL_QUEUE
+        auth_settings.BAPH_EMAIL_QUEUE = True
+        self.get_current = Organization.__dict__.get('get_current')
+        Organization.get_current = classmethod(lambda cls: None)
+
+    def tearDown(self):
+        if self.get_current:
+            Organization.get_current = self.get_current
+        else:
+            # the method is inherited, remove the patched one
+            del Organization.get_current
+        auth_settings.BAPH_EMAIL_QUEUE = self.queue_enabled
+        self.settings_override.disable()
+        self.server.stop()
+        session = orm.sessionmaker()
+        session.query(QueuedEmail).delete()
+        session.query(UserRegistration).delete()
+        session.query(User).delete()
+        session.commit()
+        session.close()
+
+    def wait_for_messages(self, count):
+        for i in range(100):
+            if len(self.server.messages) >= count:
+                break
+            time.sleep(0.01)
+        return self.server.messages
+
+    def test_activation_email_queued(self):
+        """
+        With ``BAPH_EMAIL_QUEUE`` enabled, the activation e-mail is queued
+        when the account is created, and delivered by the worker.
+
+        """
+        new_user = UserRegistration.objects.create_user(**self.user_info)
+        self.failUnlessEqual(self.server.messages, [])
+        self.failUnlessEqual(QueuedEmail.get_failed().count(), 0)
+
+        self.failUnlessEqual(QueuedEmail.send_pending(), (1, 0))
+        messages = self.wait_for_messages(1)
+        self.failUnlessEqual(len(messages), 1)
+        self.assertEqual(messages[0][0], [self.user_info['email']])
+        self.failUnless(new_user.signup.activation_key in messages[0][1])
+        self.failUnlessEqual(QueuedEmail.send_pending(), (0, 0))
+
+    def test_claims_are_exclusive(self):
+        """
+        Emails claimed by one worker are not claimed by another until the
+        claim expires.
+
+        """
+        for i in range(3):
+            QueuedEmail.enqueue(
+                'registration/emails/activation_email_subject.txt',
+                'registration/emails/activation_email_message.txt',
+                'user%d@example.com' % i, {'activation_key': str(i)})
+        claimed = QueuedEmail.claim_pending()
+        self.failUnlessEqual(len(claimed), 3)
+        self.failUnlessEqual(QueuedEmail.claim_pending(), [])
+        self.failUnlessEqual(QueuedEmail.send_pending(), (0, 0))
+
+        session = orm.sessionmaker()
+        session.query(QueuedEmail).update(
+            {QueuedEmail.claimed_until: datetime.datetime.now()
+                                        - datetime.timedelta(seconds=1)})
+        session.commit()
+        self.failUnlessEqual(QueuedEmail.send_pending(), (3, 0))
+        self.failUnlessEqual(len(self.wait_for_messages(3)), 3)
+
+    def test_reclaimed_email_result_is_discarded(self):
+        """
+        A worker whose claim expired doesn't overwrite the claim of the
+        worker which took over the email, nor send after the expiry.
+
+        """
+        email = QueuedEmail.enqueue(
+            'registration/emails/activation_email_subject.txt',
+            'registration/emails/activation_email_message.txt',
+            'alice@example.com', {'activation_key': 'key'})
+        email, = QueuedEmail.claim_pending()
+        token = email.claimed_by
+        session = orm.sessionmaker()
+        session.query(QueuedEmail).update({QueuedEmail.claimed_by: 'other'})
+        session.commit()
+        email.mark_sent()
+        self.failIf(email.save_result(token))
+        self.failUnlessEqual(email.sent, None)
+        self.failUnlessEqual(email.claimed_by, 'other')
+
+        session.query(QueuedEmail).update({QueuedEmail.claimed_until: None})
+        session.commit()
+        timeout = auth_settings.BAPH_EMAIL_QUEUE_CLAIM_TIMEOUT
+        auth_settings.BAPH_EMAIL_QUEUE_CLAIM_TIMEOUT = 0
+        try:
+            self.failUnlessEqual(QueuedEmail.send_pending(), (0, 0))
+        finally:
+            auth_settings.BAPH_EMAIL_QUEUE_CLAIM_TIMEOUT = timeout
+        self.failUnlessEqual(self.server.messages, [])
+        self.failUnlessEqual(QueuedEmail.send_pending(), (1, 0))
+        self.failUnlessEqual(len(self.wait_for_messages(1)), 1)
+
+    def test_failed_email_is_retried_then_abandoned(self):
+        """
+        Rejected emails are retried after a delay, and abandoned after
+        ``BAPH_EMAIL_QUEUE_MAX_ATTEMPTS`` attempts.
+
+        """
+        email = QueuedEmail.enqueue(
+            'registration/emails/activation_email_subject.txt',
+            'registration/emails/activation_email_message.txt',
+            'alice@example.com', {'activation_key': 'key'})
+        self.server.reject = True
+        self.failUnlessEqual(QueuedEmail.send_pending(), (0, 1))
+
+        email = orm.sessionmaker().query(QueuedEmail).get(email.id)
+        self.failUnlessEqual(email.attempts, 1)
+        self.failUnless(email.next_attempt > datetime.datetime.now())
+        self.failUnless('451' in email.last_error)
+        self.failUnlessEqual(email.claimed_by, None)
+        # the retry is not due yet
+        self.failUnlessEqual(QueuedEmail.send_pending(), (0, 0))
+
+        email.next_attempt = datetime.datetime.now()
+        email.attempts = auth_settings.BAPH_EMAIL_QUEUE_MAX_ATTEMPTS - 1
+        orm.sessionmaker().commit()
+        self.failUnlessEqual(QueuedEmail.send_pending(), (0, 1))
+        self.failUnlessEqual(QueuedEmail.get_failed().count(), 1)
+
+        self.server.reject = False
+        self.failUnlessEqual(QueuedEmail.send_pending(), (0, 0))
+        self.failUnlessEqual(self.server.messages, [])
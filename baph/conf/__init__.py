@@ -1,4 +1,3 @@
-import ast
 from contextlib import contextmanager
 import imp
 import importlib
@@ -12,7 +11,10 @@ from django.conf import global_settings
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.functional import LazyObject, empty
 
+from baph.core.preconfig.index import (cached_lookup, get_environment,
+                                       is_import_path)
 from baph.core.preconfig.loader import PreconfigLoader
+from baph.utils import bytecode
 
 
 ENVIRONMENT_VARIABLE = "DJANGO_SETTINGS_MODULE"
@@ -194,16 +196,36 @@ class Settings:
     if explicit:
       self._explicit_settings.add(key)
 
+  @staticmethod
+  def find_package_path(package):
+    loader = pkgutil.find_loader(package)
+    if not loader:
+      return None
+    if not loader.is_package(package):
+      raise ValueError('%r is not a package' % package)
+    return loader.filename
+
   def get_package_path(self, package):
     if package not in self.package_paths:
-      loader = pkgutil.find_loader(package)
-      if not loader:
+      path = cached_lookup(('package', package) + get_environment(),
+                           lambda path: [path],
+                           lambda: self.find_package_path(package),
+                           lambda path: is_import_path(package, path))
+      if not path:
         return None
-      if not loader.is_package(package):
-        raise ValueError('%r is not a package' % package)
-      self.package_paths[package] = loader.filename
+      self.package_paths[package] = path
     return self.package_paths[package]
 
+  def get_settings_modules(self, path):
+    " returns the names of the generated settings modules which exist "
+    " in the package at path. The result is indexed until the package "
+    " directory changes "
+    def find_modules():
+      return [mod for mod in self.preconfig.modules
+              if os.path.exists('%s/%s.py' % (path, mod))]
+    return cached_lookup(('modules', path, self.preconfig.index_key),
+                         [path], find_modules)
+
   @staticmethod
   def create_module(fullname, **kwargs):
     """
@@ -217,12 +239,8 @@ class Settings:
 
   @staticmethod
   def compile_module(module):
-    path = module.__file__
-    with open(path, 'rb') as fp:
-      content = fp.read()
-    node = ast.parse(content, path)
-    code = compile(node, path, 'exec')
-    exec code in module.__dict__
+    " executes the module source, using cached bytecode when possible "
+    bytecode.exec_file(module.__file__, module.__dict__, module.__name__)
 
   def load_module_settings(self, module_name):
     msg = '  %s' % module_name
@@ -268,7 +286,7 @@ class Settings:
       }
       module = self.create_module(package, **kwargs)
 
-    for mod in self.preconfig.modules:
+    for mod in self.get_settings_modules(path):
       module = '%s.%s' % (package, mod)
       self.load_module_settings(module)
 
@@ -329,6 +347,9 @@ class Settings:
     if not self.SECRET_KEY:
       raise ImproperlyConfigured("The SECRET_KEY setting must not be empty.")
 
+    if os.environ.get(bytecode.REPORT_ENV_VARIABLE):
+      sys.stderr.write('%s\n' % bytecode.get_timing_report())
+
     '''
     if hasattr(time, 'tzset') and self.TIME_ZONE:
       # When we can, attempt to validate the timezone. If we can't find
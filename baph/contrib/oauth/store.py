@@ -1,27 +1,141 @@
 from datetime import datetime
+import hashlib
+import logging
+import Queue
+import threading
+import time
 
 from django.conf import settings
 from oauth_provider.store import InvalidConsumerError, InvalidTokenError, Store
 from sqlalchemy import or_
 
 from baph.auth.models import User, Organization, OAuthConsumer, OAuthNonce
+from baph.core.cache.utils import get_cache
 from baph.db.orm import ORM
 
 
 NONCE_VALID_PERIOD = getattr(settings, "OAUTH_NONCE_VALID_PERIOD", None)
+# how far (in seconds) nonce timestamps may be ahead of the server clock.
+# Unlimited by default. Set it along with NONCE_CACHE, whose entries are
+# kept until the nonce timestamp expires
+NONCE_MAX_SKEW = getattr(settings, "OAUTH_NONCE_MAX_SKEW", None)
+# cache alias used for the nonce uniqueness check. The cache must be shared
+# by all processes serving the api (ie. memcached), as nonces are only
+# checked against the cache when this is set
+NONCE_CACHE = getattr(settings, "OAUTH_NONCE_CACHE", None)
+# when using the nonce cache, whether to also record the nonces in the
+# database. Records are written by a background thread, outside the request
+NONCE_AUDIT = getattr(settings, "OAUTH_NONCE_AUDIT", False)
+# the number of nonces waiting to be recorded, beyond which new ones are
+# dropped (and logged) rather than held in memory
+NONCE_AUDIT_QUEUE_SIZE = getattr(settings, "OAUTH_NONCE_AUDIT_QUEUE_SIZE",
+                                 10000)
+# cache alias used to cache consumer lookups by consumer key. Only the
+# join against the user is cached: the consumer itself is still loaded by
+# primary key on each request, so changes to its key or secret apply
+# immediately
+CONSUMER_CACHE = getattr(settings, "OAUTH_CONSUMER_CACHE", None)
+CONSUMER_CACHE_TIMEOUT = getattr(settings, "OAUTH_CONSUMER_CACHE_TIMEOUT", 300)
 
 orm = ORM.get()
+logger = logging.getLogger(__name__)
+
+
+class NonceAuditWriter(object):
+    """
+    Writes used nonces to the database from a daemon thread, so the
+    inserts are not part of the request which used the nonce. Nonces are
+    dropped when the queue is full, ie. when the database can't keep up
+    """
+    batch_size = 100
+
+    def __init__(self, maxsize=None):
+        if maxsize is None:
+            maxsize = NONCE_AUDIT_QUEUE_SIZE
+        self.queue = Queue.Queue(maxsize)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run,
+                                               name='oauth-nonce-audit')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def put(self, params):
+        self.start()
+        try:
+            self.queue.put_nowait(params)
+        except Queue.Full:
+            if not self.dropped:
+                logger.warning('Oauth nonce audit queue is full; dropping '
+                               'nonces')
+            self.dropped += 1
+            return False
+        if self.dropped:
+            logger.warning('Dropped %d oauth nonces from the audit queue'
+                           % self.dropped)
+            self.dropped = 0
+        return True
+
+    def get_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def write(self, batch):
+        try:
+            orm.engine.execute(OAuthNonce.__table__.insert(), batch)
+        except Exception:
+            logger.exception('Unable to record %d oauth nonces' % len(batch))
+
+    def run(self):
+        while True:
+            batch = self.get_batch()
+            self.write(batch)
+            for i in range(len(batch)):
+                self.queue.task_done()
+
+    def flush(self):
+        " blocks until all queued nonces have been written "
+        self.queue.join()
+
+nonce_audit_writer = NonceAuditWriter()
+
 
 class ModelStore(Store):
     """
     Store implementation using sqla models
     """
     def get_consumer(self, request, oauth_request, consumer_key):
+        """
+        Returns the consumer with the given key which belongs to the
+        current organization (or to a superuser). With CONSUMER_CACHE,
+        the join against the user is replaced by a cached lookup, but the
+        matching consumer is still loaded by primary key
+        """
         org_id = Organization.get_current_id(request)
         col_key = Organization.get_column_key()
-        col = getattr(User, col_key)
 
         session = orm.sessionmaker()
+        if CONSUMER_CACHE:
+            consumers = self.get_cached_consumers(
+                oauth_request['oauth_consumer_key'])
+            for consumer in consumers:
+                if consumer['org_id'] == org_id or consumer['is_superuser']:
+                    consumer = session.query(OAuthConsumer).get(consumer['id'])
+                    if consumer:
+                        return consumer
+            raise InvalidConsumerError()
+
+        col = getattr(User, col_key)
         consumer = session.query(OAuthConsumer) \
             .join(OAuthConsumer.user) \
             .filter(OAuthConsumer.key==oauth_request['oauth_consumer_key']) \
@@ -34,6 +148,35 @@ class ModelStore(Store):
             raise InvalidConsumerError()
         return consumer
 
+    def get_cached_consumers(self, key):
+        """
+        Returns the id, user organization id and user superuser status of
+        all consumers with the given key, as dicts. The results are cached
+        by key. Cached entries are removed when a consumer, or the user of
+        a consumer, is changed (see `kill_consumer_cache` and
+        `kill_user_consumer_cache`)
+        """
+        cache = get_cache(CONSUMER_CACHE)
+        cache_key = OAuthConsumer.get_cache_key(key)
+        consumers = cache.get(cache_key)
+        if consumers is None:
+            col = getattr(User, Organization.get_column_key())
+            session = orm.sessionmaker()
+            query = session.query(OAuthConsumer.id, col, User.is_superuser) \
+                .join(OAuthConsumer.user) \
+                .filter(OAuthConsumer.key==key)
+            consumers = [{'id': id, 'org_id': org_id,
+                          'is_superuser': is_superuser}
+                         for id, org_id, is_superuser in query]
+            cache.set(cache_key, consumers, CONSUMER_CACHE_TIMEOUT)
+        return consumers
+
+    def get_nonce_cache_key(self, consumer_key, nonce, timestamp):
+        key = '%s:%s:%s' % (consumer_key, nonce, timestamp)
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return 'oauth_nonce_%s' % hashlib.sha1(key).hexdigest()
+
     def check_nonce(self, request, oauth_request, nonce, timestamp=0):
         """
         Return `True` if the nonce has not yet been used, `False` otherwise.
@@ -44,20 +187,34 @@ class ModelStore(Store):
         `timestamp`: nonce timestamp.
         """
         timestamp = int(timestamp)
+        now = int(time.time())
 
-        if NONCE_VALID_PERIOD and int(now().strftime("%s")) \
-                - timestamp > NONCE_VALID_PERIOD:
+        if NONCE_VALID_PERIOD and now - timestamp > NONCE_VALID_PERIOD:
+            return False
+        if NONCE_MAX_SKEW is not None and timestamp - now > NONCE_MAX_SKEW:
+            # timestamps far in the future would have to be remembered
+            # for just as long
             return False
 
-        timestamp = datetime.fromtimestamp(timestamp) \
-                            .strftime('%Y-%m-%d %H:%M:%S')
-
-        session = orm.sessionmaker()
         params = {
             'consumer_key': oauth_request['oauth_consumer_key'],
             'key': oauth_request['oauth_nonce'],
-            'timestamp': timestamp,
+            'timestamp': datetime.fromtimestamp(timestamp),
             }
+
+        if NONCE_CACHE and NONCE_VALID_PERIOD:
+            # the nonce only needs to be remembered until its timestamp is
+            # no longer valid, which is later for timestamps in the future
+            timeout = NONCE_VALID_PERIOD + max(timestamp - now, 0) + 1
+            key = self.get_nonce_cache_key(params['consumer_key'],
+                                           params['key'], timestamp)
+            if not get_cache(NONCE_CACHE).add(key, 1, timeout):
+                return False
+            if NONCE_AUDIT:
+                nonce_audit_writer.put(params)
+            return True
+
+        session = orm.sessionmaker()
         nonce = session.query(OAuthNonce).filter_by(**params).first()
         if nonce:
             return False
@@ -65,4 +222,4 @@ class ModelStore(Store):
         nonce = OAuthNonce(**params)
         session.add(nonce)
         session.commit()
-        return True
\ No newline at end of file
+        return True
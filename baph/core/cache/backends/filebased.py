@@ -1,16 +1,32 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import errno
 import gzip
+import hashlib
 import os.path
 import pickle
+import shutil
+import struct
+import tempfile
+import threading
 import time
+import zlib
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
 
 from django.conf import settings
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
 from django.core.cache.backends.filebased import FileBasedCache
+from django.utils.encoding import force_bytes
 
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
 
-DEFAULT_TIMEOUT = object()
 
 class CustomOpenerFileCache(FileBasedCache):
     '''Allows one to specify a custom opener function to be used when caching
@@ -45,7 +61,7 @@ class CustomOpenerFileCache(FileBasedCache):
         fname = self._key_to_file(key)
         dirname = os.path.dirname(fname)
 
-        if timeout == DEFAULT_TIMEOUT:
+        if timeout is DEFAULT_TIMEOUT:
             timeout = self.default_timeout
 
         self._cull()
@@ -64,18 +80,352 @@ class CustomOpenerFileCache(FileBasedCache):
     def has_key(self, key, version=None):
         key = self.make_key(key, version=version)
         self.validate_key(key)
-        fname = self._key_to_file(key)
+        return self._is_live(self._key_to_file(key))
+
+    def _is_live(self, fname):
         try:
             with self._opener(fname, 'rb') as f:
-                exp = pickle.load()
+                exp = pickle.load(f)
             now = time.time()
-            if exp < now:
+            if exp is not None and exp < now:
                 self._delete(fname)
                 return False
             else:
                 return True
         except (IOError, OSError, EOFError, pickle.PickleError):
             return False
+
+
+def _gzip_compress(data):
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+def _gzip_decompress(data):
+    with gzip.GzipFile(fileobj=StringIO(data), mode='rb') as f:
+        return f.read()
+
+# codec name -> (header flag, compress, decompress)
+CODECS = {
+    'zlib': (1, zlib.compress, zlib.decompress),
+    'gzip': (2, _gzip_compress, _gzip_decompress),
+}
+if lz4 is not None:
+    CODECS['lz4'] = (3, lz4.compress, lz4.decompress)
+
+# magic, expiry (0 = never), codec flag
+HEADER = struct.Struct('>4sdB')
+MAGIC = 'BFC1'
+CACHE_SUFFIX = '.djcache'
+
+
+class _Sweeper(threading.Thread):
+    """
+    Daemon thread which periodically culls a cache directory, so writes
+    never have to pay for a directory scan
+    """
+    def __init__(self, cache, interval):
+        super(_Sweeper, self).__init__(name='cache-sweeper:%s' % cache._dir)
+        self.daemon = True
+        self.cache = cache
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.cache.cull()
+            except Exception:
+                pass
+
+    def stop(self):
+        self.stopped.set()
+
+
+class ShardedFileCache(BaseCache):
+    '''A filesystem cache for large cached assets.
+
+    Entries are stored in a sharded directory tree, written atomically via
+    rename, and optionally compressed. The expiry is stored in a fixed-size
+    header, so expiry checks never unpickle the value. Culling is done by a
+    periodic background sweep rather than on every write.
+
+    Supported OPTIONS (in addition to MAX_ENTRIES and CULL_FREQUENCY):
+
+    ``COMPRESSION``
+        One of 'zlib', 'gzip' or 'lz4' (if installed). Defaults to None.
+    ``COMPRESS_MIN_LENGTH``
+        Pickled values smaller than this are stored uncompressed.
+        Defaults to 1024 bytes.
+    ``SHARD_DEPTH``
+        The number of 2-character directory levels. Defaults to 2.
+    ``CULL_INTERVAL``
+        Seconds between background sweeps. 0 disables the sweeper, leaving
+        culling to explicit calls to ``cull()``. Defaults to 300.
+    '''
+    _sweepers = {}
+    _sweeper_lock = threading.Lock()
+
+    def __init__(self, dir, params):
+        super(ShardedFileCache, self).__init__(params)
+        options = params.get('OPTIONS', {})
+        self._dir = os.path.abspath(dir)
+        self._shard_depth = int(options.get('SHARD_DEPTH', 2))
+        self._compress_min_length = int(options.get('COMPRESS_MIN_LENGTH',
+                                                    1024))
+        self._cull_interval = int(options.get('CULL_INTERVAL', 300))
+        codec = options.get('COMPRESSION', None)
+        if codec and codec not in CODECS:
+            raise ValueError('Unsupported cache compression: %r (available: '
+                             '%s)' % (codec, ', '.join(sorted(CODECS))))
+        self._codec = codec
+        self._decoders = dict((flag, decompress) for flag, _, decompress
+                              in CODECS.values())
+        if not os.path.exists(self._dir):
+            self._createdir()
+
+    def _createdir(self):
+        try:
+            os.makedirs(self._dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise EnvironmentError("Cache directory '%s' does not exist "
+                                       "and could not be created" % self._dir)
+
+    def _ensure_sweeper(self):
+        if not self._cull_interval or self._dir in self._sweepers:
+            return
+        with self._sweeper_lock:
+            if self._dir in self._sweepers:
+                return
+            sweeper = _Sweeper(self, self._cull_interval)
+            self._sweepers[self._dir] = sweeper
+            sweeper.start()
+
+    def close(self, **kwargs):
+        """
+        Stops the background sweeper for this cache directory. The next
+        write starts a new one. Django also calls this at the end of every
+        request (via ``request_finished``), which leaves the sweeper running
+        """
+        if 'signal' in kwargs:
+            return
+        with self._sweeper_lock:
+            sweeper = self._sweepers.pop(self._dir, None)
+        if sweeper is not None:
+            sweeper.stop()
+            if sweeper is not threading.current_thread():
+                sweeper.join()
+
+    def _key_to_file(self, key):
+        digest = hashlib.md5(force_bytes(key)).hexdigest()
+        shards = [digest[i*2:i*2+2] for i in range(self._shard_depth)]
+        return os.path.join(self._dir, *(shards + [digest + CACHE_SUFFIX]))
+
+    def _get_expiry(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return 0.0
+        return time.time() + timeout
+
+    def _read_header(self, f):
+        header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise EOFError('truncated cache file')
+        magic, expiry, flag = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise EOFError('invalid cache file')
+        return expiry, flag
+
+    def _is_expired(self, expiry, now=None):
+        return expiry and expiry < (now or time.time())
+
+    def _encode(self, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        flag = 0
+        if self._codec and len(data) >= self._compress_min_length:
+            flag, compress, _ = CODECS[self._codec]
+            data = compress(data)
+        return flag, data
+
+    def _decode(self, flag, data):
+        if flag:
+            data = self._decoders[flag](data)
+        return pickle.loads(data)
+
+    def _write(self, fname, expiry, flag, data, exclusive=False):
+        """
+        Writes an entry via a temp file. The temp file is renamed into
+        place, or if ``exclusive`` is set, hard-linked into place, which
+        fails if the entry already exists. Returns False in that case
+        """
+        dirname = os.path.dirname(fname)
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, expiry, flag))
+                f.write(data)
+            if not exclusive:
+                os.rename(tmp, fname)
+                return True
+            try:
+                os.link(tmp, fname)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                return False
+            finally:
+                os.remove(tmp)
+            return True
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _delete(self, fname):
+        try:
+            os.remove(fname)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._ensure_sweeper()
+        fname = self._key_to_file(key)
+        flag, data = self._encode(value)
+        expiry = self._get_expiry(timeout)
+        try:
+            if self._write(fname, expiry, flag, data, exclusive=True):
+                return True
+            # an expired entry doesn't count; remove it and try once more
+            if self._is_live(fname):
+                return False
+            return self._write(fname, expiry, flag, data, exclusive=True)
+        except (IOError, OSError):
+            return False
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        fname = self._key_to_file(key)
+        try:
+            with open(fname, 'rb') as f:
+                expiry, flag = self._read_header(f)
+                if self._is_expired(expiry):
+                    self._delete(fname)
+                    return default
+                data = f.read()
+            return self._decode(flag, data)
+        except (IOError, OSError, EOFError, KeyError, zlib.error,
+                pickle.PickleError):
+            return default
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._ensure_sweeper()
+        fname = self._key_to_file(key)
+        flag, data = self._encode(value)
+        try:
+            self._write(fname, self._get_expiry(timeout), flag, data)
+        except (IOError, OSError):
+            pass
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        try:
+            self._delete(self._key_to_file(key))
+        except (IOError, OSError):
+            pass
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._is_live(self._key_to_file(key))
+
+    def _is_live(self, fname):
+        try:
+            with open(fname, 'rb') as f:
+                expiry, flag = self._read_header(f)
+        except (IOError, OSError, EOFError):
+            return False
+        if self._is_expired(expiry):
+            try:
+                self._delete(fname)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def _iter_files(self):
+        for root, dirs, files in os.walk(self._dir):
+            for name in files:
+                yield os.path.join(root, name)
+
+    def cull(self):
+        """
+        Removes expired entries and stale temp files. If the number of
+        remaining entries exceeds MAX_ENTRIES, the oldest 1/CULL_FREQUENCY
+        of them are removed as well (all of them if CULL_FREQUENCY is 0).
+        Returns the number of files removed
+        """
+        now = time.time()
+        removed = 0
+        live = []
+        for fname in self._iter_files():
+            try:
+                if fname.endswith('.tmp'):
+                    # abandoned partial writes
+                    if os.path.getmtime(fname) < now - 3600:
+                        self._delete(fname)
+                        removed += 1
+                    continue
+                if not fname.endswith(CACHE_SUFFIX):
+                    continue
+                with open(fname, 'rb') as f:
+                    expiry, flag = self._read_header(f)
+                if self._is_expired(expiry, now):
+                    self._delete(fname)
+                    removed += 1
+                else:
+                    live.append((os.path.getmtime(fname), fname))
+            except (IOError, OSError, EOFError):
+                continue
+
+        if len(live) <= self._max_entries:
+            return removed
+
+        live.sort()
+        if self._cull_frequency == 0:
+            doomed = live
+        else:
+            doomed = live[:len(live) // self._cull_frequency]
+        for mtime, fname in doomed:
+            try:
+                self._delete(fname)
+                removed += 1
+            except (IOError, OSError):
+                pass
+        return removed
+
+    def clear(self):
+        try:
+            shutil.rmtree(self._dir)
+        except (IOError, OSError):
+            pass
+
 """
 if hasattr(settings, 'FILE_CACHE_LOCATION'):
     cache = CustomOpenerFileCache(settings.FILE_CACHE_LOCATION,
@@ -1,6 +1,9 @@
 from contextlib import contextmanager
+import logging
 import time
 
+from baph.core.instrumentation import InstrumentedCache, get_request_stats
+
 
 try:
   # django 1.7 - current
@@ -10,6 +13,9 @@ except:
   from django.utils.module_loading import import_by_path as import_string
 
 
+logger = logging.getLogger(__name__)
+
+
 class CacheNamespace(object):
   def __init__(self, name, attr, cache_alias='default', default_value=None,
                default_func=None):
@@ -100,7 +106,6 @@ class CacheNamespace(object):
 
   @property
   def cache(self):
-    from django.core.cache import get_cache
     return get_cache(self.cache_alias)
 
   def get_default(self):
@@ -117,6 +122,23 @@ class CacheNamespace(object):
   def version_key(self, value):
     return '%s_%s' % (self.name.lower(), value)
 
+  def incr_version(self, value=None):
+    """
+    Increments the version key for the given namespace value, invalidating
+    every key stored under it. Returns the new version
+    """
+    version_key = self.version_key(self.resolve_value(value))
+    cache = self.cache
+    try:
+      return cache.incr(version_key)
+    except ValueError:
+      # the key does not exist. if another process adds it first, the
+      # add fails and its version is incremented instead
+      version = int(time.time())
+      if cache.add(version_key, version):
+        return version
+      return cache.incr(version_key)
+
   def key_prefix(self, value):
     version_key = self.version_key(value)
     version = self.cache.get(version_key)
@@ -124,3 +146,63 @@ class CacheNamespace(object):
       version = int(time.time())
       self.cache.set(version_key, version)
     return '%s_%s' % (version_key, version)
+
+def get_cache(alias):
+  """
+  Returns the cache backend for alias. During an instrumented request,
+  the backend is wrapped to record each operation
+  """
+  from django.core.cache import get_cache as get_backend
+  cache = get_backend(alias)
+  stats = get_request_stats()
+  if stats is None:
+    return cache
+  return InstrumentedCache(cache, stats)
+
+def get_uncovered_models(models):
+  """
+  Returns the cached models (those with a cache_alias) among models which
+  no cache namespace with a default value covers. bump_cache_namespaces
+  can't invalidate the cached entries of these models
+  """
+  covered = set()
+  for ns in CacheNamespace.get_cache_namespaces():
+    try:
+      ns.resolve_value(None)
+    except ValueError:
+      continue
+    covered.update(ns.affected_models)
+  return sorted((model for model in set(models)
+                 if model._meta.cache_alias and model not in covered),
+                key=lambda model: model.__name__)
+
+def bump_cache_namespaces(models):
+  """
+  Increments the version of each cache namespace used by the given
+  models, in place of per-object cache invalidation. Returns the list
+  of namespaces which were invalidated. Cached models which none of them
+  cover are logged, as their cached entries may now be stale
+  """
+  from django.conf import settings
+  if not getattr(settings, 'CACHE_ENABLED', False):
+    return []
+  models = set(models)
+  bumped = []
+  covered = set()
+  for ns in CacheNamespace.get_cache_namespaces():
+    if not models.intersection(ns.affected_models):
+      continue
+    try:
+      ns.incr_version()
+    except ValueError:
+      logger.warning('Unable to invalidate cache namespace %r: no '
+                     'default value' % ns.name)
+      continue
+    bumped.append(ns)
+    covered.update(ns.affected_models)
+  stale = sorted(model.__name__ for model in models - covered
+                 if model._meta.cache_alias)
+  if stale:
+    logger.warning('Cached entries of %s were not invalidated: no cache '
+                   'namespace covers them' % ', '.join(stale))
+  return bumped
@@ -8,7 +8,7 @@ from functools import wraps
 from django.conf import settings
 from django.core import signals
 from django.core.exceptions import PermissionDenied, SuspiciousOperation
-from django.core.urlresolvers import get_urlconf, RegexURLResolver
+from django.core.urlresolvers import get_urlconf
 from django.http import Http404
 from django.http.multipartparser import MultiPartParserError
 from django.utils.decorators import available_attrs
@@ -16,13 +16,9 @@ from django.utils.encoding import force_text
 from django.views import debug
 import six
 
-logger = logging.getLogger('django.request')
+from .utils import get_resolver
 
-def get_resolver(urlconf=None):
-  if urlconf is None:
-    from django.conf import settings
-    urlconf = settings.ROOT_URLCONF
-  return RegexURLResolver(r'^/', urlconf)
+logger = logging.getLogger('django.request')
 
 def convert_exception_to_response(get_response):
     """
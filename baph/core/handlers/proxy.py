@@ -1,4 +1,5 @@
-from django.core.urlresolvers import set_urlconf, RegexURLPattern
+from django.core.urlresolvers import RegexURLPattern, RegexURLResolver
+from functools32 import lru_cache
 
 from baph.utils.module_loading import import_string
 
@@ -6,15 +7,32 @@ from .base import BaseHandler
 from .utils import get_resolver
 
 
+class ProxyURLConf(object):
+  """
+  Wraps a urlconf module, replacing its urlpatterns, so the error handlers
+  and any other module attributes are still found by the resolver
+  """
+  def __init__(self, module, urlpatterns):
+    self.module = module
+    self.urlpatterns = urlpatterns
+
+  def __getattr__(self, key):
+    return getattr(self.module, key)
+
+@lru_cache(maxsize=None)
 def get_proxy_resolver(urlconf, default_view):
-  from django.conf import settings
-  set_urlconf(urlconf)
+  """
+  Returns a resolver for urlconf with the default proxy view appended as a
+  catchall, built once per urlconf. The urlconf's own pattern list is left
+  untouched, so concurrent requests never see it being modified
+  """
   resolver = get_resolver(urlconf)
   callback = import_string(default_view)
+  urlpatterns = list(resolver.url_patterns)
   if callback not in resolver.reverse_dict:
-    pattern = RegexURLPattern(r'', callback)
-    resolver.url_patterns.append(pattern)
-  return resolver
+    urlpatterns.append(RegexURLPattern(r'', callback))
+  return RegexURLResolver(r'^/',
+                          ProxyURLConf(resolver.urlconf_module, urlpatterns))
 
 class ProxyHandler(BaseHandler):
   middleware_setting_key = 'PROXY_MIDDLEWARE'
@@ -26,13 +44,12 @@ class ProxyHandler(BaseHandler):
 
   def get_resolver(self, urlconf=None):
     """
-    Loads the urlresolver with the given urlconf, then appends the default
-    proxy view as a catchall at the end of the pattern list
+    Returns the resolver for the given urlconf, with the default proxy view
+    as a catchall at the end of the pattern list
     """
+    from django.conf import settings
     if urlconf is None:
-      from django.conf import settings
       urlconf = getattr(settings, self.urlconf_setting_key)
-    callback_name = settings.PROXY_DEFAULT_VIEW
-    return get_proxy_resolver(urlconf, callback_name)
+    return get_proxy_resolver(urlconf, settings.PROXY_DEFAULT_VIEW)
 
-proxy_handler = ProxyHandler()
\ No newline at end of file
+proxy_handler = ProxyHandler()
@@ -1,8 +1,23 @@
 from django.core.urlresolvers import RegexURLResolver
+from functools32 import lru_cache
 
 
 def get_resolver(urlconf=None):
   if urlconf is None:
     from django.conf import settings
     urlconf = settings.ROOT_URLCONF
+  return get_cached_resolver(urlconf)
+
+@lru_cache(maxsize=None)
+def get_cached_resolver(urlconf):
+  """
+  Returns the resolver for urlconf, built once per urlconf so its pattern
+  and reverse dicts are reused across requests
+  """
   return RegexURLResolver(r'^/', urlconf)
+
+def clear_resolver_cache():
+  " call after changing urlconfs at runtime (ie. in tests) "
+  from baph.core.handlers.proxy import get_proxy_resolver
+  get_cached_resolver.cache_clear()
+  get_proxy_resolver.cache_clear()
@@ -0,0 +1,172 @@
+"""
+Per-request performance counters.
+
+While a request is instrumented (see
+:class:`baph.middleware.instrumentation.InstrumentationMiddleware`), a
+:class:`RequestStats` is bound to the current thread. SQL statements are
+recorded by engine cursor events, and cache operations by the
+:class:`InstrumentedCache` wrapper returned by
+:func:`baph.core.cache.utils.get_cache`. Outside an instrumented request,
+neither records anything.
+"""
+from collections import Counter
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.events import ConnectionEvents
+
+
+_local = threading.local()
+_listeners_installed = False
+
+# the cache methods which are counted by InstrumentedCache
+CACHE_OPERATIONS = ('get', 'set', 'add', 'delete', 'incr', 'decr',
+                    'get_many', 'set_many', 'delete_many', 'has_key')
+
+
+class RequestStats(object):
+  def __init__(self):
+    self.start = time.time()
+    self.end = None
+    self.sql_count = 0
+    self.sql_time = 0.0
+    self.cache_time = 0.0
+    # statement -> number of executions
+    self.statements = Counter()
+    # cache operation name -> number of calls
+    self.cache_ops = Counter()
+
+  @property
+  def total_time(self):
+    end = self.end if self.end is not None else time.time()
+    return end - self.start
+
+  @property
+  def cache_count(self):
+    return sum(self.cache_ops.values())
+
+  def finish(self):
+    self.end = time.time()
+
+  def record_statement(self, statement, duration):
+    self.sql_count += 1
+    self.sql_time += duration
+    self.statements[statement] += 1
+
+  def record_cache_op(self, op, duration):
+    self.cache_ops[op] += 1
+    self.cache_time += duration
+
+  def get_repeated_statements(self, threshold):
+    """
+    Returns (statement, count) pairs for the statements executed at least
+    threshold times, most frequent first. These are N+1 query candidates
+    """
+    return [(statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold]
+
+  def get_exceeded_budgets(self, budgets):
+    """
+    Returns (name, value, limit) for each entry in budgets (a dict of
+    stat names, ie. 'sql_count', to limits) which was exceeded
+    """
+    exceeded = []
+    for name, limit in sorted(budgets.items()):
+      value = getattr(self, name)
+      if value > limit:
+        exceeded.append((name, value, limit))
+    return exceeded
+
+  def get_server_timing(self):
+    " returns the value for a Server-Timing header "
+    return ', '.join([
+      'db;dur=%.2f;desc="%d queries"' % (self.sql_time * 1000, self.sql_count),
+      'cache;dur=%.2f;desc="%d ops"' % (self.cache_time * 1000,
+                                         self.cache_count),
+      'total;dur=%.2f' % (self.total_time * 1000),
+    ])
+
+
+def get_request_stats():
+  " returns the stats for the request being handled by this thread "
+  return getattr(_local, 'stats', None)
+
+def start_request_stats():
+  install_engine_listeners()
+  _local.stats = RequestStats()
+  return _local.stats
+
+def end_request_stats():
+  stats = get_request_stats()
+  _local.stats = None
+  if stats is not None:
+    stats.finish()
+  return stats
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+  if getattr(_local, 'stats', None) is not None:
+    # a connection executes one statement at a time
+    conn.info['query_start_time'] = time.time()
+
+def record_statement(conn, statement):
+  start = conn.info.pop('query_start_time', None)
+  stats = getattr(_local, 'stats', None)
+  if stats is None or start is None:
+    # the statement started before the request was instrumented
+    return
+  stats.record_statement(statement, time.time() - start)
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+  record_statement(conn, statement)
+
+def handle_error(exception_context):
+  " failed statements are recorded too, and must not leave a start time "
+  if exception_context.connection is not None:
+    record_statement(exception_context.connection,
+                     exception_context.statement)
+
+def dbapi_error(conn, cursor, statement, parameters, context, exception):
+  " the equivalent of handle_error for SQLAlchemy < 0.9.7 "
+  record_statement(conn, statement)
+
+def install_engine_listeners():
+  global _listeners_installed
+  if _listeners_installed:
+    return
+  event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+  event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+  if hasattr(ConnectionEvents, 'handle_error'):
+    event.listen(Engine, 'handle_error', handle_error)
+  else:
+    event.listen(Engine, 'dbapi_error', dbapi_error)
+  _listeners_installed = True
+
+
+class InstrumentedCache(object):
+  """
+  Wraps a cache backend, recording each operation in stats
+  """
+  def __init__(self, cache, stats):
+    self._cache = cache
+    self._stats = stats
+
+  def __getattr__(self, key):
+    attr = getattr(self._cache, key)
+    if key not in CACHE_OPERATIONS:
+      return attr
+    def timed(*args, **kwargs):
+      start = time.time()
+      try:
+        return attr(*args, **kwargs)
+      finally:
+        self._stats.record_cache_op(key, time.time() - start)
+    return timed
+
+  def __contains__(self, key):
+    return self.has_key(key)
@@ -1,10 +1,13 @@
+from multiprocessing import Pool
 from optparse import make_option
+import os
 
 from django.core.exceptions import ImproperlyConfigured
 from django.core.management.base import BaseCommand, CommandError
 from django.core import serializers
 from django.utils.datastructures import SortedDict
 
+from baph.core.serializers import register_builtin_serializers
 from baph.db import ORM, DEFAULT_DB_ALIAS
 from baph.db.models.loading import extract_app_name
 
@@ -26,6 +29,12 @@ class Command(BaseCommand):
             help='Use natural keys if they are available.'),
         make_option('-a', '--all', action='store_true', dest='use_base_manager', default=False,
             help="Use Django's base manager to dump all models stored in the database, including those that would otherwise be filtered or modified by a custom manager."),
+        make_option('--chunk-size', default=1000, dest='chunk_size', type='int',
+            help='The number of rows to fetch per round trip when streaming rows with yield_per.'),
+        make_option('-o', '--output-dir', default=None, dest='output_dir',
+            help='Write each model to its own file (ModelName.format) in the given directory, instead of stdout.'),
+        make_option('--workers', default=1, dest='workers', type='int',
+            help='The number of worker processes used to dump models in parallel (requires --output-dir).'),
     )
     help = ("Output the contents of the database as a fixture of the given "
             "format (using each model's default manager unless --all is "
@@ -42,6 +51,12 @@ class Command(BaseCommand):
         show_traceback = options.get('traceback')
         use_natural_keys = options.get('use_natural_keys')
         use_base_manager = options.get('use_base_manager')
+        chunk_size = options.get('chunk_size')
+        output_dir = options.get('output_dir')
+        workers = options.get('workers') or 1
+
+        if workers > 1 and not output_dir:
+            raise CommandError('--workers requires --output-dir')
 
         excluded_apps = set()
         excluded_models = set()
@@ -99,6 +114,7 @@ class Command(BaseCommand):
 
         # Check that the serialization format exists; this is a shortcut to
         # avoid collating all the objects and _then_ failing.
+        register_builtin_serializers()
         if format not in serializers.get_public_serializer_formats():
             raise CommandError("Unknown serialization format: %s" % format)
 
@@ -107,24 +123,79 @@ class Command(BaseCommand):
         except KeyError:
             raise CommandError("Unknown serialization format: %s" % format)
 
-        def get_objects():
-            # Collate the objects to be serialized.
-            session = orm.sessionmaker()
-            for model in sort_dependencies(app_list.items()):
-                if model in excluded_models:
-                    continue
-                for obj in session.query(model):
-                    yield obj
+        models = [model for model in sort_dependencies(app_list.items())
+                  if model not in excluded_models]
+        serialize_options = {
+            'indent': indent,
+            'use_natural_keys': use_natural_keys,
+            }
 
         try:
-            self.stdout.ending = None
-            serializers.serialize(format, get_objects(), indent=indent,
-                    use_natural_keys=use_natural_keys, stream=self.stdout)
+            if output_dir:
+                if not os.path.isdir(output_dir):
+                    os.makedirs(output_dir)
+                jobs = [(model.__name__, output_dir, format, chunk_size,
+                         serialize_options) for model in models]
+                if workers > 1:
+                    pool = Pool(workers, initializer=init_worker)
+                    try:
+                        results = pool.map(dump_model_to_file, jobs)
+                    finally:
+                        pool.close()
+                        pool.join()
+                else:
+                    results = map(dump_model_to_file, jobs)
+                for filename, count in results:
+                    self.stderr.write('Dumped %d object(s) to %s'
+                                      % (count, filename))
+            else:
+                self.stdout.ending = None
+                serializers.serialize(format,
+                        iter_objects(models, chunk_size),
+                        stream=self.stdout, **serialize_options)
         except Exception as e:
             if show_traceback:
                 raise
             raise CommandError("Unable to serialize database: %s" % e)
 
+def iter_objects(models, chunk_size=1000):
+    """
+    Yields all rows of the given models, fetching chunk_size rows per
+    round trip. Objects are expunged once serialized, so neither the
+    result set nor the identity map is held in memory
+    """
+    session = orm.sessionmaker()
+    for model in models:
+        for obj in session.query(model).yield_per(chunk_size):
+            yield obj
+            session.expunge(obj)
+
+def init_worker():
+    """
+    Discards connections inherited from the parent process, so each
+    worker opens its own
+    """
+    orm.engine.dispose()
+
+def dump_model_to_file(job):
+    """
+    Serializes a single model to output_dir/ModelName.format. Takes
+    picklable args, so it can be used as a multiprocessing target
+    """
+    model_name, output_dir, format, chunk_size, options = job
+    model = orm.Base._decl_class_registry[model_name]
+    filename = os.path.join(output_dir, '%s.%s' % (model_name, format))
+    counter = []
+
+    def objects():
+        for obj in iter_objects([model], chunk_size):
+            counter.append(None)
+            yield obj
+
+    with open(filename, 'w') as stream:
+        serializers.serialize(format, objects(), stream=stream, **options)
+    return (filename, len(counter))
+
 def sort_dependencies(app_list):
     """Sort a list of app,modellist pairs into a single list of models.
 
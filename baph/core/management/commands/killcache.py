@@ -1,11 +1,13 @@
 from collections import defaultdict
 import json
+from optparse import make_option
 import os
 import sys
+import time
 
 from django.core.cache import get_cache
+from django.utils.datastructures import SortedDict
 from django.utils.termcolors import make_style
-from MySQLdb.converters import conversions, escape
 from sqlalchemy import inspect
 from sqlalchemy import *
 from sqlalchemy.exc import ResourceClosedError
@@ -13,7 +15,7 @@ from sqlalchemy.orm import lazyload, contains_eager, class_mapper
 from sqlalchemy.orm.util import identity_key
 from sqlalchemy.sql import compiler
 
-from baph.core.management.base import BaseCommand #NoArgsCommand
+from baph.core.management.base import BaseCommand, CommandError #NoArgsCommand
 from baph.db.orm import ORM
 
 
@@ -58,6 +60,93 @@ def prompt_for_model_name():
             continue
         return cmd
 
+def chunked(items, size):
+    for i in xrange(0, len(items), size):
+        yield items[i:i+size]
+
+def parse_pk(model, value):
+    """
+    Converts a raw pk string into a value suitable for comparison against
+    the primary key columns. Composite keys are given as comma-separated
+    values, in primary key column order
+    """
+    if isinstance(value, tuple):
+        return value
+    frags = tuple(v.strip() for v in str(value).split(','))
+    if len(frags) != len(class_mapper(model).primary_key):
+        raise ValueError('Invalid primary key for %s: %r'
+                         % (model.__name__, value))
+    return frags
+
+def read_id_file(filename):
+    """
+    Reads primary keys from a file, one per line. Blank lines and lines
+    starting with '#' are ignored
+    """
+    with open(filename) as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            yield line
+
+def get_filtered_pks(session, model, where):
+    """
+    Returns the primary keys of all objects matching a raw SQL
+    WHERE clause
+    """
+    pk_cols = class_mapper(model).primary_key
+    query = session.query(*pk_cols).filter(text(where))
+    return [tuple(row) for row in query]
+
+def pk_filter(model, pks):
+    """
+    Returns a filter expression matching all of the given primary keys
+    """
+    pk_cols = class_mapper(model).primary_key
+    if len(pk_cols) == 1:
+        return pk_cols[0].in_([pk[0] for pk in pks])
+    return tuple_(*pk_cols).in_(pks)
+
+def collect_cache_keys(session, model, pks, chunk_size=500):
+    """
+    Loads objects in chunks (one query per chunk) and returns a dict of
+    de-duplicated cache keys and version keys, grouped by cache alias.
+    The session is cleared after each chunk to keep memory usage flat
+    """
+    caches = defaultdict(lambda: {
+        'cache_keys': set(),
+        'version_keys': set(),
+    })
+    found = 0
+    for chunk in chunked(pks, chunk_size):
+        query = session.query(model).filter(pk_filter(model, chunk))
+        for obj in query:
+            found += 1
+            cache_keys, version_keys = obj.get_cache_keys(
+                child_updated=True, force_expire_pointers=True)
+            for alias, cache_key in cache_keys:
+                caches[alias]['cache_keys'].add(cache_key)
+            for alias, version_key in version_keys:
+                caches[alias]['version_keys'].add(version_key)
+        session.expunge_all()
+    return found, caches
+
+def increment_version_keys(cache, keys):
+    """
+    Increments a set of version keys atomically, as in
+    CacheNamespace.incr_version. Missing keys are initialized to the
+    current timestamp; if another process creates a key first, its
+    value is incremented instead
+    """
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # the key does not exist
+            if not cache.add(key, int(time.time())):
+                cache.incr(key)
+
 def prompt_for_pk(model):
     print 'Enter the primary key components:'
     pk = []
@@ -70,8 +159,26 @@ class Command(BaseCommand):
     requires_model_validation = True
     help = "Kills cache keys for baph models"
     args = "modelname [id id ...]"
+    option_list = BaseCommand.option_list + (
+        make_option('--bulk', action='store_true', dest='bulk',
+            default=False, help='Run non-interactively, loading objects '
+            'in chunks and invalidating their keys in batched calls.'),
+        make_option('--filter', dest='where', default=None,
+            help='A SQL WHERE clause selecting the objects to invalidate '
+            '(implies --bulk).'),
+        make_option('--file', dest='id_file', default=None,
+            help='A file containing one primary key per line (implies '
+            '--bulk). Composite keys are comma-separated.'),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+            default=500, help='The number of objects to load per query, '
+            'and the number of keys per cache call, in bulk mode.'),
+    )
 
     def handle(self, *args, **options):
+        if options.get('bulk') or options.get('where') \
+                or options.get('id_file'):
+            return self.handle_bulk(*args, **options)
+
         if len(args) > 0:
             model_name = args[0]
         else:
@@ -136,3 +243,54 @@ class Command(BaseCommand):
 
             model_name = None
             pks = None
+
+    def handle_bulk(self, *args, **options):
+        where = options.get('where')
+        id_file = options.get('id_file')
+        chunk_size = options.get('chunk_size') or 500
+
+        if not args:
+            raise CommandError('A model name is required in bulk mode')
+        model_name = args[0]
+        if not model_name in Base._decl_class_registry:
+            raise CommandError('Invalid model name: %s' % model_name)
+        model = Base._decl_class_registry[model_name]
+
+        sources = [bool(args[1:]), bool(where), bool(id_file)]
+        if sum(sources) != 1:
+            raise CommandError('Bulk mode requires exactly one of: a list '
+                               'of ids, --filter, or --file')
+
+        start = time.time()
+        session = orm.sessionmaker()
+        if where:
+            pks = get_filtered_pks(session, model, where)
+        elif id_file:
+            pks = [parse_pk(model, pk) for pk in read_id_file(id_file)]
+        else:
+            pks = [parse_pk(model, pk) for pk in args[1:]]
+        # preserve ordering while removing duplicate ids
+        pks = list(SortedDict.fromkeys(pks))
+
+        print info_msg('Loading %d %s objects' % (len(pks), model_name))
+        found, caches = collect_cache_keys(session, model, pks, chunk_size)
+        print success_msg('  Found %d objects' % found)
+
+        total = 0
+        for alias, keys in caches.items():
+            cache = get_cache(alias)
+            cache_keys = sorted(keys['cache_keys'])
+            version_keys = sorted(keys['version_keys'])
+            print info_msg('Processing keys on cache %r: %d cache keys, '
+                           '%d version keys' % (alias, len(cache_keys),
+                                                len(version_keys)))
+            for chunk in chunked(cache_keys, chunk_size):
+                cache.delete_many(chunk)
+            for chunk in chunked(version_keys, chunk_size):
+                increment_version_keys(cache, chunk)
+            total += len(cache_keys) + len(version_keys)
+
+        elapsed = time.time() - start
+        rate = total / elapsed if elapsed else float(total)
+        print success_msg('Processed %d keys in %.2fs (%.1f keys/sec)'
+                          % (total, elapsed, rate))
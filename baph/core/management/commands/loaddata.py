@@ -24,11 +24,15 @@ from django.db import (
 from django.utils._os import upath
 from django.utils.datastructures import SortedDict
 from django.utils.functional import cached_property, memoize
+from sqlalchemy import inspect
 from sqlalchemy.orm.attributes import instance_dict
 from sqlalchemy.orm.session import Session
 from sqlalchemy.orm.util import identity_key
 
 from baph.core.management.new_base import BaseCommand
+from baph.core.cache.utils import bump_cache_namespaces, get_uncovered_models
+from baph.core.serializers import (get_raw_deserializer,
+                                   register_builtin_serializers)
 from baph.db import DEFAULT_DB_ALIAS
 from baph.db.models import get_app_paths
 from baph.db.orm import ORM
@@ -69,6 +73,37 @@ def get_deferred_updates(session):
             deferred.append((type(obj), filters, update))
     return deferred
 
+def rows_for_tables(model, data):
+    """
+    Splits a fixture record into one row per mapped table (more than one
+    when joined table inheritance is used), keyed by column key
+    """
+    mapper = inspect(model)
+    data = dict(data)
+    if mapper.polymorphic_on is not None \
+            and mapper.polymorphic_identity is not None:
+        prop = mapper.get_property_by_column(mapper.polymorphic_on)
+        data.setdefault(prop.key, mapper.polymorphic_identity)
+
+    rows = SortedDict((table, {}) for table in mapper.tables)
+    for prop in mapper.column_attrs:
+        if prop.key not in data:
+            continue
+        for col in prop.columns:
+            if col.table in rows:
+                rows[col.table][col.key] = data[prop.key]
+    return rows
+
+def get_bulk_row_key(table, row):
+    """
+    Returns a key identifying the row by primary key, or None if
+    the primary key is incomplete
+    """
+    key = tuple(row.get(col.key) for col in table.primary_key.columns)
+    if not key or any(part is None for part in key):
+        return None
+    return (table, key)
+
 class Command(BaseCommand):
     help = 'Installs the named fixture(s) in the database.'
     missing_args_message = ("No database fixture specified. Please provide "
@@ -98,6 +133,18 @@ class Command(BaseCommand):
         '--format', action='store', dest='format', default=None,
         help='Format of serialized data when reading from stdin.',
       )
+      parser.add_argument(
+        '--bulk', action='store_true', dest='bulk', default=False,
+        help='Insert rows with executemany Core inserts, in table dependency '
+             'order, instead of building ORM instances. Model constructors, '
+             'flush hooks and per-object cache invalidation are skipped; '
+             'affected cache namespaces are bumped once at the end. Cached '
+             'models which no cache namespace covers are refused.'
+      )
+      parser.add_argument(
+        '--chunk-size', action='store', dest='chunk_size', type=int,
+        default=1000, help='The number of rows per executemany in bulk mode.',
+      )
 
     def handle(self, *fixture_labels, **options):
       self.ignore = options['ignore']
@@ -106,6 +153,8 @@ class Command(BaseCommand):
       self.verbosity = options['verbosity']
       #self.excluded_models, self.excluded_apps = parse_apps_and_model_labels(options['exclude'])
       self.format = options['format']
+      self.bulk = options['bulk']
+      self.chunk_size = options['chunk_size']
 
       '''
       with transaction.atomic(using=self.using):
@@ -130,6 +179,7 @@ class Command(BaseCommand):
         self.fixture_object_count = 0
         self.models = set()
 
+        register_builtin_serializers()
         self.serialization_formats = serializers.get_public_serializer_formats()
         # Forcing binary mode may be revisited after dropping Python 2 support (see #22399)
         self.compression_formats = {
@@ -155,8 +205,14 @@ class Command(BaseCommand):
         session = orm.sessionmaker()
         session.close()
         for fixture_label in fixture_labels:
-          self.load_label(fixture_label)
+          if self.bulk:
+            self.load_label_bulk(fixture_label)
+          else:
+            self.load_label(fixture_label)
         session.commit()
+        if self.bulk:
+          for ns in bump_cache_namespaces(self.models):
+            logger.info('Incremented cache namespace %r' % ns.name)
 
         # Since we disabled constraint checks, we must manually check for
         # any invalid keys that might have been added
@@ -280,6 +336,92 @@ class Command(BaseCommand):
             session.rollback()
             raise
 
+    def load_label_bulk(self, fixture_label):
+        """
+        Loads fixtures files for a given label, using Core inserts.
+        Rows are grouped by table and inserted in metadata.sorted_tables
+        order, with one executemany per chunk of rows sharing a column set.
+        """
+        session = orm.sessionmaker()
+        logger.info('Bulk loading fixture label: "%s"' % fixture_label)
+        table_rows = {}
+        for fixture_file, fixture_dir, fixture_name \
+                    in self.find_fixtures(fixture_label):
+            logger.info('  Loading fixture: %s' % fixture_file)
+            _, ser_fmt, cmp_fmt = self.parse_name(
+                    os.path.basename(fixture_file))
+            deserializer = get_raw_deserializer(ser_fmt)
+            if deserializer is None:
+                raise CommandError("Serialization format '%s' does not "
+                                   "support bulk loading" % ser_fmt)
+            open_method, mode = self.compression_formats[cmp_fmt]
+            fixture = open_method(fixture_file, mode)
+            try:
+                self.fixture_count += 1
+                objects_in_fixture = 0
+                for model, data in deserializer(fixture, using=self.using,
+                        ignorenonexistent=self.ignore):
+                    objects_in_fixture += 1
+                    self.models.add(model)
+                    rows = rows_for_tables(model, data)
+                    if len(rows) > 1 and any(get_bulk_row_key(t, r) is None
+                                             for t, r in rows.items()):
+                        raise CommandError(
+                            "%s rows span multiple tables, and require "
+                            "explicit primary keys in bulk mode"
+                            % model.__name__)
+                    for table, row in rows.items():
+                        ordered = table_rows.setdefault(table, SortedDict())
+                        # later fixtures override earlier rows with the
+                        # same identity, as in load_label
+                        key = get_bulk_row_key(table, row) \
+                            or ('new', len(ordered))
+                        ordered.pop(key, None)
+                        ordered[key] = row
+                self.loaded_object_count += objects_in_fixture
+                self.fixture_object_count += objects_in_fixture
+            except Exception as e:
+                if not isinstance(e, CommandError):
+                    e.args = ("Problem installing fixture '%s': %s" 
+                              % (fixture_file, e),)
+                raise
+            finally:
+                fixture.close()
+
+            if objects_in_fixture == 0:
+                warnings.warn(
+                    "No fixture data found for '%s'. (File format may be "
+                    "invalid.)" % fixture_name, RuntimeWarning
+                )
+
+        if getattr(settings, 'CACHE_ENABLED', False):
+            uncovered = get_uncovered_models(self.models)
+            if uncovered:
+                raise CommandError(
+                    "%s cannot be bulk loaded: no cache namespace covers "
+                    "their cached entries, which would be left stale. Load "
+                    "them without --bulk"
+                    % ', '.join(model.__name__ for model in uncovered))
+
+        try:
+            connection = session.connection()
+            for table in orm.Base.metadata.sorted_tables:
+                if table not in table_rows:
+                    continue
+                # executemany requires a consistent set of keys
+                groups = SortedDict()
+                for row in table_rows.pop(table).values():
+                    groups.setdefault(tuple(sorted(row)), []).append(row)
+                for rows in groups.values():
+                    for i in range(0, len(rows), self.chunk_size):
+                        connection.execute(table.insert(),
+                                           rows[i:i+self.chunk_size])
+                    logger.info('  Inserted %d row(s) into %s'
+                                % (len(rows), table.fullname))
+        except:
+            session.rollback()
+            raise
+
     def _find_fixtures(self, fixture_label):
         """
         Finds fixture files for a given label.
@@ -159,6 +159,12 @@ class Preconfiguration(object):
     context = self.context
     return render_tpls(self.module_tpls, context)
 
+  @property
+  def index_key(self):
+    " returns the values which determine the module names "
+    return (self.root, self.base, self.prefixes, self.suffixes,
+            self.module_args, sorted(self.context.items()))
+
 
   def load_values(self):
     """ get values for preconfig arguments """
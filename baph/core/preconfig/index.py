@@ -0,0 +1,209 @@
+"""
+A small on-disk index of preconfig lookups (distribution roots, package
+paths, and which settings modules exist), so that process start and
+call_command don't need to probe the filesystem for every candidate
+module, or scan distributions via pkg_resources.
+
+Each entry records the mtimes of the directories it was derived from, and
+is discarded when any of them change (ie. when a settings module is added
+or removed). The index lives in the bytecode cache directory, and is
+disabled along with it.
+
+Lookups which depend on the import machinery are keyed by the process
+environment (see `get_environment`), and are checked against the current
+sys.path whenever they're read.
+
+Processes with different environments share the index file, so each save
+merges the entries on disk with the ones set by this process, drops the
+stale ones, and keeps at most MAX_ENTRIES of the most recently set. The
+file is replaced atomically; concurrent savers may drop each other's
+newest entries, which are simply looked up again.
+"""
+import hashlib
+import imp
+import json
+import os
+import sys
+import tempfile
+import time
+
+from baph.utils.bytecode import get_cache_dir
+
+
+INDEX_FILENAME = 'preconfig-index.json'
+MAX_ENTRIES = 500
+
+_default_index = None
+
+
+def get_mtime(path):
+  try:
+    return os.stat(path).st_mtime
+  except OSError:
+    return None
+
+def get_environment():
+  " returns the parts of the process state which affect import lookups "
+  path = json.dumps([os.path.abspath(entry) for entry in sys.path])
+  return (sys.executable, hashlib.sha1(path).hexdigest(), os.getcwd())
+
+def is_import_path(package, path):
+  """
+  Returns True if path is the directory the import machinery currently
+  finds package in. Packages found by something other than a plain
+  directory on sys.path (or on the parent package's __path__) are never
+  considered current
+  """
+  if '.' in package:
+    parent, name = package.rsplit('.', 1)
+    search_path = getattr(sys.modules.get(parent), '__path__', None)
+    if search_path is None:
+      return False
+  else:
+    name = package
+    search_path = sys.path
+  for entry in search_path:
+    candidate = os.path.join(os.path.abspath(entry), name)
+    if os.path.isdir(candidate):
+      for init in ('__init__.py', '__init__.pyc'):
+        if os.path.exists(os.path.join(candidate, init)):
+          return candidate == os.path.abspath(path)
+    for suffix, mode, type_ in imp.get_suffixes():
+      if os.path.exists(candidate + suffix):
+        # shadowed by a module
+        return False
+  return False
+
+class PreconfigIndex(object):
+  def __init__(self, path):
+    self.path = path
+    self._entries = None
+    self._updated = {}
+
+  @classmethod
+  def default(cls):
+    " returns the shared index for this process "
+    global _default_index
+    if _default_index is None:
+      cache_dir = get_cache_dir()
+      if not cache_dir:
+        return None
+      _default_index = cls(os.path.join(cache_dir, INDEX_FILENAME))
+    return _default_index
+
+  @staticmethod
+  def make_key(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+
+  def load(self):
+    " returns the entries currently on disk "
+    try:
+      with open(self.path, 'rb') as fp:
+        entries = json.load(fp)
+    except (IOError, ValueError):
+      return {}
+    if not isinstance(entries, dict):
+      return {}
+    return entries
+
+  @property
+  def entries(self):
+    if self._entries is None:
+      self._entries = self.load()
+    return self._entries
+
+  @staticmethod
+  def is_stale(entry):
+    for path, mtime in entry['dirs'].items():
+      if get_mtime(path) != mtime:
+        return True
+    return False
+
+  def get(self, key, default=None):
+    """
+    Returns the value stored for key, or default if there is no entry,
+    or the entry is stale
+    """
+    entry = self.entries.get(key)
+    if not entry or self.is_stale(entry):
+      return default
+    return entry['value']
+
+  def set(self, key, value, dirs):
+    """
+    Stores value for key, to be invalidated when any of dirs change
+    """
+    entry = {
+      'value': value,
+      'dirs': dict((path, get_mtime(path)) for path in dirs),
+      'time': time.time(),
+    }
+    self.entries[key] = entry
+    self._updated[key] = entry
+    self.save()
+
+  def prune(self, entries):
+    " returns entries without the stale ones, capped at MAX_ENTRIES "
+    valid = []
+    for key, entry in entries.items():
+      try:
+        if self.is_stale(entry):
+          continue
+      except (KeyError, AttributeError):
+        # written by an older version
+        continue
+      valid.append((entry.get('time', 0), key))
+    valid.sort(reverse=True)
+    return dict((key, entries[key]) for _, key in valid[:MAX_ENTRIES])
+
+  def save(self):
+    """
+    Merges the entries set by this process into the ones on disk, and
+    replaces the index file with the result
+    """
+    entries = self.load()
+    entries.update(self._updated)
+    entries = self.prune(entries)
+    dirname = os.path.dirname(self.path)
+    try:
+      fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    except (IOError, OSError):
+      return
+    try:
+      with os.fdopen(fd, 'wb') as fp:
+        json.dump(entries, fp)
+      os.rename(tmp_path, self.path)
+    except (IOError, OSError):
+      try:
+        os.remove(tmp_path)
+      except OSError:
+        pass
+      return
+    self._entries = entries
+    self._updated = {}
+
+def cached_lookup(parts, dirs, func, validate=None):
+  """
+  Returns func(), using the value stored in the default index under
+  parts if it is still valid. dirs may be a callable taking the result,
+  for lookups whose directories are only known afterwards. validate is
+  an optional callable taking a stored value, which returns False when
+  the value must be looked up again
+  """
+  index = PreconfigIndex.default()
+  if index is None:
+    return func()
+  try:
+    key = index.make_key(*parts)
+  except TypeError:
+    # parts which can't be serialized are never indexed
+    return func()
+  value = index.get(key)
+  if value is not None and (validate is None or validate(value)):
+    return value
+  value = func()
+  if value is not None:
+    if callable(dirs):
+      dirs = dirs(value)
+    index.set(key, value, dirs)
+  return value
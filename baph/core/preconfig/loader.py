@@ -1,28 +1,45 @@
 import imp
 import inspect
 import os
-from pkg_resources import get_distribution
 import sys
 
 from .config import Preconfiguration
+from .index import cached_lookup, get_environment, is_import_path
 from .utils import load_preconfig_profile
 
 
 PRECONFIG_MODULE_NAME = 'preconfig'
 CONFIG_FOLDERS = ('', 'config', 'conf')
 
+def find_app_root(app):
+  " returns the location of an app, using its distribution "
+  from pkg_resources import get_distribution
+  dist = get_distribution(app)
+  return os.path.join(dist.location, app)
+
 class PreconfigLoader(object):
   cache = {}
+  roots = {}
 
   def __init__(self):
     raise Exception('PreconfigLoader is not initializable')
 
+  @classmethod
+  def get_app_root(cls, app):
+    " returns the location of an app, skipping the pkg_resources scan "
+    " when the location is already indexed "
+    if app not in cls.roots:
+      cls.roots[app] = cached_lookup(
+        ('root', app) + get_environment(),
+        lambda root: [root],
+        lambda: find_app_root(app),
+        lambda root: is_import_path(app, root))
+    return cls.roots[app]
+
   @classmethod
   def load(cls, root=None):
     if root is None and 'BAPH_APP' in os.environ:
-      app = os.environ['BAPH_APP']
-      dist = get_distribution(app)
-      root = os.path.join(dist.location, app)
+      root = cls.get_app_root(os.environ['BAPH_APP'])
       '''
       try:
         _, root, _ = imp.find_module(app, sys.path)
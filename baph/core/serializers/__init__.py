@@ -0,0 +1,29 @@
+from django.core import serializers
+from django.utils.importlib import import_module
+
+
+# serialization formats provided by baph, in addition to those
+# listed in settings.SERIALIZATION_MODULES
+BUILTIN_SERIALIZERS = {
+    'jsonl': 'baph.core.serializers.jsonl',
+}
+
+def register_builtin_serializers():
+    """
+    Registers the baph serializers which haven't been overridden
+    via settings.SERIALIZATION_MODULES
+    """
+    formats = serializers.get_serializer_formats()
+    for format, module in BUILTIN_SERIALIZERS.items():
+        if format not in formats:
+            serializers.register_serializer(format, module)
+
+def get_raw_deserializer(format):
+    """
+    Returns the RawDeserializer for the given format, which yields
+    (Model, data) pairs instead of model instances, or None if the
+    format doesn't provide one
+    """
+    deserializer = serializers.get_deserializer(format)
+    module = import_module(deserializer.__module__)
+    return getattr(module, 'RawDeserializer', None)
@@ -4,6 +4,8 @@ from sqlalchemy import inspect
 from sqlalchemy.orm.attributes import instance_dict
 from sqlalchemy.orm.properties import ColumnProperty
 
+from baph.db.types import unwrap_json
+
 
 class Serializer(BaseSerializer):
     def serialize(self, queryset, **options):
@@ -26,7 +28,7 @@ class Serializer(BaseSerializer):
                 #    continue
                 if attr.name not in obj.__dict__:
                     continue
-                self._current[attr.name] = obj.__dict__[attr.name]
+                self._current[attr.name] = unwrap_json(obj.__dict__[attr.name])
             self.end_object(obj)
             if self.first:
                 self.first = False
@@ -9,6 +9,7 @@ import sys
 
 from baph.core.serializers.python import Serializer as PythonSerializer
 from baph.core.serializers.python import Deserializer as PythonDeserializer
+from baph.core.serializers.python import RawDeserializer as PythonRawDeserializer
 from django.core.serializers.base import DeserializationError
 from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import six
@@ -80,3 +81,18 @@ def Deserializer(stream_or_string, **options):
     except Exception as e:
         six.reraise(DeserializationError, DeserializationError(e), 
                     sys.exc_info()[2])
+
+def RawDeserializer(stream_or_string, **options):
+    """
+    Deserialize a stream or string of JSON data into (Model, data) pairs.
+    """
+    if not isinstance(stream_or_string, (bytes, six.string_types)):
+        stream_or_string = stream_or_string.read()
+    if isinstance(stream_or_string, bytes):
+        stream_or_string = stream_or_string.decode('utf8')
+    try:
+        objects = json.loads(stream_or_string)
+    except Exception as e:
+        six.reraise(DeserializationError, DeserializationError(e), 
+                    sys.exc_info()[2])
+    return PythonRawDeserializer(objects, **options)
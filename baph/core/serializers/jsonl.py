@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import sys
+
+from baph.core.serializers.json import Serializer as JSONSerializer
+from baph.core.serializers.python import Deserializer as PythonDeserializer
+from baph.core.serializers.python import RawDeserializer as PythonRawDeserializer
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import six
+
+
+class Serializer(JSONSerializer):
+    """
+    Convert a queryset to JSON-lines (one JSON object per line).
+    """
+    internal_use_only = False
+
+    def start_serialization(self):
+        if json.__version__.split('.') >= ['2', '1', '3']:
+            # Use JS strings to represent Python Decimal instances (ticket #16850)
+            self.options.update({'use_decimal': False})
+        self._current = None
+        self.json_kwargs = self.options.copy()
+        self.json_kwargs.pop('stream', None)
+        self.json_kwargs.pop('fields', None)
+        # indentation would break the one-object-per-line format
+        self.json_kwargs.pop('indent', None)
+
+    def end_serialization(self):
+        pass
+
+    def end_object(self, obj):
+        self.stream.write(json.dumps(self.get_dump_object(obj),
+                                     cls=DjangoJSONEncoder,
+                                     **self.json_kwargs))
+        self.stream.write("\n")
+        self._current = None
+
+def _iter_lines(stream_or_string):
+    if isinstance(stream_or_string, bytes):
+        stream_or_string = stream_or_string.decode('utf8')
+    if isinstance(stream_or_string, six.string_types):
+        stream_or_string = stream_or_string.splitlines()
+    for line in stream_or_string:
+        if isinstance(line, bytes):
+            line = line.decode('utf8')
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def Deserializer(stream_or_string, **options):
+    """
+    Deserialize a stream or string of JSON-lines data, one line at a time.
+    """
+    try:
+        for obj in PythonDeserializer(_iter_lines(stream_or_string),
+                                      **options):
+            yield obj
+    except (GeneratorExit, AttributeError):
+        # loaddata skips AttributeErrors (see the json Deserializer)
+        raise
+    except Exception as e:
+        six.reraise(DeserializationError, DeserializationError(e),
+                    sys.exc_info()[2])
+
+def RawDeserializer(stream_or_string, **options):
+    """
+    Deserialize a stream or string of JSON-lines data into (Model, data)
+    pairs, one line at a time.
+    """
+    return PythonRawDeserializer(_iter_lines(stream_or_string), **options)
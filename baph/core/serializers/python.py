@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.utils.encoding import smart_text, is_protected_type
 from sqlalchemy.orm.util import identity_key
 
@@ -44,6 +45,14 @@ def Deserializer(object_list, **options):
     It's expected that you pass the Python objects themselves (instead of a
     stream or a string) to the constructor
     """
+    for Model, data in RawDeserializer(object_list, **options):
+        yield Model(**data)
+
+def RawDeserializer(object_list, **options):
+    """
+    Deserialize simple Python objects into (Model, data) pairs, without
+    instantiating the models. Used for bulk (Core) loading
+    """
     db = options.pop('using', DEFAULT_DB_ALIAS)
     get_apps()
     for d in object_list:
@@ -56,12 +65,12 @@ def Deserializer(object_list, **options):
         # Handle each field
         for (field_name, field_value) in d.iteritems():
             if isinstance(field_value, str):
-                field_value = smart_unicode(field_value, 
+                field_value = smart_text(field_value, 
                     options.get("encoding", settings.DEFAULT_CHARSET), 
                     strings_only=True)
             data[field_name] = field_value
 
-        yield Model(**data)
+        yield (Model, data)
 
 def _get_model(model_identifier):
     """
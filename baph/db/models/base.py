@@ -17,14 +17,16 @@ from sqlalchemy.orm.interfaces import MANYTOONE
 from sqlalchemy.orm.properties import ColumnProperty, RelationshipProperty
 from sqlalchemy.orm.session import Session
 from sqlalchemy.orm.util import has_identity, identity_key
-from sqlalchemy.schema import ForeignKeyConstraint
+from sqlalchemy.schema import Column, ForeignKeyConstraint
 
+from baph.apps.lazy import LazyClassRegistry, suspend_loading
 from baph.db import ORM
 from baph.db.models import signals
 from baph.db.models.loading import get_model, register_models
 from baph.db.models.mixins import CacheMixin, GlobalMixin, ModelPermissionMixin
 from baph.db.models.options import Options
-from baph.db.models.utils import key_to_value
+from baph.db.models.utils import keys_to_values
+from baph.db.types import unwrap_json
 from baph.utils.functional import cachedclassproperty
 from baph.utils.importing import remove_class
 from baph.utils.module_loading import import_string
@@ -50,17 +52,35 @@ def set_default_schema(constraint, compiler, **kw):
     return compiler.visit_foreign_key_constraint(constraint, **kw)
 
 
-def constructor(self, **kwargs):
-    cls = type(self)
+# per-class plans, compiled on first use. These are cleared whenever mappers
+# are (re)configured, as new backrefs may add attributes to existing classes
+_constructor_plans = {} # (defaults, valid kwarg names), used by constructor
+_dict_serializers = {} # (columns, extra props), used by Model.to_dicts
+_flush_hooks = {} # batch hook (or None), used by before_flush
 
-    # auto-populate default values on init
+@event.listens_for(mapper, 'after_configured')
+def reset_compiled_plans():
+    _constructor_plans.clear()
+    _dict_serializers.clear()
+    _flush_hooks.clear()
+
+def get_constructor_plan(cls):
+    """
+    Returns a tuple of (defaults, attrs) for cls, where defaults is a
+    list of (key, default, is_callable) for each single-column attribute
+    with a python-side default, and attrs is a frozenset of the names
+    which are known to be valid kwargs
+    """
+    plan = _constructor_plans.get(cls)
+    if plan is not None:
+        return plan
+
+    defaults = []
     for attr in cls.__mapper__.all_orm_descriptors:
         if not hasattr(attr, 'property'):
             continue
         if not isinstance(attr.property, ColumnProperty):
             continue
-        if attr.key in kwargs:
-            continue
         if len(attr.property.columns) != 1:
             continue
         col = attr.property.columns[0]
@@ -69,19 +89,51 @@ def constructor(self, **kwargs):
         if col.default is None:
             continue
         default = col.default.arg
-        if callable(default):
-            setattr(self, attr.key, default({}))
+        defaults.append((attr.key, default, callable(default)))
+
+    attrs = frozenset(name for name in dir(cls) if not name.startswith('__'))
+    plan = _constructor_plans[cls] = (defaults, attrs)
+    return plan
+
+def constructor(self, **kwargs):
+    cls = type(self)
+    defaults, attrs = get_constructor_plan(cls)
+
+    # auto-populate default values on init
+    for key, default, is_callable in defaults:
+        if key in kwargs:
+            continue
+        if is_callable:
+            setattr(self, key, default({}))
         else:
-            setattr(self, attr.key, default)
+            setattr(self, key, default)
 
     # now load in the kwargs values
     for k in kwargs:
-        if not hasattr(cls, k):
+        if k not in attrs and not hasattr(cls, k):
             raise TypeError('%r is an invalid keyword argument for %s' %
                             (k, cls.__name__))
         setattr(self, k, kwargs[k])
 
 
+def get_dict_serializer(cls):
+    """
+    Returns a tuple of (columns, extra_props) for cls, where columns is a
+    list of (key, column) for each single-column attribute, and
+    extra_props contains the names in _meta.extra_dict_props
+    """
+    serializer = _dict_serializers.get(cls)
+    if serializer is not None:
+        return serializer
+
+    columns = []
+    for attr in inspect(cls).column_attrs:
+        columns.append((attr.key, attr.columns[0]))
+    extra_props = tuple(cls._meta.extra_dict_props)
+    serializer = _dict_serializers[cls] = (tuple(columns), extra_props)
+    return serializer
+
+
 @event.listens_for(mapper, 'mapper_configured')
 def set_polymorphic_base_mapper(mapper_, class_):
     if mapper_.polymorphic_on is not None:
@@ -178,7 +230,7 @@ class Model(CacheMixin, ModelPermissionMixin, GlobalMixin):
         elif isinstance(value, dict):
             return {k: self.dictify(v) for k, v in value.items()}
         else:
-            return value
+            return unwrap_json(value)
 
     def to_dict(self):
         '''Creates a dictionary out of the column properties of the object.
@@ -187,17 +239,56 @@ class Model(CacheMixin, ModelPermissionMixin, GlobalMixin):
 
         :rtype: :class:`dict`
         '''
-        __dict__ = dict([(key, val) for key, val in self.__dict__.iteritems()
+        __dict__ = dict([(key, unwrap_json(val))
+                         for key, val in self.__dict__.iteritems()
                          if not key.startswith('_sa_')])
         if len(__dict__) == 0:
             for attr in inspect(type(self)).column_attrs:
-                __dict__[attr.key] = getattr(self, attr.key)
+                __dict__[attr.key] = unwrap_json(getattr(self, attr.key))
 
         for key in self._meta.extra_dict_props:
             value = getattr(self, key)
             __dict__[key] = self.dictify(value)
         return __dict__
 
+    @classmethod
+    def to_dicts(cls, objs, rows=False):
+        '''Bulk version of :meth:`to_dict`, using a per-class compiled list
+        of column attributes. Unlike :meth:`to_dict`, only column attributes
+        and ``extra_dict_props`` are included; relations which happen to be
+        loaded are not.
+
+        If ``rows`` is True, ``objs`` are Core result rows (for example,
+        from ``session.execute(cls.__table__.select())``), which are read
+        directly without building instances. ``extra_dict_props`` require
+        an instance, so they are omitted in this mode, as are
+        ``column_property`` expressions, which a table select doesn't
+        include.
+
+        :rtype: :class:`list` of :class:`dict`
+        '''
+        if rows:
+            columns = [(key, col) for key, col in get_dict_serializer(cls)[0]
+                       if isinstance(col, Column)]
+            return [dict((key, unwrap_json(row[col])) for key, col in columns)
+                    for row in objs]
+
+        results = []
+        for obj in objs:
+            columns, extra_props = get_dict_serializer(type(obj))
+            state = obj.__dict__
+            try:
+                data = dict((key, unwrap_json(state[key]))
+                            for key, col in columns)
+            except KeyError:
+                # some attributes are deferred or expired
+                data = dict((key, unwrap_json(getattr(obj, key)))
+                            for key, col in columns)
+            for key in extra_props:
+                data[key] = obj.dictify(getattr(obj, key))
+            results.append(data)
+        return results
+
     @property
     def is_deleted(self):
         return False
@@ -224,6 +315,16 @@ class Model(CacheMixin, ModelPermissionMixin, GlobalMixin):
         " the public hook for instance preprocessing before a flush event "
         pass
 
+    @classmethod
+    def before_flush_many(cls, session, objs, add):
+        " runs the before_flush hooks for a batch of instances of the class. "
+        " override to preprocess all of the flushed instances at once "
+        attrs = cls.before_flush_attrs
+        for obj in objs:
+            for attr in attrs:
+                attr.before_flush(session, add, instance=obj)
+            obj.before_flush(session, add)
+
     @property
     def updated_fields(self):
         " returns a list of fields that have been modified "
@@ -236,12 +337,52 @@ class Model(CacheMixin, ModelPermissionMixin, GlobalMixin):
         return changed
 
 
+def call_before_flush(session, objs, add):
+    for obj in objs:
+        obj._before_flush(session, add)
+
+def get_flush_hook(cls):
+    """
+    Returns a callable which runs the before_flush hooks for a list of
+    instances of cls, or None if cls has no hooks to run
+    """
+    try:
+        return _flush_hooks[cls]
+    except KeyError:
+        pass
+
+    hook = None
+    if not hasattr(cls, '_before_flush'):
+        pass
+    elif cls._before_flush.im_func is not Model._before_flush.im_func:
+        # the private routine was overridden, so it must be called as-is
+        hook = call_before_flush
+    elif (cls.before_flush_attrs
+            or cls.before_flush.im_func is not Model.before_flush.im_func
+            or cls.before_flush_many.im_func
+                is not Model.before_flush_many.im_func):
+        hook = cls.before_flush_many
+    _flush_hooks[cls] = hook
+    return hook
+
+def dispatch_before_flush(session, objs, add):
+    """
+    Groups objs by class, and runs the before_flush hooks once per class
+    which defines any
+    """
+    by_class = defaultdict(list)
+    for obj in objs:
+        by_class[type(obj)].append(obj)
+    for cls, cls_objs in by_class.items():
+        hook = get_flush_hook(cls)
+        if hook is not None:
+            hook(session, cls_objs, add)
+
 @event.listens_for(Session, 'before_flush')
 def before_flush(session, flush_context, instances):
-    for obj in session.new:
-        obj._before_flush(session, add=True)
-    for obj in session.dirty:
-        obj._before_flush(session, add=False)
+    dispatch_before_flush(session, session.new, True)
+    # hooks for new objects may modify others, so check dirty afterwards
+    dispatch_before_flush(session, session.dirty, False)
 
 
 def normalize_args(args):
@@ -272,15 +413,17 @@ class ModelBase(type):
         # print('%s.__init__(%s)' % (name, cls))
         found = False
         registry = cls._decl_class_registry
-        if name in registry:
-            found = True
-        elif cls in registry.values():
-            found = True
-            add_class(name, cls)
-
-        if '_decl_class_registry' not in cls.__dict__:
-            if not found:
-                _as_declarative(cls, name, cls.__dict__)
+        # registry lookups must not import other modules defining name
+        with suspend_loading():
+            if name in registry:
+                found = True
+            elif cls in registry.values():
+                found = True
+                add_class(name, cls)
+
+            if '_decl_class_registry' not in cls.__dict__:
+                if not found:
+                    _as_declarative(cls, name, cls.__dict__)
 
         type.__init__(cls, name, bases, attrs)
 
@@ -299,8 +442,9 @@ class ModelBase(type):
         new_class = super_new(cls, name, bases, {'__module__': module})
 
         # check the class registry to see if we created this already
-        if name in new_class._decl_class_registry:
-            return new_class._decl_class_registry[name]
+        with suspend_loading():
+            if name in new_class._decl_class_registry:
+                return new_class._decl_class_registry[name]
 
         attr_meta = attrs.pop('Meta', None)
         if not attr_meta:
@@ -327,7 +471,10 @@ class ModelBase(type):
                 # an alias to the base class, rather than trying to create a
                 # new class under a second name
                 base_cls = bases[0]
-                base_cls.add_to_class('_meta', new_class._meta)
+                # the options have already been contributed to new_class, and
+                # can't be contributed again, so they are moved to the base
+                new_class._meta.model = base_cls
+                base_cls._meta = new_class._meta
                 register_models(base_cls._meta.app_label, base_cls)
                 return base_cls
 
@@ -439,6 +586,7 @@ class ModelBase(type):
 
 
 def get_declarative_base(**kwargs):
+    kwargs.setdefault('class_registry', LazyClassRegistry())
     return declarative_base(
         cls=Model,
         metaclass=ModelBase,
@@ -458,18 +606,55 @@ def kill_cache(mapper, connection, target):
     target.kill_cache()
 
 
+def get_global_candidates(session):
+    """
+    Returns the objects in the session whose global status may need to be
+    derived from their global_parents. Only new and modified objects are
+    considered, unless an object was globalized since the last flush, in
+    which case unmodified children in the session may be affected too
+    """
+    candidates = []
+    globalized = False
+    for obj in session.new:
+        if obj._meta.global_parents:
+            candidates.append(obj)
+    for obj in session.dirty:
+        if obj._meta.global_parents:
+            candidates.append(obj)
+        if not globalized and obj._meta.global_column:
+            history = attributes.get_history(obj, obj._meta.global_column)
+            globalized = any(history.added)
+    if globalized:
+        candidates = [obj for obj in session if obj._meta.global_parents]
+    return candidates
+
 @event.listens_for(Session, 'before_flush')
 def check_global_status(session, flush_context, instances):
     """
     If global_parents is defined, we check the parents to see if any of them
     are global. If a global parent is found, we set the child to global as well
     """
-    for target in session:
-        if target._meta.global_parents:
-            if target.is_globalized():
-                continue
-            for parent_rel in target._meta.global_parents:
-                parent = key_to_value(target, parent_rel, raw=True)
-                if parent and parent.is_globalized():
-                    target.globalize(commit=False)
+    pending = [obj for obj in get_global_candidates(session)
+               if not obj.is_globalized()]
+    while pending:
+        by_class = defaultdict(list)
+        for target in pending:
+            by_class[type(target)].append(target)
+
+        changed = False
+        for cls, targets in by_class.items():
+            for parent_rel in cls._meta.global_parents:
+                targets = [t for t in targets if not t.is_globalized()]
+                if not targets:
                     break
+                # resolve this parent for all targets in one pass
+                parents = keys_to_values(targets, parent_rel, raw=True)
+                for target, parent in zip(targets, parents):
+                    if parent and parent.is_globalized():
+                        target.globalize(commit=False)
+                        changed = True
+
+        # newly globalized objects may be the parents of other candidates
+        if not changed:
+            break
+        pending = [obj for obj in pending if not obj.is_globalized()]
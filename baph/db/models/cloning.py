@@ -1,13 +1,16 @@
+from collections import defaultdict
 import copy
 
 from sqlalchemy import inspect
 from sqlalchemy.orm import class_mapper
-from sqlalchemy.orm.attributes import instance_dict
+from sqlalchemy.orm.attributes import instance_dict, set_committed_value
 from sqlalchemy.orm.collections import MappedCollection
 from sqlalchemy.orm.properties import ColumnProperty, RelationshipProperty
 from sqlalchemy.orm.session import object_session
 from sqlalchemy.orm.util import identity_key
+from sqlalchemy.sql.expression import BinaryExpression
 
+from baph.db.models.utils import column_to_attr
 from baph.db.orm import ORM
 from baph.utils.collections import duck_type_collection
 
@@ -31,6 +34,37 @@ def reload_object(instance):
     .one()
   return instance
 
+def reload_objects(instances):
+  """
+  Reloads a list of instances with the correct polymorphic subclasses,
+  using one query per base class. Returns the reloaded instances, in the
+  same order
+  """
+  groups = defaultdict(list)
+  for i, instance in enumerate(instances):
+    cls, pk_vals = identity_key(instance=instance)
+    groups[cls].append((i, instance, pk_vals))
+
+  results = list(instances)
+  for cls, items in groups.items():
+    pk_cols = inspect(cls).primary_key
+    if len(pk_cols) != 1:
+      # composite keys can't be matched with a single IN
+      for i, instance, pk_vals in items:
+        results[i] = reload_object(instance)
+      continue
+    session = object_session(items[0][1])
+    for i, instance, pk_vals in items:
+      session.expunge(instance)
+    pk_attr = column_to_attr(cls, pk_cols[0])
+    query = session.query(cls) \
+      .with_polymorphic('*') \
+      .filter(pk_attr.in_([pk_vals[0] for i, instance, pk_vals in items]))
+    loaded = dict((getattr(obj, pk_attr.key), obj) for obj in query)
+    for i, instance, pk_vals in items:
+      results[i] = loaded[pk_vals[0]]
+  return results
+
 def get_polymorphic_subclass(instance):
   """
   Return the appropriate polymorphic subclass for an instance which may not 
@@ -80,9 +114,9 @@ def get_default_excludes(cls):
   for table in mapper.tables:
     # do not copy primary key columns
     exclude_cols.update(table.primary_key.columns)
-    for fkc in table.foreign_key_constraints:
+    for fk in table.foreign_keys:
       # do not copy foreign key columns
-      exclude_cols.update(fkc.columns)
+      exclude_cols.add(fk.parent)
 
   props = map(mapper.get_property_by_column, exclude_cols)
   keys = set(prop.key for prop in props)
@@ -104,6 +138,61 @@ def get_default_columns(cls):
     columns.add(key)
   return columns
 
+def can_prefetch(prop):
+  """
+  Returns True if a relationship can be loaded for many parents with a
+  single IN query (a plain single-column join, with no secondary table
+  or additional join criteria)
+  """
+  return (prop.secondary is None
+    and len(prop.local_remote_pairs) == 1
+    and isinstance(prop.primaryjoin, BinaryExpression)
+    and prop.lazy not in ('dynamic', 'noload'))
+
+def prefetch_relationship(session, prop, parents):
+  """
+  Loads a relationship for all parents which haven't loaded it yet, using
+  a single IN query, and populates the relationship on each parent. The
+  related objects are loaded with their polymorphic subclasses
+  """
+  parents = [p for p in parents if prop.key not in instance_dict(p)]
+  if not parents:
+    return
+
+  local_col, remote_col = prop.local_remote_pairs[0]
+  local_attr = column_to_attr(prop.parent.class_, local_col)
+  target = prop.mapper.class_
+  remote_attr = column_to_attr(target, remote_col)
+
+  values = set(getattr(p, local_attr.key) for p in parents)
+  values.discard(None)
+  children = []
+  if values:
+    query = session.query(target) \
+      .with_polymorphic('*') \
+      .filter(remote_attr.in_(values))
+    if prop.order_by:
+      query = query.order_by(*prop.order_by)
+    children = query.all()
+
+  # objects already in the identity map may be of the wrong class
+  stale = [i for i, child in enumerate(children)
+           if type(child) != get_polymorphic_subclass(child)]
+  if stale:
+    reloaded = reload_objects([children[i] for i in stale])
+    for i, child in zip(stale, reloaded):
+      children[i] = child
+
+  groups = defaultdict(list)
+  for child in children:
+    groups[getattr(child, remote_attr.key)].append(child)
+  for parent in parents:
+    related = groups.get(getattr(parent, local_attr.key), [])
+    if prop.uselist:
+      set_committed_value(parent, prop.key, related)
+    else:
+      set_committed_value(parent, prop.key, related[0] if related else None)
+
 def is_column(prop):
   return prop.strategy_wildcard_key == 'column'
 
@@ -111,9 +200,40 @@ def is_relationship(prop):
   return prop.strategy_wildcard_key == 'relationship'
 
 
+class IdentityKey(object):
+  """
+  Wraps an unhashable object (ie. a ruleset) for use in a dict key. Keys
+  are equal only for the same object, which the key keeps alive, so the
+  object's id can't be reused while the key exists
+  """
+  __slots__ = ('obj',)
+
+  def __init__(self, obj):
+    self.obj = obj
+
+  def __hash__(self):
+    return id(self.obj)
+
+  def __eq__(self, other):
+    return isinstance(other, IdentityKey) and other.obj is self.obj
+
+  def __ne__(self, other):
+    return not self == other
+
+
 class CloneEngine(object):
-  def __init__(self, user=None, ruleset=None, registry=None, context=None):
+  """
+  Clones object trees according to cloning rules. If bulk is True, rules
+  and column lists are computed once per class/path instead of per
+  instance, and the tree is loaded one level at a time before cloning,
+  with one query per relation (and per polymorphic base class to be
+  reloaded) instead of per instance
+  """
+  def __init__(self, user=None, ruleset=None, registry=None, context=None,
+               bulk=False):
     self.root = None
+    self.bulk = bulk
+    self._plans = {}
     self.user = user
     self.ruleset = ruleset or {}
     if registry is None:
@@ -123,6 +243,101 @@ class CloneEngine(object):
       context = {}
     self.context = context
 
+  def memoize(self, key, func, *args):
+    """
+    In bulk mode, returns the cached result of func(*args) for key,
+    otherwise calls func
+    """
+    if not self.bulk:
+      return func(*args)
+    try:
+      return self._plans[key]
+    except KeyError:
+      value = self._plans[key] = func(*args)
+      return value
+
+  def resolve_rules(self, cls, base_cls, ruleset, rule_keys):
+    """
+    Returns the (ruleset, rule_keys, rules) to be used for an instance of
+    cls, given the ruleset and rule_keys passed down from its parent
+    """
+    if ruleset is None:
+      ruleset = self.ruleset
+    if not ruleset:
+      ruleset = self.memoize(('ruleset', cls), get_cloning_rules, cls)
+
+    rule_keys = rule_keys or []
+    if cls != base_cls:
+      rule_keys = rule_keys + [cls.__name__]
+    rule_keys = rule_keys + [base_cls.__name__]
+
+    rules = self.memoize(('rules', IdentityKey(ruleset), tuple(rule_keys)),
+                         self.get_rules, ruleset, rule_keys)
+    return ruleset, rule_keys, rules
+
+  def relationship_kwargs(self, prop, ruleset, rule_keys):
+    return self.memoize(
+      ('relationship', prop, IdentityKey(ruleset), tuple(rule_keys)),
+      self.get_relationship_kwargs, prop, ruleset, rule_keys)
+
+  def get_column_keys(self, cls, rules):
+    """
+    Returns the keys of the column attrs to be copied from an instance
+    """
+    excludes = self.memoize(('excludes', cls), get_default_excludes, cls)
+    excludes = excludes | set(rules.get('excludes', []))
+    return [prop.key for prop in inspect(cls).column_attrs
+            if prop.key not in excludes]
+
+  def prefetch(self, instance, cast_to=None):
+    """
+    Loads the tree which will be cloned from instance, one level at a time.
+    Relations which can't be prefetched are loaded lazily during cloning
+    """
+    session = object_session(instance)
+    if session is None:
+      return
+    level = [(instance, None, None, cast_to)]
+    seen = set([identity_key(instance=instance)])
+    while level:
+      by_relation = defaultdict(list)
+      for obj, ruleset, rule_keys, cast in level:
+        base_cls = identity_key(instance=obj)[0]
+        cls = cast or get_polymorphic_subclass(obj)
+        if type(obj) != cls:
+          # the root was not loaded polymorphically; clone_obj reloads it
+          continue
+        ruleset, rule_keys, rules = self.resolve_rules(
+          cls, base_cls, ruleset, rule_keys)
+        mapper = inspect(cls)
+        for key in rules.get('relations', []) + rules.get('relinks', []):
+          if not mapper.has_property(key):
+            continue
+          prop = mapper.get_property(key)
+          if not is_relationship(prop):
+            continue
+          kwargs = self.relationship_kwargs(prop, ruleset, rule_keys)
+          by_relation[prop].append((obj, kwargs))
+
+      level = []
+      for prop, items in by_relation.items():
+        if can_prefetch(prop):
+          prefetch_relationship(session, prop, [obj for obj, kw in items])
+        for obj, kwargs in items:
+          value = getattr(obj, prop.key)
+          if not value:
+            continue
+          if duck_type_collection(value) == dict:
+            value = value.values()
+          elif duck_type_collection(value) != list:
+            value = [value]
+          for child in value:
+            ident = identity_key(instance=child)
+            if ident in seen:
+              continue
+            seen.add(ident)
+            level.append((child, kwargs['ruleset'], kwargs['rule_keys'], None))
+
   @staticmethod
   def get_relationship_kwargs(prop, ruleset, rule_keys):
     related_class = prop.mapper.class_
@@ -163,16 +378,13 @@ class CloneEngine(object):
     cls = type(instance)
     mapper = inspect(cls)
 
-    excludes = get_default_excludes(cls)
-    excludes.update(rules.get('excludes', []))
+    column_keys = self.memoize(('columns', cls, IdentityKey(rules)),
+                               self.get_column_keys, cls, rules)
 
     data = {}    
 
-    for prop in mapper.column_attrs:
+    for key in column_keys:
       " start with all non-excluded column attrs "
-      key = prop.key
-      if key in excludes:
-        continue
       data[key] = getattr(instance, key)
 
     for key in rules.get('preserve', []):
@@ -236,17 +448,12 @@ class CloneEngine(object):
       instance = reload_object(instance)
     mapper = inspect(cls)
 
-    if ruleset is None:
-      ruleset = self.ruleset
-    if not ruleset:
-      ruleset = get_cloning_rules(cls)
+    if is_root and self.bulk:
+      # load the whole tree up front, a level at a time
+      self.prefetch(instance, cast_to)
 
-    rule_keys = rule_keys or []
-    if cls != base_cls:
-      rule_keys = rule_keys + [cls.__name__]
-    rule_keys = rule_keys + [base_cls.__name__]
-
-    rules = self.get_rules(ruleset, rule_keys)
+    ruleset, rule_keys, rules = self.resolve_rules(
+      cls, base_cls, ruleset, rule_keys)
     callback = rules.get('callback', None)
     if 'requires' in rules:
       required = set(rules['requires'])
@@ -282,7 +489,7 @@ class CloneEngine(object):
 
       value = getattr(instance, key)
 
-      kwargs = self.get_relationship_kwargs(prop, ruleset, rule_keys)
+      kwargs = self.relationship_kwargs(prop, ruleset, rule_keys)
       value = self.clone_collection(value, **kwargs)
       setattr(clone, key, value)
 
@@ -308,7 +515,7 @@ class CloneEngine(object):
     return clone
 
 def clone_obj(obj, user, rules=None, registry=None, path=None, root=None,
-              cast_to=None, context=None):
+              cast_to=None, context=None, bulk=False):
     """Clones an object and returns the clone.
 
     Default behavior is to only process columns (no relations), and
@@ -335,6 +542,10 @@ def clone_obj(obj, user, rules=None, registry=None, path=None, root=None,
         
     :param root: the top-level object. This is set automatically, and users
         should not need to use this field
+
+    :param bulk: if True, the tree is loaded a level at a time before
+        cloning (one query per relation rather than per object), and
+        rules are computed once per class and path. Use this for large trees
     
     Rule dictionaries can contain the following directives:
     
@@ -374,7 +585,8 @@ def clone_obj(obj, user, rules=None, registry=None, path=None, root=None,
       registry = {}
     if context is None:
       context = {}
-    engine = CloneEngine(user=user, registry=registry, context=context)
+    engine = CloneEngine(user=user, registry=registry, context=context,
+                         bulk=bulk)
     clone = engine.clone_obj(obj, cast_to=cast_to)
     return clone
 
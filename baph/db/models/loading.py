@@ -9,6 +9,8 @@ from django.utils.datastructures import SortedDict
 from django.utils.importlib import import_module
 from django.utils.module_loading import module_has_submodule
 from django.utils._os import upath
+
+from baph.apps.lazy import lazy_models_enabled
 #from django.utils import six
 
 
@@ -130,6 +132,18 @@ class AppCache(object):
             self.app_labels[self._label_for(models)] = models
         return models
 
+    def _load_lazy_app(self, app_label):
+        """
+        Loads the models module for app_label only, for lazy model loading
+        """
+        imp.acquire_lock()
+        try:
+            app_name = self.extract_app_name(app_label)
+            if app_name is not None and app_name not in self.handled:
+                self.load_app(app_name)
+        finally:
+            imp.release_lock()
+
     def app_cache_ready(self):
         """
         Returns true if the model cache is fully populated.
@@ -240,7 +254,10 @@ class AppCache(object):
 
         Returns None if no model is found.
         """
-        if seed_cache:
+        if seed_cache and not self.loaded and lazy_models_enabled():
+            # only import the models of the app being asked for
+            self._load_lazy_app(app_label)
+        elif seed_cache:
             self._populate()
         if only_installed and app_label not in self.app_labels:
             return None
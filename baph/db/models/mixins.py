@@ -6,19 +6,20 @@ import time
 import types
 
 from django.conf import settings
-from django.core.cache import get_cache
 from sqlalchemy import *
-from sqlalchemy import inspect
+from sqlalchemy import event, inspect
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.ext.declarative.clsregistry import _class_resolver
 from sqlalchemy.ext.hybrid import hybrid_method
-from sqlalchemy.orm import class_mapper, object_session
+from sqlalchemy.orm import class_mapper, mapper, object_session
 from sqlalchemy.orm.attributes import get_history, instance_dict
 from sqlalchemy.orm.properties import ColumnProperty, RelationshipProperty
 from sqlalchemy.orm.util import has_identity, identity_key
 
+from baph.core.cache.utils import get_cache, get_uncovered_models
 from baph.db import ORM
-from .utils import column_to_attr, class_resolver
+from baph.utils import geo
+from .utils import chunked, column_to_attr, class_resolver
 
 
 cache_logger = logging.getLogger('cache')
@@ -41,6 +42,19 @@ CACHE_KEY_MODES = (
   'asset',
 )
 
+# the permission key graph is static once mappers are configured, so
+# these are compiled on first use and reset when new mappers are configured
+_related_class_cache = {}
+_column_key_cache = {}
+_fks_cache = {}
+_normalized_key_cache = {}
+
+@event.listens_for(mapper, 'after_configured')
+def reset_permission_graph():
+    for cache in (_related_class_cache, _column_key_cache, _fks_cache,
+                  _normalized_key_cache):
+        cache.clear()
+
 class TimestampMixin(object):
 
     @declared_attr
@@ -98,7 +112,8 @@ class GeoMixin(object):
         lat_field = getattr(cls, field_names[0])
         lon_field = getattr(cls, field_names[1])
         diff = threshold / 69.0 # miles -> degree variance
-        filters = [
+        filters = cls.get_geohash_filters(lat, lon, threshold)
+        filters += [
             lat_field > lat - diff,
             lat_field < lat + diff,
             lon_field > lon - diff,
@@ -107,12 +122,117 @@ class GeoMixin(object):
             ]
         return filters
 
+    @classmethod
+    def get_geohash_filters(cls, lat, lon, radius):
+        """ returns a list containing a filter which limits results to the
+            geohash cells covering the search radius, or an empty list if
+            no geohash column is configured, or the radius is too large.
+            Rows without a geohash (ie. written before the column was added,
+            or by Core inserts) always pass, and are left to the other
+            filters """
+        if not cls._meta.geohash_field_name:
+            return []
+        prefixes = geo.geohash_prefixes(lat, lon, radius,
+                                        cls._meta.geohash_precision)
+        if not prefixes:
+            return []
+        col = getattr(cls, cls._meta.geohash_field_name)
+        # range comparisons (rather than LIKE) so an index can be used
+        return [or_(col == None, *[and_(col >= prefix, col < prefix + '~')
+                                   for prefix in sorted(prefixes)])]
+
+    @classmethod
+    def get_proximity_filters(cls, lat, lon, radius):
+        """ returns a list of sqla filters which narrow a query to the
+            candidates within radius (in miles) of the given point, using
+            only index-friendly comparisons (geohash prefix ranges and a
+            bounding box). Results must be checked exactly afterwards, ie
+            via rank_by_distance """
+        field_names = cls._meta.latlon_field_names
+        lat_field = getattr(cls, field_names[0])
+        lon_field = getattr(cls, field_names[1])
+        min_lat, min_lon, max_lat, max_lon = geo.bounding_box(lat, lon, radius)
+
+        filters = cls.get_geohash_filters(lat, lon, radius)
+        filters += [lat_field >= min_lat, lat_field <= max_lat]
+        if min_lon > max_lon:
+            # the box crosses the antimeridian
+            filters.append(or_(lon_field >= min_lon, lon_field <= max_lon))
+        elif (min_lon, max_lon) != (-180.0, 180.0):
+            filters += [lon_field >= min_lon, lon_field <= max_lon]
+        return filters
+
+    @classmethod
+    def rank_by_distance(cls, objs, lat, lon, radius=None):
+        """ sorts objs by distance (in miles) from the given point, computed
+            in bulk. If radius is given, farther objects are excluded.
+            Returns a list of (obj, distance) """
+        field_names = cls._meta.latlon_field_names
+        lats = [getattr(obj, field_names[0]) for obj in objs]
+        lons = [getattr(obj, field_names[1]) for obj in objs]
+        return geo.rank_by_distance(lat, lon, objs, lats, lons, radius)
+
+    @classmethod
+    def query_nearby(cls, lat, lon, radius, query=None):
+        """ returns a list of (obj, distance) for all objects within radius
+            (in miles) of the given point, nearest first. query can be
+            provided to apply additional filters """
+        if query is None:
+            from baph.db.orm import ORM
+            query = ORM.get().sessionmaker().query(cls)
+        candidates = query.filter(
+            *cls.get_proximity_filters(lat, lon, radius)).all()
+        return cls.rank_by_distance(candidates, lat, lon, radius)
+
+    def update_geohash(self):
+        """ sets the geohash column from the current coordinates """
+        field_names = self._meta.latlon_field_names
+        lat = getattr(self, field_names[0])
+        lon = getattr(self, field_names[1])
+        if lat is None or lon is None:
+            value = None
+        else:
+            value = geo.encode_geohash(float(lat), float(lon),
+                                       self._meta.geohash_precision)
+        if getattr(self, self._meta.geohash_field_name) != value:
+            setattr(self, self._meta.geohash_field_name, value)
+
+@event.listens_for(GeoMixin, 'before_insert', propagate=True)
+@event.listens_for(GeoMixin, 'before_update', propagate=True)
+def update_geohash(mapper, connection, target):
+    if target._meta.geohash_field_name:
+        target.update_geohash()
+
+def iter_related(value):
+    """
+    Yields the objects in a relation value (a single object, or a
+    list-like or dict-like collection)
+    """
+    from baph.db.orm import ORM
+    if isinstance(value, ORM.get().Base):
+        # single object
+        yield value
+    elif hasattr(value, 'iteritems'):
+        # dict-like collection
+        for obj in value.values():
+            yield obj
+    elif hasattr(value, '__iter__'):
+        # list-like collection
+        for obj in value:
+            yield obj
+
 class GlobalMixin(object):
 
-    def globalize(self, commit=True):
+    def globalize(self, commit=True, bulk=False):
         """
         Converts object into a global by creating an instance of 
         Meta.global_class with the same identity key.
+
+        If bulk is True, global_cascades are applied with set-based UPDATE
+        statements (one per level of each cascade relation) instead of
+        loading and globalizing each object. Cascaded objects updated in bulk
+        bypass mapper events, so their caches are invalidated by namespace
+        only (see bulk_globalize_cascades for the objects which aren't)
         """
         from baph.db.orm import ORM
         orm = ORM.get()
@@ -125,28 +245,106 @@ class GlobalMixin(object):
 
         setattr(self, self._meta.global_column, True)
 
-        # handle meta.global_cascades
-        for field in self._meta.global_cascades:
-            value = getattr(self, field, None)
-            if not value:
-                continue
-            if isinstance(value, orm.Base):
-                # single object
-                value.globalize(commit=False)
-            elif hasattr(value, 'iteritems'):
-                # dict-like collection
-                for obj in value.values():
-                    obj.globalize(commit=False)
-            elif hasattr(value, '__iter__'):
-                # list-like collection
-                for obj in value:
-                    obj.globalize(commit=False)
-       
+        if bulk and has_identity(self):
+            session = object_session(self) or orm.sessionmaker()
+            criteria = and_(*[attr == value for attr, value in
+                              zip(self.pk_attrs, identity_key(instance=self)[1])])
+            self.bulk_globalize_cascades(session, criteria)
+        else:
+            self.globalize_cascades()
+
         if commit:
             session = orm.sessionmaker()
             session.add(self)
             session.commit()
 
+    def globalize_cascades(self):
+        """
+        Globalizes the objects in meta.global_cascades, one at a time
+        """
+        for field in self._meta.global_cascades:
+            value = getattr(self, field, None)
+            if not value:
+                continue
+            for obj in iter_related(value):
+                obj.globalize(commit=False)
+
+    @classmethod
+    def bulk_globalize_cascades(cls, session, criteria, seen=None,
+                                chunk_size=500):
+        """
+        Globalizes the meta.global_cascades of all rows of cls matching
+        criteria, one level at a time: the join keys of each level are
+        selected, and the next level is updated with one UPDATE per
+        chunk_size keys.
+        Relations which can't be expressed as a single-column join
+        (secondary tables, composite keys) are globalized by loading the
+        affected objects instead, as are polymorphic targets (whose
+        subclasses may declare their own cascades) and, when caching is
+        enabled, cached targets which no cache namespace covers (whose
+        cached entries must be killed per object). Returns the set of
+        classes updated in bulk
+        """
+        top_level = seen is None
+        if top_level:
+            seen = defaultdict(set)
+        updated = set()
+        mapper = inspect(cls)
+        cache_enabled = getattr(settings, 'CACHE_ENABLED', False)
+        for field in cls._meta.global_cascades:
+            prop = mapper.get_property(field)
+            target = prop.mapper.class_
+            if prop.secondary is not None or len(prop.local_remote_pairs) != 1:
+                for obj in session.query(cls).filter(criteria):
+                    value = getattr(obj, field, None)
+                    if value:
+                        for child in iter_related(value):
+                            child.globalize(commit=False)
+                continue
+
+            local_col, remote_col = prop.local_remote_pairs[0]
+            local_attr = column_to_attr(cls, local_col)
+            remote_attr = column_to_attr(target, remote_col)
+            keys = set(row[0] for row in
+                       session.query(local_attr).filter(criteria)
+                       if row[0] is not None)
+            # skip keys already handled, so cyclical data terminates
+            keys -= seen[prop]
+            if not keys:
+                continue
+            seen[prop].update(keys)
+
+            if len(prop.mapper.self_and_descendants) > 1 or (
+                    cache_enabled and get_uncovered_models([target])):
+                for chunk in chunked(sorted(keys), chunk_size):
+                    for obj in session.query(target) \
+                            .filter(remote_attr.in_(chunk)):
+                        obj.globalize(commit=False)
+                continue
+
+            global_attr = getattr(target, target._meta.global_column)
+            for chunk in chunked(sorted(keys), chunk_size):
+                child_criteria = remote_attr.in_(chunk)
+                session.query(target) \
+                    .filter(child_criteria) \
+                    .update({global_attr: True}, synchronize_session=False)
+                updated.update(target.bulk_globalize_cascades(
+                    session, child_criteria, seen, chunk_size))
+            updated.add(target)
+
+        if top_level and updated:
+            # objects already loaded in the session are now stale
+            from baph.core.cache.utils import bump_cache_namespaces
+            classes = tuple(updated)
+            for obj in session.identity_map.values():
+                if not isinstance(obj, classes):
+                    continue
+                column = obj._meta.global_column
+                if not get_history(obj, column).added:
+                    session.expire(obj, [column])
+            bump_cache_namespaces(updated)
+        return updated
+
     def is_globalized(self):
         if self._meta.global_column == 'is_globalized':
             raise Exception('global_column name conflicts with existing '
@@ -723,8 +921,64 @@ class ModelPermissionMixin(object):
                 ctx.update(parent.get_context(depth=1))
         return ctx
 
+    @classmethod
+    def get_column_keys(cls):
+        """
+        Returns a pair of dicts mapping columns to the keys of the attributes
+        which reference them. The first considers the leading column of every
+        column property, the second only single-column properties
+        """
+        if cls in _column_key_cache:
+            return _column_key_cache[cls]
+        keys = {}
+        single_keys = {}
+        for k, v in cls.__mapper__.all_orm_descriptors.items():
+            try:
+                cols = v.property.columns
+            except AttributeError:
+                continue
+            if not isinstance(v.property, ColumnProperty):
+                continue
+            keys.setdefault(cols[0], k)
+            if len(cols) == 1:
+                single_keys.setdefault(cols[0], v.key)
+        _column_key_cache[cls] = (keys, single_keys)
+        return _column_key_cache[cls]
+
+    @classmethod
+    def get_permission_parent_keys(cls):
+        """
+        Returns (relation name, local fk column name) pairs for all
+        permission parents
+        """
+        key = (cls, 'permission_parent_keys')
+        if key not in _fks_cache:
+            _fks_cache[key] = [
+                (rel, tuple(getattr(cls, rel).property.local_columns)[0].name)
+                for rel in cls._meta.permission_parents]
+        return _fks_cache[key]
+
+    @classmethod
+    def compile_permission_graph(cls):
+        """
+        Compiles and caches the permission keys for this class (and,
+        recursively, its permission parents)
+        """
+        for limiter, key, value, col_key, base_cls in cls.get_fks():
+            if not key:
+                continue
+            for k in key.split(','):
+                cls.normalize_key(k)
+
     @classmethod
     def get_fks(cls, include_parents=True, remote_key=None):
+        cache_key = (cls, include_parents, remote_key)
+        if cache_key not in _fks_cache:
+            _fks_cache[cache_key] = cls._get_fks(include_parents, remote_key)
+        return list(_fks_cache[cache_key])
+
+    @classmethod
+    def _get_fks(cls, include_parents=True, remote_key=None):
         keys = []
         cls_name = cls.__name__
 
@@ -799,18 +1053,8 @@ class ModelPermissionMixin(object):
                         new_col_key = frags[0][2:-2]
 
                 if limiter == 'single' or not col_key:
-                    col_key = col_attr.key
-                    attr = getattr(cls, col_attr.key, None)
-                    if not isinstance(attr, RelationshipProperty):
-                        # the column is named differently from the attr
-                        for k,v in cls.__mapper__.all_orm_descriptors.items():
-                            if not hasattr(v, 'property'):
-                                continue
-                            if not isinstance(v.property, ColumnProperty):
-                                continue
-                            if v.property.columns[0] == col:
-                                col_key = k
-                                break
+                    # the column may be named differently from the attr
+                    col_key = cls.get_column_keys()[0].get(col, col_attr.key)
 
                 if limiter == 'single':
                     # for single limiters, we can eliminate the final join
@@ -823,6 +1067,13 @@ class ModelPermissionMixin(object):
 
     @classmethod
     def get_related_class(cls, rel_name):
+        if (cls, rel_name) not in _related_class_cache:
+            _related_class_cache[(cls, rel_name)] = \
+                cls._get_related_class(rel_name)
+        return _related_class_cache[(cls, rel_name)]
+
+    @classmethod
+    def _get_related_class(cls, rel_name):
         attr = getattr(cls, rel_name)
         prop = attr.property
         related_cls = prop.argument
@@ -867,6 +1118,12 @@ class ModelPermissionMixin(object):
 
     @classmethod
     def normalize_key(cls, key):
+        if (cls, key) not in _normalized_key_cache:
+            _normalized_key_cache[(cls, key)] = cls._normalize_key(key)
+        return _normalized_key_cache[(cls, key)]
+
+    @classmethod
+    def _normalize_key(cls, key):
         limiter = ''
         frags = key.split('.')
         if len(frags) > 1:
@@ -886,16 +1143,7 @@ class ModelPermissionMixin(object):
             attr = None
             for loc, rem in current_rel.property.local_remote_pairs:
                 if rem in col.property.columns:
-                    attr = loc.name
-                    for c in inspect(prev_cls).all_orm_descriptors:
-                        try:
-                            cols = c.property.columns
-                            assert len(cols) == 1
-                            if cols[0] == loc:
-                                attr = c.key
-                                break
-                        except:
-                            pass
+                    attr = prev_cls.get_column_keys()[1].get(loc, loc.name)
                     break
             if attr:
                 if frags:
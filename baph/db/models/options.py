@@ -32,7 +32,8 @@ DEFAULT_NAMES = ('model_name', 'model_name_plural',
                  'permission_limiters', 'permission_terminator',
                  'permission_handler', 'permission_resources',
                  'global_column', 'global_cascades', 'global_parents',
-                 'latlon_field_names', 'extra_dict_props',
+                 'latlon_field_names', 'geohash_field_name',
+                 'geohash_precision', 'extra_dict_props',
                  )
 
 class Options(object):
@@ -110,6 +111,12 @@ class Options(object):
         # latlon_field_names is a 2-tuple containing the field names
         # of the latitude and longitude columns (for geocoding purposes)
         self.latlon_field_names = None
+        # geohash_field_name is the name of a string column which stores
+        # the geohash of latlon_field_names. It is updated on flush, and
+        # allows proximity searches to be narrowed using an index
+        self.geohash_field_name = None
+        # geohash_precision is the length of the stored geohash
+        self.geohash_precision = 12
 
         self.limit = 1000
         self.object_name, self.app_label = None, app_label
@@ -2,6 +2,9 @@ import types
 
 from sqlalchemy import inspect
 from sqlalchemy.ext.declarative.clsregistry import _class_resolver
+from sqlalchemy.orm.attributes import instance_dict
+from sqlalchemy.orm.exc import UnmappedColumnError
+from sqlalchemy.orm.util import identity_key
 
 
 def has_inherited_table(cls):
@@ -43,19 +46,18 @@ def class_resolver(cls):
 def column_to_attr(cls, col):
     """
     Takes a class and a column and returns the attribute which 
-    references the column
+    references the column, or None if the column isn't mapped
     """
     if hasattr(cls, col.name):
         # the column name is the same as the attr name
         return getattr(cls, col.name)
-    for attr_ in inspect(cls).all_orm_descriptors:
-        # iterate through descriptors to find one that contains the column
-        try:
-            assert attr_.property.columns == [col]
-            return attr_
-        except:
-            continue
-    return None
+    try:
+        # this also finds properties spanning several columns, ie. the
+        # primary key of a joined inheritance subclass
+        prop = inspect(cls).get_property_by_column(col)
+    except UnmappedColumnError:
+        return None
+    return getattr(cls, prop.key)
 
 def key_to_value(obj, key, raw=False):
     """
@@ -91,6 +93,9 @@ def key_to_value(obj, key, raw=False):
         related_cls = class_resolver(prop.argument)
         related_col = prop.local_remote_pairs[0][0]
         attr_ = column_to_attr(previous_cls, related_col)
+        if attr_ is None:
+            # the fk isn't mapped, so the empty relation is all we have
+            return None
         related_key = attr_.key
         related_val = getattr(previous_obj, related_key)
         if related_val is None:
@@ -109,3 +114,102 @@ def key_to_value(obj, key, raw=False):
         return str(value).strip()
     return None
 
+
+def chunked(items, size):
+    for i in xrange(0, len(items), size):
+        yield items[i:i+size]
+
+def load_related(session, prop, values, chunk_size=500):
+    """
+    Loads the targets of a *-to-one relation for a list of fk values.
+    Objects already in the identity map are reused; the rest are loaded
+    with one IN query per chunk. Returns a dict of {fk value: object}
+    """
+    related_cls = class_resolver(prop.argument)
+    remote_col = prop.local_remote_pairs[0][1]
+    remote_attr = column_to_attr(related_cls, remote_col)
+    pk_cols = inspect(related_cls).primary_key
+
+    found = {}
+    if remote_attr is None:
+        # the related objects can't be matched up with the fk values
+        return found
+    missing = set(values)
+    if len(pk_cols) == 1 and remote_col in pk_cols:
+        # the relation targets the pk, so we can check the identity map
+        for value in values:
+            ident = identity_key(related_cls, value)
+            obj = session.identity_map.get(ident)
+            if obj is not None:
+                found[value] = obj
+                missing.discard(value)
+
+    for chunk in chunked(list(missing), chunk_size):
+        query = session.query(related_cls).filter(remote_attr.in_(chunk))
+        for obj in query:
+            found[getattr(obj, remote_attr.key)] = obj
+    return found
+
+def keys_to_values(objs, key, raw=False):
+    """
+    Evaluate chained relations against many target objects at once. This
+    is the batch equivalent of key_to_value: each hop is resolved for all
+    objects with a single IN query (per related class), reusing loaded
+    relations and the identity map. Returns a list aligned with objs
+    """
+    from baph.db.orm import ORM
+
+    frags = key.split('.')
+    if not raw:
+        col_key = frags.pop()
+    current = list(objs)
+    session = None
+
+    for attr_name in frags:
+        pending = []
+        for i, obj in enumerate(current):
+            if not obj:
+                continue
+            if attr_name in instance_dict(obj):
+                # relation is already loaded, no query required
+                value = instance_dict(obj)[attr_name]
+                if value:
+                    current[i] = value
+                    continue
+            pending.append(i)
+
+        # group the unresolved objects by relation, and look up the
+        # related objects by fk
+        by_prop = {}
+        for i in pending:
+            obj = current[i]
+            prop = getattr(type(obj), attr_name).property
+            related_col = prop.local_remote_pairs[0][0]
+            attr_ = column_to_attr(type(obj), related_col)
+            if attr_ is None:
+                # the fk isn't mapped, load the relation itself
+                current[i] = getattr(obj, attr_name) or None
+                continue
+            related_val = getattr(obj, attr_.key)
+            current[i] = None
+            if related_val is None:
+                # relation and key are both empty: no parent found
+                continue
+            by_prop.setdefault(prop, []).append((i, related_val))
+
+        for prop, items in by_prop.items():
+            if session is None:
+                session = ORM.get().sessionmaker()
+            values = set(value for i, value in items)
+            found = load_related(session, prop, values)
+            for i, value in items:
+                current[i] = found.get(value)
+
+    if raw:
+        return current
+
+    results = []
+    for obj in current:
+        value = getattr(obj, col_key, None) if obj else None
+        results.append(str(value).strip() if value else None)
+    return results
@@ -10,13 +10,15 @@ try:
     import json
 except ImportError:
     import simplejson as json
+import binascii
 import datetime
+from importlib import import_module
 import uuid
 import re
 
 from django.conf import settings
 from django.utils.timezone import is_naive, is_aware, make_aware
-from pytz import timezone
+from pytz import timezone, AmbiguousTimeError, NonExistentTimeError
 from sqlalchemy import types
 from sqlalchemy.databases import mysql, postgresql
 from sqlalchemy.ext.mutable import Mutable
@@ -25,6 +27,22 @@ from sqlalchemy.ext.mutable import Mutable
 class Email(types.TypeDecorator):
     impl = types.Unicode
 
+def uuid_from_bytes(value):
+    return uuid.UUID(int=int(binascii.hexlify(value), 16))
+
+def uuid_from_string(value):
+    '''Returns a :class:`uuid.UUID` for a string value. The canonical
+    hyphenated form is converted directly, skipping the prefix and brace
+    handling in ``UUID.__init__``; other forms are parsed by it.
+    '''
+    if (len(value) == 36 and value[8] == value[13] == value[18]
+            == value[23] == '-'):
+        return uuid.UUID(int=int(value.replace('-', ''), 16))
+    return uuid.UUID(value)
+
+def uuid_to_bytes(value):
+    return binascii.unhexlify('%032x' % value.int)
+
 class UUID(types.TypeDecorator):
     '''Generic UUID column type for SQLAlchemy. Includes native support for
     PostgreSQL and a MySQL-specific implementation, in addition to the
@@ -48,46 +66,204 @@ class UUID(types.TypeDecorator):
             return dialect.type_descriptor(types.CHAR(self.impl.length))
 
     def process_bind_param(self, value, dialect=None):
-        if value:
-            if isinstance(value, uuid.UUID):
-                if dialect:
-                    if dialect.name == 'mysql':
-                        return value.bytes
-                    elif dialect.name in ('postgres', 'postgresql'):
-                        return value
-                return str(value)
-            else:
-                raise ValueError('value %s is not a valid uuid.UUID' % value)
-        else:
-            return None
+        return self._get_bind_converter(dialect)(value)
 
     def process_result_value(self, value, dialect=None):
-        if value:
-            if dialect:
-                if dialect.name == 'mysql':
-                    return uuid.UUID(bytes=value)
-                elif dialect.name in ('postgres', 'postgresql'):
-                    return value
-            return uuid.UUID(value)
+        return self._get_result_converter(dialect)(value)
+
+    def _get_bind_converter(self, dialect):
+        if dialect and dialect.name == 'mysql':
+            convert = uuid_to_bytes
+        elif dialect and dialect.name in ('postgres', 'postgresql'):
+            convert = None
         else:
-            return None
+            convert = str
+
+        def process(value):
+            if not value:
+                return None
+            if not isinstance(value, uuid.UUID):
+                raise ValueError('value %s is not a valid uuid.UUID' % value)
+            if convert is None:
+                return value
+            return convert(value)
+        return process
+
+    def _get_result_converter(self, dialect):
+        if dialect and dialect.name == 'mysql':
+            convert = uuid_from_bytes
+        elif dialect and dialect.name in ('postgres', 'postgresql'):
+            convert = None
+        else:
+            convert = uuid_from_string
+
+        def process(value):
+            if not value:
+                return None
+            if convert is None:
+                return value
+            return convert(value)
+        return process
+
+    def bind_processor(self, dialect):
+        """
+        Returns a processor specific to dialect, built once per dialect,
+        rather than checking the dialect name for each value
+        """
+        return chain_processors(self._get_bind_converter(dialect),
+                                self.impl.bind_processor(dialect))
+
+    def result_processor(self, dialect, coltype):
+        return chain_processors(self.impl.result_processor(dialect, coltype),
+                                self._get_result_converter(dialect))
 
     def is_mutable(self):
         return False
 
+_json_codec = None
+
+def get_json_codec():
+    '''Returns the module used to encode and decode JSON columns. The
+    ``BAPH_JSON_CODEC`` setting names a module providing ``dumps`` and
+    ``loads`` (ie. ``'ujson'`` or ``'simplejson'``), or a list of them to
+    try in order. The standard library ``json`` module is used when none
+    of them can be imported.
+    '''
+    global _json_codec
+    if _json_codec is None:
+        names = getattr(settings, 'BAPH_JSON_CODEC', None) or ()
+        if isinstance(names, basestring):
+            names = [names]
+        codec = json
+        for name in names:
+            try:
+                codec = import_module(name)
+            except ImportError:
+                continue
+            break
+        _json_codec = codec
+    return _json_codec
+
+def decode_json(raw):
+    return get_json_codec().loads(raw)
+
+_missing = object()
+
+class LazyJson(object):
+    '''A JSON column value which is decoded on first use. It proxies item
+    access, iteration, comparison and attribute access to the decoded
+    value, and pickles and copies as the decoded value, but it is not an
+    instance of the decoded type: code which type-checks the value, and
+    encoders which don't know about it, need the decoded value, via
+    :attr:`value` or :func:`unwrap_json` (``to_dict`` and ``to_dicts``
+    return decoded values).
+    '''
+    __slots__ = ('raw', '_value')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._value = _missing
+
+    @property
+    def decoded(self):
+        return self._value is not _missing
+
+    @property
+    def value(self):
+        if self._value is _missing:
+            self._value = decode_json(self.raw)
+        return self._value
+
+    def __getattr__(self, key):
+        return getattr(self.value, key)
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __setitem__(self, key, value):
+        self.value[key] = value
+
+    def __delitem__(self, key):
+        del self.value[key]
+
+    def __contains__(self, key):
+        return key in self.value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __nonzero__(self):
+        return bool(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyJson):
+            other = other.value
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.value)
+
+    def __str__(self):
+        return str(self.value)
+
+    def __unicode__(self):
+        return unicode(self.value)
+
+    def __reduce_ex__(self, protocol):
+        # pickle and copy the decoded value, not the proxy
+        if self._value is _missing:
+            return (decode_json, (self.raw,))
+        return (type(self._value), (self._value,))
+
+    def __reduce__(self):
+        return self.__reduce_ex__(2)
+
+def unwrap_json(value):
+    '''Returns the decoded value of a :class:`LazyJson`, for consumers
+    which need the real object (ie. JSON encoders). Other values are
+    returned unchanged.
+    '''
+    if type(value) is LazyJson:
+        return value.value
+    return value
+
 class Json(types.TypeDecorator):
+    '''Stores a JSON-serializable value, encoded with the codec returned by
+    :func:`get_json_codec`. With ``lazy=True``, loaded values are
+    :class:`LazyJson` proxies, and are only decoded when used. An undecoded
+    value is written back as its original string. Lazy columns can't be
+    wrapped with :class:`MutableDict` or :class:`MutableList`, whose
+    change tracking requires the decoded value.
+    '''
     impl = types.Unicode
 
+    def __init__(self, *args, **kwargs):
+        self.lazy = kwargs.pop('lazy', False)
+        super(Json, self).__init__(*args, **kwargs)
+
     def process_bind_param(self, value, dialect):
         if value is None:
             return None
-        #return json.dumps(value)
-        return unicode(json.dumps(value))
+        if isinstance(value, LazyJson):
+            if not value.decoded:
+                return value.raw
+            value = value.value
+        return unicode(get_json_codec().dumps(value))
 
     def process_result_value(self, value, dialect):
         if not value:
             return None
-        return json.loads(value)
+        if self.lazy:
+            return LazyJson(value)
+        return get_json_codec().loads(value)
 
 JsonType = Json
 
@@ -102,11 +278,23 @@ class List(JsonText):
 
 # http://docs.sqlalchemy.org/en/latest/orm/extensions/mutable.html
 
+def check_mutable_type(sqltype):
+    "Rejects lazy Json types, which mutable types would decode on load."
+    if getattr(types.to_instance(sqltype), 'lazy', False):
+        raise ValueError('Mutable types require a decoded value; lazy=True '
+                         'is not supported for %r' % sqltype)
+
 class MutableDict(Mutable, dict):
+    @classmethod
+    def as_mutable(cls, sqltype):
+        check_mutable_type(sqltype)
+        return super(MutableDict, cls).as_mutable(sqltype)
+
     @classmethod
     def coerce(cls, key, value):
         "Convert plain dictionaries to MutableDict."
 
+        value = unwrap_json(value)
         if not isinstance(value, MutableDict):
             if isinstance(value, dict):
                 return MutableDict(value)
@@ -129,9 +317,15 @@ class MutableDict(Mutable, dict):
         self.changed()
 
 class MutableList(Mutable, list):
+    @classmethod
+    def as_mutable(cls, sqltype):
+        check_mutable_type(sqltype)
+        return super(MutableList, cls).as_mutable(sqltype)
+
     @classmethod
     def coerce(cls, key, value):
         """Convert plain list to MutationList"""
+        value = unwrap_json(value)
         if not isinstance(value, MutableList):
             if isinstance(value, list):
                 return MutableList(value)
@@ -181,41 +375,146 @@ class Dict(JsonText):
     def python_type(self):
         return dict
 
+# ISO-8601 datetimes, ie. '2015-04-01T12:30:00.123+02:00'
+ISO_DATETIME = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.\d*)?'
+    r'(Z|[+-]\d{2}:?\d{2})?$')
+DATETIME = re.compile('([0-9: -]+)\.?([0-9]*)([\+-][0-9]{2}:?[0-9]{2})?')
+
+def parse_datetime(value):
+    '''Parses a datetime string, returning a naive datetime. Values with
+    a UTC offset are converted to UTC.
+    '''
+    match = ISO_DATETIME.match(value)
+    if match:
+        year, month, day, hour, minute, second, tz = match.groups()
+        result = datetime.datetime(int(year), int(month), int(day),
+                                   int(hour), int(minute), int(second))
+        if tz == 'Z':
+            tz = None
+    else:
+        value = value.replace('T', ' ').replace('Z', '+00:00')
+        dt, ms, tz = DATETIME.match(value).groups()
+        result = datetime.datetime.strptime(dt, '%Y-%m-%d %H:%M:%S')
+    if tz:
+        pol, h, m = tz[0], int(tz[1:3]), int(tz[-2:])
+        delta = datetime.timedelta(hours=h, minutes=m)
+        if pol == '+':
+            result -= delta
+        else:
+            result += delta
+    return result
+
+def format_datetime(value):
+    return '%04d-%02d-%02d %02d:%02d:%02d' % (value.year, value.month,
+        value.day, value.hour, value.minute, value.second)
+
+def chain_processors(first, second):
+    " returns a processor applying first, then second (either may be None) "
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return lambda value: second(first(value))
+
 class TZAwareDateTime(types.TypeDecorator):
+    '''A DateTime stored as naive wall-clock time in ``tz``, and loaded as
+    an aware datetime in ``tz``.
+    '''
     impl = types.DateTime
 
+    # max number of cached tzinfos per type, for zones with DST
+    tzinfo_cache_size = 100000
+
     def __init__(self, tz, *args, **kwargs):
         super(TZAwareDateTime, self).__init__(*args, **kwargs)
         self.tz = timezone(tz)
+        # zones without transitions (ie. UTC) can be attached directly
+        self.fixed_offset = not hasattr(self.tz, '_utc_transition_times')
+        # naive datetime, truncated to the minute -> tzinfo, or False if
+        # it can't be cached
+        self._tzinfos = {}
+
+    def localize(self, value):
+        '''Attaches ``tz`` to a naive datetime. Equivalent to
+        ``tz.localize(value, is_dst=None)``, but the resulting tzinfo is
+        cached per minute, unless an offset change falls within it.
+        '''
+        if self.fixed_offset:
+            return value.replace(tzinfo=self.tz)
+        key = value.replace(second=0, microsecond=0)
+        tzinfo = self._tzinfos.get(key)
+        if tzinfo is None:
+            tzinfo = self._resolve_tzinfo(key)
+            if len(self._tzinfos) >= self.tzinfo_cache_size:
+                self._tzinfos.clear()
+            self._tzinfos[key] = tzinfo
+        if tzinfo is False:
+            return self.tz.localize(value, is_dst=None)
+        return value.replace(tzinfo=tzinfo)
+
+    def _resolve_tzinfo(self, minute):
+        try:
+            start = self.tz.localize(minute, is_dst=None).tzinfo
+            end = self.tz.localize(minute + datetime.timedelta(seconds=59),
+                                   is_dst=None).tzinfo
+        except (AmbiguousTimeError, NonExistentTimeError):
+            return False
+        if start is not end:
+            return False
+        return start
+
+    def to_naive(self, value):
+        '''Returns the naive wall-clock datetime to store for value, which
+        may be a string. Naive values which don't exist in ``tz``, or are
+        ambiguous, raise an error.
+        '''
+        if isinstance(value, basestring):
+            value = parse_datetime(value)
+        if value.tzinfo is None:
+            self.localize(value)
+        else:
+            value = value.replace(tzinfo=None)
+        return value.replace(microsecond=0)
 
     def process_bind_param(self, value, dialect):
         if value is None:
             return None
-        if isinstance(value, basestring):
-            value = value.replace('T', ' ').replace('Z', '+00:00')
-            p = re.compile('([0-9: -]+)\.?([0-9]*)([\+-][0-9]{2}:?[0-9]{2})?')
-            dt, ms, tz = p.match(value).groups()
-            value = datetime.datetime.strptime(dt, '%Y-%m-%d %H:%M:%S')
-            if tz:
-                pol, h, m = tz[0], int(tz[1:3]), int(tz[-2:])
-                delta = datetime.timedelta(hours=h, minutes=m)
-                if pol == '+':
-                    value -= delta
-                else:
-                    value += delta
-
-        if is_naive(value):
-            value = make_aware(value, self.tz)
-        else:
-            value = value.replace(tzinfo=self.tz)
-        return value.strftime('%Y-%m-%d %H:%M:%S')
+        return format_datetime(self.to_naive(value))
 
     def process_result_value(self, value, dialect):
         if value is None:
             return None
-        value = self.tz.localize(value, is_dst=None)
-        return value
-        
+        return self.localize(value)
+
+    def bind_processor(self, dialect):
+        '''Returns a processor built once per dialect. Dialects which
+        format datetimes themselves (ie. sqlite) are given naive datetimes,
+        and others a formatted string.
+        '''
+        impl_processor = self.impl.bind_processor(dialect)
+        to_naive = self.to_naive
+        if impl_processor is None:
+            def process(value):
+                if value is None:
+                    return None
+                return format_datetime(to_naive(value))
+        else:
+            def process(value):
+                if value is None:
+                    return None
+                return impl_processor(to_naive(value))
+        return process
+
+    def result_processor(self, dialect, coltype):
+        localize = self.localize
+        def process(value):
+            if value is None:
+                return None
+            return localize(value)
+        return chain_processors(self.impl.result_processor(dialect, coltype),
+                                process)
+
     def compare_values(self, x, y):
         if x and y and is_naive(x) and is_aware(y):
             x = make_aware(x, self.tz)
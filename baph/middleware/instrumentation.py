@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+'''\
+:mod:`baph.middleware.instrumentation` -- Request Instrumentation Middleware
+===========================================================================
+
+Records the SQL statements and cache operations caused by each request.
+The counters are attached to the request as ``request.stats`` (a
+:class:`baph.core.instrumentation.RequestStats`) and summarized in a
+``Server-Timing`` response header.
+
+Settings:
+
+``BAPH_REQUEST_BUDGETS``
+    A dict of stat names to limits, ie. ``{'sql_count': 50, 'sql_time':
+    0.5, 'cache_count': 100, 'total_time': 2.0}`` (times in seconds).
+    Requests exceeding any of them are logged as warnings.
+``BAPH_N_PLUS_ONE_THRESHOLD``
+    Statements executed at least this many times in one request are
+    logged as N+1 candidates. Defaults to 10; set to 0 to disable.
+``BAPH_SERVER_TIMING``
+    Whether to add the ``Server-Timing`` header. Defaults to ``True``.
+'''
+import logging
+
+from django.conf import settings
+
+from baph.core.instrumentation import end_request_stats, start_request_stats
+from baph.middleware.base import MiddlewareMixin
+
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentationMiddleware(MiddlewareMixin):
+    '''Django middleware which counts the SQL statements, database time and
+    cache operations of each request. It should be listed first, so the
+    other middleware are included in the counts.
+    '''
+
+    def process_request(self, request):
+        request.stats = start_request_stats()
+
+    def process_response(self, request, response):
+        stats = getattr(request, 'stats', None)
+        if stats is None:
+            return response
+        end_request_stats()
+
+        if getattr(settings, 'BAPH_SERVER_TIMING', True):
+            response['Server-Timing'] = stats.get_server_timing()
+
+        budgets = getattr(settings, 'BAPH_REQUEST_BUDGETS', None) or {}
+        exceeded = stats.get_exceeded_budgets(budgets)
+        if exceeded:
+            logger.warning('Request exceeded budget: %s %s (%s)' % (
+                request.method, request.path,
+                ', '.join('%s=%s > %s' % item for item in exceeded)))
+
+        threshold = getattr(settings, 'BAPH_N_PLUS_ONE_THRESHOLD', 10)
+        if threshold:
+            for statement, count in stats.get_repeated_statements(threshold):
+                logger.warning('Possible N+1 query: %s %s executed %d '
+                               'times: %s' % (request.method, request.path,
+                                              count, statement))
+        return response
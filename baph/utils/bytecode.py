@@ -0,0 +1,128 @@
+"""
+A bytecode cache for python sources which are executed directly, rather
+than imported (layered settings modules, patches), and so never benefit
+from .pyc files.
+
+Compiled code is stored in a per-user cache directory, keyed by the source
+path, and is only used if the source's mtime and size and the interpreter's
+magic number all match. The directory can be changed with the
+BAPH_BYTECODE_CACHE environment variable; set it to an empty string to
+disable caching.
+
+Each file executed via :func:`exec_file` is timed, and
+:func:`get_timing_report` summarizes the results. Set BAPH_TIMING_REPORT
+to print the report to stderr once settings are loaded.
+"""
+import hashlib
+import imp
+import logging
+import marshal
+import os
+import struct
+import tempfile
+import time
+
+
+CACHE_ENV_VARIABLE = 'BAPH_BYTECODE_CACHE'
+REPORT_ENV_VARIABLE = 'BAPH_TIMING_REPORT'
+
+MAGIC = imp.get_magic()
+# magic number, source mtime, source size
+HEADER = struct.Struct('<4sdq')
+
+logger = logging.getLogger(__name__)
+
+# (label, seconds, cached) for each file executed via exec_file, in order
+load_timings = []
+
+
+def get_cache_dir():
+    """
+    Returns the cache directory, creating it if needed, or None if caching
+    is disabled or the directory can't be used safely
+    """
+    path = os.environ.get(CACHE_ENV_VARIABLE)
+    if path is None:
+        uid = os.getuid() if hasattr(os, 'getuid') else 0
+        path = os.path.join(tempfile.gettempdir(), 'baph-bytecode-%d' % uid)
+    if not path:
+        return None
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path, 0700)
+        if hasattr(os, 'getuid') and os.stat(path).st_uid != os.getuid():
+            # never load code from a directory owned by someone else
+            logger.warning('Ignoring bytecode cache %r: not owned by the '
+                           'current user' % path)
+            return None
+    except OSError:
+        return None
+    return path
+
+def get_cache_path(cache_dir, path):
+    key = hashlib.sha1(os.path.abspath(path)).hexdigest()
+    return os.path.join(cache_dir, '%s.pyc' % key)
+
+def read_cache(cache_path, mtime, size):
+    try:
+        with open(cache_path, 'rb') as fp:
+            header = fp.read(HEADER.size)
+            if HEADER.unpack(header) != (MAGIC, mtime, size):
+                return None
+            return marshal.load(fp)
+    except (IOError, EOFError, ValueError, TypeError, struct.error):
+        return None
+
+def write_cache(cache_path, mtime, size, code):
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(HEADER.pack(MAGIC, mtime, size))
+            marshal.dump(code, fp)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError):
+        logger.debug('Unable to write bytecode cache for %r' % cache_path)
+
+def load_code(path):
+    """
+    Returns a tuple of (code, cached) for the python source at path, where
+    cached indicates whether the code was loaded from the cache
+    """
+    st = os.stat(path)
+    cache_dir = get_cache_dir()
+    if cache_dir:
+        cache_path = get_cache_path(cache_dir, path)
+        code = read_cache(cache_path, st.st_mtime, st.st_size)
+        if code is not None:
+            return (code, True)
+
+    with open(path, 'rb') as fp:
+        source = fp.read()
+    code = compile(source, path, 'exec', 0, True)
+    if cache_dir:
+        write_cache(cache_path, st.st_mtime, st.st_size, code)
+    return (code, False)
+
+def exec_file(path, namespace, label=None):
+    """
+    Executes the python source at path in namespace, using cached bytecode
+    when possible, and records the time taken
+    """
+    start = time.time()
+    code, cached = load_code(path)
+    exec code in namespace
+    load_timings.append((label or path, time.time() - start, cached))
+
+def get_timing_report():
+    """
+    Returns a summary of the load time of each file executed via exec_file
+    """
+    lines = ['%-56s %10s  %s' % ('module', 'time (ms)', 'source')]
+    total = 0.0
+    for label, seconds, cached in load_timings:
+        total += seconds
+        lines.append('%-56s %10.2f  %s'
+                     % (label, seconds * 1000, 'cache' if cached else 'compiled'))
+    lines.append('%-56s %10.2f' % ('total', total * 1000))
+    return '\n'.join(lines)
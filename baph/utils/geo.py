@@ -0,0 +1,167 @@
+"""
+Geospatial helpers for proximity searches: geohash encoding, geohash
+prefix coverage of a search radius, and haversine distances.
+
+Distances are in miles. If numpy is installed, :func:`haversine` is
+vectorized; otherwise it falls back to pure python.
+"""
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+EARTH_RADIUS = 3959.0 # miles
+MILES_PER_DEGREE = 69.0 # degrees of latitude (approx)
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_MAX_PRECISION = 12
+
+
+def encode_geohash(lat, lon, precision=GEOHASH_MAX_PRECISION):
+    """
+    Encodes a coordinate into a geohash string of the given length
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bit = 0
+    ch = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            rng, value = lon_range, lon
+        else:
+            rng, value = lat_range, lat
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            ch = (ch << 1) | 1
+            rng[0] = mid
+        else:
+            ch = ch << 1
+            rng[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(GEOHASH_ALPHABET[ch])
+            bit = 0
+            ch = 0
+    return ''.join(chars)
+
+def geohash_cell_size(precision):
+    """
+    Returns the (lat, lon) size, in degrees, of a geohash cell
+    """
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return (180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits))
+
+def bounding_box(lat, lon, radius):
+    """
+    Returns (min_lat, min_lon, max_lat, max_lon) of the box containing
+    all points within radius of the given point. min_lon is greater than
+    max_lon if the box crosses the antimeridian
+    """
+    lat_diff = radius / MILES_PER_DEGREE
+    min_lat = max(lat - lat_diff, -90.0)
+    max_lat = min(lat + lat_diff, 90.0)
+    if min_lat == -90.0 or max_lat == 90.0:
+        # the box contains a pole, so all longitudes are in range
+        return (min_lat, -180.0, max_lat, 180.0)
+
+    # degrees of longitude shrink towards the poles, so use the
+    # latitude farthest from the equator
+    max_abs_lat = max(abs(min_lat), abs(max_lat))
+    lon_diff = lat_diff / math.cos(math.radians(max_abs_lat))
+    if lon_diff >= 180.0:
+        return (min_lat, -180.0, max_lat, 180.0)
+    min_lon = wrap_longitude(lon - lon_diff)
+    max_lon = wrap_longitude(lon + lon_diff)
+    return (min_lat, min_lon, max_lat, max_lon)
+
+def wrap_longitude(lon):
+    return ((lon + 180.0) % 360.0) - 180.0
+
+def geohash_prefixes(lat, lon, radius, max_precision=GEOHASH_MAX_PRECISION):
+    """
+    Returns a set of geohash prefixes which together cover every point
+    within radius of the given point. The longest prefix whose cells are
+    at least as large as the bounding box is used, so at most four cells
+    are returned (per side of the antimeridian). Returns None if the
+    search area is too large to be narrowed by prefix
+    """
+    min_lat, min_lon, max_lat, max_lon = bounding_box(lat, lon, radius)
+    if min_lon > max_lon:
+        # split the box at the antimeridian
+        boxes = [(min_lat, min_lon, max_lat, 180.0),
+                 (min_lat, -180.0, max_lat, max_lon)]
+    else:
+        boxes = [(min_lat, min_lon, max_lat, max_lon)]
+
+    prefixes = set()
+    for (min_lat, min_lon, max_lat, max_lon) in boxes:
+        precision = 0
+        for p in xrange(max_precision, 0, -1):
+            lat_size, lon_size = geohash_cell_size(p)
+            if lat_size >= max_lat - min_lat and lon_size >= max_lon - min_lon:
+                precision = p
+                break
+        if not precision:
+            return None
+        # a box no larger than a cell intersects at most 2x2 cells,
+        # each of which contains one of the box's corners
+        for corner_lat in (min_lat, max_lat):
+            for corner_lon in (min_lon, max_lon):
+                corner_lon = min(corner_lon, 180.0 - 1e-9)
+                prefixes.add(encode_geohash(corner_lat, corner_lon, precision))
+    return prefixes
+
+def haversine(lat, lon, lats, lons):
+    """
+    Returns the distances from (lat, lon) to each of the points in lats
+    and lons. If numpy is available, a numpy array is returned, otherwise
+    a list. Points with no coordinates (None) have an infinite distance
+    """
+    if numpy is not None:
+        return _haversine_numpy(lat, lon, lats, lons)
+    return [_haversine(lat, lon, lat2, lon2) for lat2, lon2 in zip(lats, lons)]
+
+def _haversine(lat1, lon1, lat2, lon2):
+    if lat2 is None or lon2 is None:
+        return float('inf')
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+def _haversine_numpy(lat, lon, lats, lons):
+    lats = numpy.array(lats, dtype=float)
+    lons = numpy.array(lons, dtype=float)
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = numpy.radians(lats), numpy.radians(lons)
+    a = (numpy.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2)
+    distances = 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+    # None values become nan in a float array
+    distances[numpy.isnan(distances)] = numpy.inf
+    return distances
+
+def rank_by_distance(lat, lon, items, lats, lons, radius=None):
+    """
+    Sorts items by their distance from (lat, lon), optionally dropping
+    those farther than radius. Returns a list of (item, distance) pairs
+    """
+    distances = haversine(lat, lon, lats, lons)
+    if numpy is not None:
+        order = numpy.argsort(distances, kind='mergesort')
+        if radius is not None:
+            order = order[distances[order] <= radius]
+        return [(items[i], float(distances[i])) for i in order]
+
+    pairs = sorted(zip(items, distances), key=lambda pair: pair[1])
+    if radius is not None:
+        pairs = [pair for pair in pairs if pair[1] <= radius]
+    return pairs
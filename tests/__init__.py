@@ -0,0 +1,3 @@
+# baph replaces django's settings object when imported, which must happen
+# before any django module holds a reference to it
+import baph
@@ -0,0 +1,169 @@
+from django.core.cache import get_cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test.utils import override_settings
+
+from baph.auth import cache as auth_cache
+from baph.auth.cache import (CachedUser, build_user_snapshot,
+                             check_user_cache, get_cached_user,
+                             get_permission_version_key)
+from baph.auth.models import (Organization, Permission, PermissionAssociation,
+                              User)
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class UserCacheTestCase(TestCase):
+    '''Tests the cached user snapshots in :mod:`baph.auth.cache`.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super(UserCacheTestCase, cls).setUpClass()
+        orm.Base.metadata.create_all(orm.engine)
+
+    def setUp(self):
+        self.settings_override = override_settings(CACHE_ENABLED=True,
+                                                   BAPH_AUTH_USER_CACHE=True)
+        self.settings_override.enable()
+        meta = User._meta
+        self.orig_meta = (meta.cache_alias, meta.cache_detail_fields,
+                          meta.cache_modes)
+        meta.cache_alias = 'default'
+        meta.cache_detail_fields = ['id']
+        meta.cache_modes = ('detail',)
+        self.cache = get_cache('default')
+        self.cache.clear()
+
+        self.session = orm.sessionmaker()
+        self.org = Organization(name=u'org')
+        self.user = User(email='alice@example.com', username='alice',
+                         password='secret-hash', organization=self.org)
+        self.perm = Permission(codename='view_all', resource='user',
+                               action='view')
+        self.session.add_all([self.org, self.user, self.perm])
+        self.session.commit()
+        self.user_id = self.user.id
+
+    def tearDown(self):
+        self.session.rollback()
+        for model in (PermissionAssociation, Permission, User, Organization):
+            self.session.query(model).delete()
+        self.session.commit()
+        self.session.close()
+        meta = User._meta
+        (meta.cache_alias, meta.cache_detail_fields,
+         meta.cache_modes) = self.orig_meta
+        self.settings_override.disable()
+
+    def get_version(self):
+        return self.cache.get(get_permission_version_key())
+
+    def summarize(self, permissions):
+        return dict((org, dict((resource, dict(
+            (action, sorted(perm.codename for perm in perms))
+            for action, perms in actions.items()))
+            for resource, actions in resources.items()))
+            for org, resources in permissions.items())
+
+    def grant(self, perm):
+        self.session.add(PermissionAssociation(user=self.user,
+                                               permission=perm))
+
+    def test_snapshot_excludes_password(self):
+        snapshot = build_user_snapshot(self.user, 1)
+        self.assertTrue('password' not in snapshot['data'])
+        self.assertEqual(snapshot['data']['email'], 'alice@example.com')
+        context_key = '%s.email' % User.__name__.lower()
+        self.assertEqual(snapshot['context'][context_key],
+                         'alice@example.com')
+        for key, value in snapshot['context'].items():
+            self.assertFalse(key.endswith('.password'))
+            self.assertNotEqual(value, 'secret-hash')
+
+    def test_cached_user(self):
+        self.grant(self.perm)
+        self.session.commit()
+        self.session.expunge_all()
+
+        user = get_cached_user(self.user_id)
+        self.assertTrue(type(user) is User)
+        cached = get_cached_user(self.user_id)
+        self.assertTrue(type(cached) is CachedUser)
+        self.assertFalse(isinstance(cached, User))
+        self.assertEqual(cached, user)
+        self.assertEqual(user, cached)
+        self.assertFalse(cached != user)
+        self.assertFalse(user != cached)
+        self.assertEqual(cached, get_cached_user(self.user_id))
+        self.assertEqual(len(set([cached, get_cached_user(self.user_id)])),
+                         1)
+        self.assertNotEqual(cached, self.user_id)
+        self.assertEqual(cached.username, 'alice')
+        self.assertEqual(cached.get_context(), build_user_snapshot(
+            user, None)['context'])
+        self.assertEqual(self.summarize(cached.get_all_permissions()),
+                         self.summarize(user.get_all_permissions()))
+        self.assertEqual(get_cached_user(-1), None)
+
+    def test_attribute_fallback(self):
+        get_cached_user(self.user_id)
+        cached = get_cached_user(self.user_id)
+        self.assertEqual(cached._instance, None)
+        # not part of the snapshot, so the user is loaded
+        self.assertEqual(cached.password, 'secret-hash')
+        self.assertTrue(cached._instance is not None)
+        self.assertEqual(cached.organization.name, u'org')
+
+        cached.first_name = u'Alice'
+        self.assertEqual(cached._instance.first_name, u'Alice')
+        self.assertEqual(cached.first_name, u'Alice')
+        self.assertTrue(cached.get_instance() is cached._instance)
+
+    def test_relationship_assignment(self):
+        get_cached_user(self.user_id)
+        cached = get_cached_user(self.user_id)
+        # the user is never loaded implicitly by the ORM
+        self.assertRaises(AttributeError, PermissionAssociation, user=cached,
+                          permission=self.perm)
+        self.assertEqual(cached._instance, None)
+        assoc = PermissionAssociation(user=cached.get_instance(),
+                                      permission=self.perm)
+        self.assertEqual(assoc.user, cached)
+
+    def test_version_bumped_after_commit(self):
+        get_cached_user(self.user_id)
+        version = self.get_version()
+
+        self.grant(self.perm)
+        self.session.flush()
+        self.assertEqual(self.get_version(), version)
+        self.assertTrue(type(get_cached_user(self.user_id)) is CachedUser)
+        self.session.commit()
+        self.assertEqual(self.get_version(), version + 1)
+
+        # the stale snapshot is replaced
+        self.session.expunge_all()
+        user = get_cached_user(self.user_id)
+        self.assertTrue(type(user) is User)
+        cached = get_cached_user(self.user_id)
+        self.assertEqual(self.summarize(cached.get_all_permissions()),
+                         self.summarize(user.get_all_permissions()))
+        self.assertTrue('user' in cached.get_all_permissions()[None])
+
+    def test_rollback_does_not_bump_version(self):
+        get_cached_user(self.user_id)
+        version = self.get_version()
+        self.grant(self.perm)
+        self.session.flush()
+        self.session.rollback()
+        self.session.commit()
+        self.assertEqual(self.get_version(), version)
+
+    def test_check_user_cache(self):
+        check_user_cache()
+        User._meta.cache_modes = ()
+        self.assertRaises(ImproperlyConfigured, check_user_cache)
+        User._meta.cache_alias = None
+        self.assertRaises(ImproperlyConfigured, check_user_cache)
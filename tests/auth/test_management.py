@@ -0,0 +1,129 @@
+import json
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import Column, ForeignKey, Integer, Unicode
+from sqlalchemy.orm import configure_mappers, relationship
+
+from baph.auth import management
+from baph.auth.management import (get_model_permissions,
+                                  get_permission_fingerprint,
+                                  read_permission_manifest, sync_permissions,
+                                  write_permission_manifest)
+from baph.auth.models import Organization, Permission
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class ManagedWidget(orm.Base):
+    '''Test model which generates permissions.'''
+    __tablename__ = 'test_baph_managed_widget'
+
+    class Meta:
+        permission_resources = {'managedwidget': ['view', 'edit']}
+        permission_parents = ['organization']
+
+    id = Column(Integer, primary_key=True)
+    organization_id = Column(Integer, ForeignKey(Organization.id))
+    name = Column(Unicode(50))
+
+    organization = relationship(Organization)
+
+
+class PermissionManagementTestCase(TestCase):
+    '''Tests the permission sync and manifest helpers in
+    :mod:`baph.auth.management`.
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super(PermissionManagementTestCase, cls).setUpClass()
+        orm.Base.metadata.create_all(orm.engine)
+
+    def setUp(self):
+        self.session = orm.sessionmaker()
+        self.addCleanup(self.cleanup)
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.path = os.path.join(self.tempdir, 'permissions.json')
+
+    def cleanup(self):
+        self.session.rollback()
+        self.session.query(Permission).delete()
+        self.session.commit()
+        self.session.close()
+
+    def test_model_permissions(self):
+        perms = get_model_permissions(ManagedWidget)
+        codenames = set(perm['codename'] for perm in perms)
+        self.assertIn('view_any_managedwidget', codenames)
+        self.assertIn('edit_organization_managedwidget', codenames)
+
+    def test_sync_permissions(self):
+        perms = get_model_permissions(ManagedWidget)
+        self.assertEqual(sync_permissions(perms[:1]), perms[:1])
+        # existing permissions are skipped
+        self.assertEqual(sync_permissions(perms), perms[1:])
+        self.assertEqual(sync_permissions(perms), [])
+        self.assertEqual(sync_permissions([]), [])
+        self.assertEqual(
+            sorted(row[0] for row in
+                   self.session.query(Permission.codename)),
+            sorted(perm['codename'] for perm in perms))
+
+    def test_manifest_round_trip(self):
+        perms = get_model_permissions(ManagedWidget)
+        write_permission_manifest(self.path, perms)
+        self.assertEqual(read_permission_manifest(self.path), perms)
+
+    def test_manifest_invalidation(self):
+        self.assertIsNone(read_permission_manifest(self.path))
+        with open(self.path, 'w') as fp:
+            fp.write('{')
+        self.assertIsNone(read_permission_manifest(self.path))
+
+        perms = get_model_permissions(ManagedWidget)
+        write_permission_manifest(self.path, perms)
+        with open(self.path) as fp:
+            manifest = json.load(fp)
+        manifest['fingerprint'] = 'stale'
+        with open(self.path, 'w') as fp:
+            json.dump(manifest, fp)
+        self.assertIsNone(read_permission_manifest(self.path))
+
+    def test_fingerprint_covers_model_names(self):
+        # model names are used in codenames and permission keys
+        fingerprint = get_permission_fingerprint()
+        self.assertEqual(get_permission_fingerprint(), fingerprint)
+        meta = ManagedWidget._meta
+        model_name = meta.model_name
+        meta.model_name = 'renamedwidget'
+        self.addCleanup(setattr, meta, 'model_name', model_name)
+        self.assertNotEqual(get_permission_fingerprint(), fingerprint)
+
+    def test_fingerprint_covers_columns(self):
+        fingerprint = get_permission_fingerprint()
+        prop = ManagedWidget.__mapper__.get_property('organization_id')
+        key = prop.key
+        prop.key = 'org_id'
+        self.addCleanup(setattr, prop, 'key', key)
+        self.assertNotEqual(get_permission_fingerprint(), fingerprint)
+
+    def test_permission_cache_reset(self):
+        get_model_permissions(ManagedWidget)
+        self.assertIn(ManagedWidget, management._permission_cache)
+
+        # configuring new mappers may add relationships to existing models
+        type('ManagedGadget', (orm.Base,), {
+            '__module__': __name__,
+            '__tablename__': 'test_baph_managed_gadget',
+            'id': Column(Integer, primary_key=True),
+            'widget_id': Column(Integer, ForeignKey(ManagedWidget.id)),
+            'widget': relationship(ManagedWidget, backref='gadgets'),
+            })
+        configure_mappers()
+        self.assertNotIn(ManagedWidget, management._permission_cache)
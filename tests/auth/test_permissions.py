@@ -0,0 +1,500 @@
+import json
+
+from sqlalchemy import Column, ForeignKey, Integer, Unicode, event
+from sqlalchemy.orm import relationship
+
+from baph.auth.mixins import (PermissionStruct, compile_resource_filters,
+                               get_join_target)
+from baph.auth.models import Organization, User
+from baph.db.models.utils import column_to_attr, key_to_value
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class PermWidget(orm.Base):
+    '''Test model with permissions based on its own columns.'''
+    __tablename__ = 'test_baph_perm_widget'
+
+    class Meta:
+        permission_parents = ['organization']
+
+    id = Column(Integer, primary_key=True)
+    organization_id = Column(Integer, ForeignKey(Organization.id))
+    name = Column(Unicode(50))
+
+    organization = relationship(Organization)
+
+
+class PermPart(orm.Base):
+    '''Test model with permissions routed through its widget.'''
+    __tablename__ = 'test_baph_perm_part'
+
+    class Meta:
+        permission_parents = ['widget']
+        permission_handler = 'widget'
+
+    id = Column(Integer, primary_key=True)
+    widget_id = Column(Integer, ForeignKey(PermWidget.id))
+
+    widget = relationship(PermWidget)
+
+
+class PermTag(orm.Base):
+    '''Test model with filter keys translated to its widget.'''
+    __tablename__ = 'test_baph_perm_tag'
+
+    class Meta:
+        filter_translations = {
+            'org': 'PermWidget.organization_id',
+            'org_name': 'PermWidget.organization.name',
+            }
+
+    id = Column(Integer, primary_key=True)
+    widget_id = Column(Integer, ForeignKey(PermWidget.id))
+    label = Column(Unicode(50))
+
+    widget = relationship(PermWidget)
+
+
+class PermReview(orm.Base):
+    '''Test model with two relations to widgets.'''
+    __tablename__ = 'test_baph_perm_review'
+
+    class Meta:
+        filter_translations = {
+            'org': 'PermWidget.organization_id',
+            'source_org': 'source.organization_id',
+            }
+
+    id = Column(Integer, primary_key=True)
+    widget_id = Column(Integer, ForeignKey(PermWidget.id))
+    source_id = Column(Integer, ForeignKey(PermWidget.id))
+
+    widget = relationship(PermWidget, foreign_keys=[widget_id])
+    source = relationship(PermWidget, foreign_keys=[source_id])
+
+
+def reference_has_obj_perm(user, resource, action, obj):
+    '''The per-object permission check as it was before the bulk checks
+    were added, used as the reference for the current implementations.
+    '''
+    if type(obj)._meta.permission_handler:
+        parent_obj = obj.get_parent(type(obj)._meta.permission_handler)
+        if not parent_obj:
+            return True
+        parent_res = type(parent_obj).resource_name
+        if action != 'view':
+            action = 'edit'
+        return reference_has_obj_perm(user, parent_res, action, parent_obj)
+
+    ctx = user.get_context()
+    perms = user.get_resource_permissions(resource, action)
+    if not perms:
+        return False
+
+    perm_map = {}
+    explicit = []
+    modes = ('explicit_allow', 'explicit_deny', 'general_allow',
+             'general_deny')
+    matches = dict((mode, []) for mode in modes)
+    errors = dict((mode, []) for mode in modes)
+
+    for p in perms:
+        mode = '%s_%s' % ('explicit' if p._explicit else 'general',
+                          'deny' if p._deny else 'allow')
+        if not p.key:
+            if p._deny:
+                return False
+            matches[mode].append(p.key)
+            continue
+        if p._explicit:
+            explicit.append(p.key)
+        if not (p.key, p._deny) in perm_map:
+            perm_map[(p.key, p._deny)] = set()
+        if p.opcode == 'in':
+            values = json.loads(p.value)
+        else:
+            values = [p.value]
+        values = [str(value) % ctx for value in values]
+        perm_map[(p.key, p._deny)].update(values)
+
+    if action == 'add':
+        for p in type(obj)._meta.permission_parents:
+            prop = getattr(type(obj), p).property
+            col = prop.local_remote_pairs[0][0]
+            col_attr = column_to_attr(type(obj), col)
+            if not (col_attr.key, False) in perm_map:
+                perm_map[(col_attr.key, False)] = set([None])
+
+    for (k, deny), allowed_values in perm_map.items():
+        mode = '%s_%s' % ('explicit' if k in explicit else 'general',
+                          'deny' if deny else 'allow')
+        if allowed_values == set([None]):
+            continue
+        key_pieces = [key_to_value(obj, key) for key in k.split(',')]
+        if None in key_pieces:
+            continue
+        value = ','.join(key_pieces)
+        if not value:
+            continue
+        if str(value) in allowed_values:
+            matches[mode].append(k)
+        else:
+            errors[mode].append(k)
+
+    if matches['explicit_deny']:
+        return False
+    elif matches['explicit_allow']:
+        return True
+    elif matches['general_deny']:
+        return False
+    elif not matches['general_allow']:
+        return False
+    elif action != 'add':
+        return True
+    elif errors['general_allow']:
+        return False
+    else:
+        return True
+
+
+class PermissionEquivalenceTestCase(TestCase):
+    '''Tests that the bulk permission checks (has_perms, has_obj_perms) and
+    the compiled has_obj_perm match the original per-object checks.
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super(PermissionEquivalenceTestCase, cls).setUpClass()
+        orm.Base.metadata.create_all(orm.engine)
+
+    def setUp(self):
+        self.session = orm.sessionmaker()
+        self.addCleanup(self.cleanup)
+        self.org1 = Organization(name=u'org1')
+        self.org2 = Organization(name=u'org2')
+        self.session.add_all([self.org1, self.org2])
+        self.session.flush()
+
+        self.widgets = [
+            PermWidget(organization=self.org1, name=u'alpha'),
+            PermWidget(organization=self.org1, name=u'beta'),
+            PermWidget(organization=self.org2, name=u'alpha'),
+            PermWidget(name=u'gamma'),
+            ]
+        self.parts = [
+            PermPart(widget=self.widgets[0]),
+            PermPart(widget=self.widgets[2]),
+            PermPart(),
+            ]
+        self.user = User(email='alice@example.com', username='alice',
+                         password='!', organization=self.org1)
+        self.session.add_all(self.widgets + self.parts + [self.user])
+        self.session.commit()
+
+        org1 = self.org1
+        Organization.get_current = classmethod(lambda cls: org1)
+        self.addCleanup(delattr, Organization, 'get_current')
+
+    def cleanup(self):
+        self.session.rollback()
+        for model in (PermPart, PermWidget, User, Organization):
+            self.session.query(model).delete()
+        self.session.commit()
+        self.session.close()
+
+    def perm(self, key=None, value=None, action='view', explicit=False,
+             deny=False):
+        if isinstance(value, list):
+            value = json.dumps(value)
+        perm = PermissionStruct(codename='%s_%s' % (action, key),
+                                resource='PermWidget', action=action,
+                                key=key, value=value)
+        perm._explicit = explicit
+        perm._deny = deny
+        return perm
+
+    def set_permissions(self, perms, org_perms=None):
+        """
+        Grants perms (in all organizations) and org_perms (a dict of
+        org id: perms) to the user, for the view and edit actions
+        """
+        all_perms = {None: perms}
+        all_perms.update(org_perms or {})
+        permissions = {}
+        for org_id, org_perms in all_perms.items():
+            actions = permissions.setdefault(org_id, {}) \
+                .setdefault('PermWidget', {})
+            for action in ('view', 'edit', 'add'):
+                actions[action] = set(self.perm(p.key, p.value, action,
+                                                p._explicit, p._deny)
+                                      for p in org_perms)
+        self.user.get_all_permissions = lambda: permissions
+        self.user.__dict__.pop('_perm_cache', None)
+
+    def check(self, expected=None):
+        """
+        Compares the reference implementation with has_obj_perm,
+        has_obj_perms and has_perms, for widgets and parts, and returns
+        the widget results for the view action
+        """
+        user = self.user
+        for is_superuser in (False, True):
+            user.is_superuser = is_superuser
+            for action in ('view', 'edit'):
+                for resource, objs in (('PermWidget', self.widgets),
+                                       ('PermPart', self.parts)):
+                    old = [reference_has_obj_perm(user, resource, action, obj)
+                           for obj in objs]
+                    single = [user.has_obj_perm(resource, action, obj)
+                              for obj in objs]
+                    self.assertEqual(single, old)
+                    self.assertEqual(
+                        user.has_obj_perms(resource, action, objs), old)
+
+                # filters which require a load, and filters which don't
+                old = [reference_has_obj_perm(user, 'PermWidget', action, w)
+                       for w in self.widgets]
+                filters = [{'id': w.id} for w in self.widgets]
+                self.assertEqual(
+                    [user.has_perm('PermWidget', action, f) for f in filters],
+                    old)
+                self.assertEqual(
+                    user.has_perms('PermWidget', action, filters), old)
+                filters = [{'id': w.id, 'organization_id': w.organization_id,
+                            'name': w.name} for w in self.widgets]
+                self.assertEqual(
+                    user.has_perms('PermWidget', action, filters),
+                    [user.has_perm('PermWidget', action, f) for f in filters])
+
+            # add checks are evaluated against transient objects
+            filters = [{'organization_id': w.organization_id,
+                        'name': w.name} for w in self.widgets]
+            old = [reference_has_obj_perm(user, 'PermWidget', 'add',
+                                          PermWidget(**f)) for f in filters]
+            self.assertEqual(
+                [user.has_perm('PermWidget', 'add', f) for f in filters], old)
+            self.assertEqual(user.has_perms('PermWidget', 'add', filters), old)
+        user.is_superuser = False
+
+        result = [reference_has_obj_perm(user, 'PermWidget', 'view', w)
+                  for w in self.widgets]
+        if expected is not None:
+            self.assertEqual(result, expected)
+        return result
+
+    def test_no_permissions(self):
+        self.set_permissions([])
+        self.check([False, False, False, False])
+
+    def test_general_allow(self):
+        self.set_permissions([
+            self.perm('organization_id', str(self.org1.id))])
+        self.check([True, True, False, False])
+
+    def test_allow_list(self):
+        self.set_permissions([self.perm('name', ['alpha', 'gamma'])])
+        self.check([True, False, True, True])
+
+    def test_chained_key(self):
+        self.set_permissions([self.perm('organization.name', 'org2')])
+        self.check([False, False, True, False])
+
+    def test_composite_key(self):
+        self.set_permissions([
+            self.perm('organization_id,name', '%s,alpha' % self.org1.id)])
+        self.check([True, False, False, False])
+
+    def test_general_deny(self):
+        self.set_permissions([
+            self.perm('organization_id', str(self.org1.id)),
+            self.perm('name', 'beta', deny=True)])
+        self.check([True, False, False, False])
+
+    def test_explicit_allow(self):
+        self.set_permissions([
+            self.perm('organization_id', str(self.org2.id)),
+            self.perm('name', 'alpha', deny=True),
+            self.perm('id', str(self.widgets[0].id), explicit=True)])
+        self.check([True, False, False, False])
+
+    def test_explicit_deny(self):
+        self.set_permissions([
+            self.perm('organization_id', str(self.org1.id)),
+            self.perm('id', str(self.widgets[0].id), explicit=True,
+                      deny=True)])
+        self.check([False, True, False, False])
+
+    def test_boolean_allow(self):
+        self.set_permissions([self.perm()])
+        self.check([True, True, True, True])
+
+    def test_boolean_deny(self):
+        self.set_permissions([
+            self.perm('organization_id', str(self.org1.id)),
+            self.perm(deny=True)])
+        self.check([False, False, False, False])
+
+    def test_cross_org(self):
+        # permissions granted in another organization don't apply
+        self.set_permissions([self.perm('name', 'alpha')], {
+            str(self.org2.id): [self.perm()],
+            str(self.org1.id): [self.perm('name', 'gamma')],
+            })
+        self.check([True, False, True, True])
+
+    def record_statements(self):
+        statements = []
+        def record(conn, cursor, statement, params, context, executemany):
+            statements.append(statement)
+        event.listen(orm.engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, orm.engine, 'before_cursor_execute',
+                        record)
+        return statements
+
+    def test_perm_objects_first_match(self):
+        # non-unique and empty filters load their first match only
+        filters = [{'name': u'alpha'}, {}, {'name': u'alpha'}]
+        statements = self.record_statements()
+        objs = self.user.get_perm_objects(PermWidget, 'view', filters)
+        self.assertEqual(len(statements), 2)
+        for statement in statements:
+            self.assertIn('LIMIT', statement)
+            self.assertNotIn(' OR ', statement)
+        first = self.session.query(PermWidget).filter_by(name=u'alpha') \
+            .first()
+        self.assertEqual(objs[0].id, first.id)
+        self.assertEqual(objs[2].id, first.id)
+        self.assertEqual(objs[1].id,
+                         self.session.query(PermWidget).first().id)
+
+    def test_perm_objects_by_pk(self):
+        # filters on the primary key alone are loaded with one IN query
+        filters = [{'id': w.id} for w in self.widgets] + [{'id': -1}]
+        statements = self.record_statements()
+        objs = self.user.get_perm_objects(PermWidget, 'view', filters)
+        self.assertEqual(len(statements), 1)
+        self.assertIn(' IN ', statements[0])
+        self.assertEqual([obj.id for obj in objs[:-1]],
+                         [w.id for w in self.widgets])
+        self.assertIsNone(objs[-1])
+
+
+class ResourceFilterTestCase(TestCase):
+    '''Tests :func:`baph.auth.mixins.compile_resource_filters`.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super(ResourceFilterTestCase, cls).setUpClass()
+        orm.Base.metadata.create_all(orm.engine)
+
+    def setUp(self):
+        self.session = orm.sessionmaker()
+        self.addCleanup(self.cleanup)
+        self.org1 = Organization(name=u'org1')
+        self.org2 = Organization(name=u'org2')
+        self.widgets = [
+            PermWidget(organization=self.org1, name=u'alpha'),
+            PermWidget(organization=self.org1, name=u'beta'),
+            PermWidget(organization=self.org2, name=u'alpha'),
+            PermWidget(name=u'gamma'),
+            ]
+        self.tags = [PermTag(widget=w, label=w.name) for w in self.widgets]
+        self.tags.append(PermTag(label=u'alpha'))
+        self.session.add_all([self.org1, self.org2] + self.tags)
+        self.session.commit()
+
+    def cleanup(self):
+        self.session.rollback()
+        for model in (PermReview, PermTag, PermWidget, Organization):
+            self.session.query(model).delete()
+        self.session.commit()
+        self.session.close()
+
+    def filter(self, resource, signature):
+        """
+        Returns the indexes of the widgets (or tags) matching the compiled
+        filters, and the joins
+        """
+        filter_, joins = compile_resource_filters(resource, tuple(signature))
+        model = orm.Base._decl_class_registry[resource]
+        objs = self.widgets if model is PermWidget else self.tags
+        query = self.session.query(model.id).join(*joins).filter(filter_)
+        ids = [row.id for row in query]
+        self.assertEqual(len(ids), len(set(ids)))
+        return sorted(i for i, obj in enumerate(objs) if obj.id in ids), joins
+
+    def test_merge_exact_values(self):
+        filter_, joins = compile_resource_filters('PermWidget', (
+            ('name', 'alpha', None, False),
+            ('name', 'beta', None, False),
+            ))
+        # a single IN clause, rather than an OR of comparisons
+        self.assertEqual(str(filter_).count(' IN '), 1)
+        self.assertNotIn(' OR ', str(filter_))
+        self.assertEqual(self.filter('PermWidget', [
+            ('name', 'alpha', None, False),
+            ('name', 'beta', None, False),
+            ]), ([0, 1, 2], ()))
+
+    def test_merge_range_and_exact_values(self):
+        self.assertEqual(self.filter('PermWidget', [
+            ('name', json.dumps(['alpha']), 'in', False),
+            ('name', 'gamma', None, False),
+            ]), ([0, 2, 3], ()))
+
+    def test_merge_deny_values(self):
+        self.assertEqual(self.filter('PermWidget', [
+            ('organization_id', str(self.org1.id), None, False),
+            ('organization_id', str(self.org2.id), None, False),
+            ('name', 'beta', None, True),
+            ('name', 'gamma', None, True),
+            ]), ([0, 2], ()))
+
+    def test_chained_key(self):
+        self.assertEqual(self.filter('PermWidget', [
+            ('organization.name', 'org1', None, False),
+            ('organization.name', 'org2', None, False),
+            ]), ([0, 1, 2], (PermWidget.organization,)))
+
+    def test_translated_key(self):
+        self.assertEqual(self.filter('PermTag', [
+            ('org', str(self.org1.id), None, False),
+            ]), ([0, 1], (PermTag.widget,)))
+
+    def test_translated_chained_key(self):
+        self.assertEqual(self.filter('PermTag', [
+            ('org_name', 'org2', None, False),
+            ('label', 'gamma', None, False),
+            ]), ([2], (PermTag.widget, PermWidget.organization)))
+
+    def test_translated_and_local_keys(self):
+        # the join is only recorded once
+        self.assertEqual(self.filter('PermTag', [
+            ('org', str(self.org1.id), None, False),
+            ('org_name', 'org1', None, False),
+            ('label', 'alpha', None, True),
+            ]), ([1], (PermTag.widget, PermWidget.organization)))
+
+    def test_join_target(self):
+        self.assertIs(get_join_target(PermTag, PermWidget), PermTag.widget)
+        self.assertIs(get_join_target(PermWidget, PermTag), PermTag)
+        # ambiguous relations are refused
+        self.assertRaises(Exception, get_join_target, PermReview, PermWidget)
+        self.assertRaises(Exception, compile_resource_filters, 'PermReview',
+                          (('org', str(self.org1.id), None, False),))
+
+    def test_translated_relation_path(self):
+        reviews = [PermReview(widget=self.widgets[0], source=self.widgets[2]),
+                   PermReview(widget=self.widgets[2], source=self.widgets[0])]
+        self.session.add_all(reviews)
+        self.session.commit()
+        filter_, joins = compile_resource_filters('PermReview', (
+            ('source_org', str(self.org2.id), None, False),))
+        self.assertEqual(joins, (PermReview.source,))
+        ids = [row.id for row in self.session.query(PermReview.id)
+               .join(*joins).filter(filter_)]
+        self.assertEqual(ids, [reviews[0].id])
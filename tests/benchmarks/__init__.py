@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+'''Micro-benchmarks for baph hot paths.
+
+These are not collected by the test runner. Run one directly, e.g.::
+
+    DJANGO_SETTINGS_MODULE=tests.benchmarks.settings \\
+        python -m tests.benchmarks.bench_permission_keys
+'''
+import gc
+import time
+
+
+def bench(name, func, number=1000, repeat=3, unit='calls'):
+    '''Runs ``func`` ``number`` times, ``repeat`` times over, and prints the
+    best throughput. Returns the best time per call, in seconds.
+    '''
+    timings = []
+    for i in range(repeat):
+        gc.collect()
+        start = time.time()
+        for j in xrange(number):
+            func()
+        timings.append(time.time() - start)
+    best = min(timings) / number
+    rate = 1.0 / best if best else float('inf')
+    print '%-50s %12.1f %s/sec (%.3f ms)' % (name, rate, unit, best * 1000)
+    return best
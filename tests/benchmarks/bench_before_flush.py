@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks the ``before_flush`` listener for a session holding many
+dirty objects, for a class with no hooks and a class with a custom
+``before_flush``.
+'''
+from sqlalchemy import Column, Integer, Unicode
+from sqlalchemy.orm import configure_mappers
+
+from baph.db.models.base import before_flush
+from baph.db.orm import ORM
+from tests.benchmarks import bench
+
+
+COUNT = 50000
+
+orm = ORM.get()
+Base = orm.Base
+
+
+class BenchFlushPlain(Base):
+    __tablename__ = 'bench_flush_plain'
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(20))
+
+    class Meta:
+        app_label = 'benchmarks'
+
+class BenchFlushHooked(Base):
+    __tablename__ = 'bench_flush_hooked'
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(20))
+
+    class Meta:
+        app_label = 'benchmarks'
+
+    def before_flush(self, session, add):
+        self.name = self.name.strip()
+
+
+def legacy_before_flush(session, flush_context, instances):
+    '''The per-object dispatch used previously, for comparison.'''
+    for obj in session.new:
+        obj._before_flush(session, add=True)
+    for obj in session.dirty:
+        obj._before_flush(session, add=False)
+
+def dirty_session(model, count=COUNT):
+    session = orm.sessionmaker()
+    objs = [model(id=i, name=u'name') for i in xrange(count)]
+    session.add_all(objs)
+    return session
+
+def main():
+    configure_mappers()
+    for model in (BenchFlushPlain, BenchFlushHooked):
+        session = dirty_session(model)
+        label = '%s x %d' % (model.__name__, COUNT)
+        bench('legacy before_flush, %s' % label,
+              lambda: legacy_before_flush(session, None, None),
+              number=1, repeat=3, unit='flushes')
+        bench('before_flush, %s' % label,
+              lambda: before_flush(session, None, None),
+              number=1, repeat=3, unit='flushes')
+        session.expunge_all()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks model instantiation (the declarative ``constructor``) for
+narrow and wide models, with and without column defaults.
+'''
+from sqlalchemy import Column, Integer, Unicode
+from sqlalchemy.orm import configure_mappers
+
+from baph.db.orm import ORM
+from tests.benchmarks import bench
+
+
+orm = ORM.get()
+Base = orm.Base
+
+
+def build_model(name, width, defaults=True):
+    '''Builds a model with ``width`` columns, half of which have a scalar
+    default and a quarter a callable default (if ``defaults`` is set).
+    '''
+    attrs = {
+        '__module__': __name__,
+        '__tablename__': 'bench_ctor_%s' % name.lower(),
+        'id': Column(Integer, primary_key=True),
+    }
+    for i in range(width):
+        kwargs = {}
+        if defaults and i % 2 == 0:
+            kwargs['default'] = u'value'
+        elif defaults and i % 4 == 1:
+            kwargs['default'] = lambda: u'generated'
+        attrs['col%d' % i] = Column(Unicode(20), **kwargs)
+    attrs['Meta'] = type('Meta', (), {'app_label': 'benchmarks'})
+    return type(name, (Base,), attrs)
+
+def main():
+    models = [
+        ('narrow (5 cols)', build_model('BenchCtorNarrow', 5)),
+        ('wide (100 cols)', build_model('BenchCtorWide', 100)),
+        ('wide, no defaults (100 cols)',
+            build_model('BenchCtorWideNoDefaults', 100, defaults=False)),
+    ]
+    configure_mappers()
+    for label, model in models:
+        bench('%s, no kwargs' % label, lambda: model(),
+              number=2000, unit='instances')
+        bench('%s, 3 kwargs' % label,
+              lambda: model(id=1, col0=u'a', col1=u'b'),
+              number=2000, unit='instances')
+
+if __name__ == '__main__':
+    main()
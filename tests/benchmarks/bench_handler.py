@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks per-request handler overhead by driving
+``BaseHandler.get_response`` and ``ProxyHandler.get_response`` with
+synthetic requests, against the per-request resolver construction used
+previously.
+'''
+from django.core.urlresolvers import RegexURLPattern, RegexURLResolver
+from django.test import RequestFactory
+
+from baph.conf import settings
+from baph.core.handlers.base import BaseHandler
+from baph.core.handlers.proxy import ProxyHandler
+from baph.utils.module_loading import import_string
+from tests.benchmarks import bench
+
+
+URLCONF = 'tests.benchmarks.urls'
+PATHS = ['/page0/1/', '/page49/1/', '/nested/section10/1/', '/missing/1/']
+
+
+class LegacyHandler(BaseHandler):
+    '''Builds a new resolver for every request.'''
+    def get_resolver(self, urlconf=None):
+        return RegexURLResolver(r'^/', urlconf or settings.ROOT_URLCONF)
+
+class LegacyProxyHandler(ProxyHandler):
+    '''Builds a new resolver for every request, appending the catchall to
+    the urlconf's pattern list when it isn't already reversible.'''
+    def get_resolver(self, urlconf=None):
+        resolver = RegexURLResolver(r'^/', urlconf or settings.PROXY_URLCONF)
+        callback = import_string(settings.PROXY_DEFAULT_VIEW)
+        if callback not in resolver.reverse_dict:
+            resolver.url_patterns.append(RegexURLPattern(r'', callback))
+        return resolver
+
+def make_handler(cls):
+    handler = cls()
+    if handler._middleware_chain is None:
+        handler.load_middleware()
+    return handler
+
+def main():
+    settings.ROOT_URLCONF = URLCONF
+    settings.PROXY_URLCONF = URLCONF
+    settings.PROXY_DEFAULT_VIEW = 'tests.benchmarks.urls.proxy_view'
+    factory = RequestFactory()
+    requests = [factory.get(path) for path in PATHS]
+
+    def run(handler, requests):
+        for request in requests:
+            handler.get_response(request)
+
+    # the base handler 404s on the last path, and the proxy handler sends
+    # it to the catchall view
+    base_requests = requests[:-1]
+    proxy = make_handler(ProxyHandler)
+    assert proxy.get_response(requests[-1]).content == 'proxied'
+
+    # the legacy proxy handler modifies the urlconf, so it goes last
+    for label, cls, reqs in (
+            ('legacy BaseHandler', LegacyHandler, base_requests),
+            ('BaseHandler', BaseHandler, base_requests),
+            ('ProxyHandler', ProxyHandler, requests),
+            ('legacy ProxyHandler', LegacyProxyHandler, requests)):
+        handler = make_handler(cls)
+        bench('%s.get_response x %d' % (label, len(reqs)),
+              lambda: run(handler, reqs), number=200, unit='batches')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks loading rows with large JSON columns: eager decoding with the
+standard library codec and with ``BAPH_JSON_CODEC``, and lazy decoding,
+with and without reading the column.
+'''
+import json
+
+from sqlalchemy import Column, Integer
+from sqlalchemy.orm import configure_mappers
+
+from baph.conf import settings
+from baph.db import types
+from baph.db.orm import ORM
+from tests.benchmarks import bench
+
+
+ROWS = 100000
+CODECS = ['ujson', 'simplejson']
+
+orm = ORM.get()
+Base = orm.Base
+
+
+class BenchJson(Base):
+    __tablename__ = 'bench_json'
+    id = Column(Integer, primary_key=True)
+    data = Column(types.JsonText())
+
+    class Meta:
+        app_label = 'benchmarks'
+
+class BenchLazyJson(Base):
+    __tablename__ = 'bench_lazy_json'
+    id = Column(Integer, primary_key=True)
+    data = Column(types.JsonText(lazy=True))
+
+    class Meta:
+        app_label = 'benchmarks'
+
+
+def make_value(i):
+    return {
+        'id': i,
+        'name': u'item %d' % i,
+        'tags': [u'tag%d' % j for j in range(20)],
+        'attributes': dict((u'key%d' % j, {'value': j, 'label': u'v%d' % j})
+                           for j in range(20)),
+    }
+
+def populate(model, count=ROWS):
+    table = model.__table__
+    table.create(orm.engine, checkfirst=True)
+    orm.engine.execute(table.delete())
+    rows = [{'id': i + 1, 'data': make_value(i)}
+            for i in xrange(count)]
+    orm.engine.execute(table.insert(), rows)
+
+def set_codec(codec):
+    settings.BAPH_JSON_CODEC = codec
+    types._json_codec = None
+    return types.get_json_codec().__name__
+
+def load(model, read=False):
+    session = orm.sessionmaker()
+    objs = session.query(model).all()
+    if read:
+        for obj in objs:
+            obj.data['id']
+    session.close()
+
+def main():
+    configure_mappers()
+    populate(BenchJson)
+    populate(BenchLazyJson)
+    for codec in [None] + CODECS:
+        name = set_codec(codec)
+        if codec and name == 'json':
+            # not installed
+            continue
+        bench('load %d rows (%s)' % (ROWS, name),
+              lambda: load(BenchJson), number=1, repeat=2, unit='loads')
+        bench('load %d rows (%s, lazy)' % (ROWS, name),
+              lambda: load(BenchLazyJson), number=1, repeat=2, unit='loads')
+        bench('load %d rows, read (%s, lazy)' % (ROWS, name),
+              lambda: load(BenchLazyJson, read=True), number=1, repeat=2,
+              unit='loads')
+    print '(%d bytes of JSON per row)' % len(json.dumps(make_value(0)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks permission key generation (``get_fks`` / ``normalize_key``)
+for a deep chain of permission parents.
+'''
+from sqlalchemy import Column, ForeignKey, Integer, Unicode
+from sqlalchemy.orm import configure_mappers, relationship
+
+from baph.db.models.mixins import reset_permission_graph
+from baph.db.orm import ORM
+from tests.benchmarks import bench
+
+
+DEPTH = 8
+
+orm = ORM.get()
+Base = orm.Base
+
+
+def build_hierarchy(depth=DEPTH):
+    '''Builds ``depth`` models, each a child of the previous one.'''
+    models = []
+    parent = None
+    for i in range(depth):
+        attrs = {
+            '__module__': __name__,
+            '__tablename__': 'bench_perm_level%d' % i,
+            'id': Column(Integer, primary_key=True),
+            'name': Column(Unicode(50)),
+        }
+        meta = {
+            'app_label': 'benchmarks',
+            'permission_resources': {'level%d' % i: ['view', 'edit']},
+            'permission_limiters': {'owned': {'id': '%(user.id)s'}},
+        }
+        if parent is not None:
+            attrs['parent_id'] = Column(Integer, ForeignKey(parent.id))
+            attrs['parent'] = relationship(parent)
+            meta['permission_parents'] = ['parent']
+        attrs['Meta'] = type('Meta', (), meta)
+        parent = type('BenchPermLevel%d' % i, (Base,), attrs)
+        models.append(parent)
+    configure_mappers()
+    return models
+
+def get_permission_keys(model):
+    keys = []
+    for limiter, key, value, col_key, base_cls in model.get_fks():
+        if key and key.find(',') == -1:
+            key = model.normalize_key(key)
+        keys.append((limiter, key, value, col_key, base_cls))
+    return keys
+
+def get_uncached_permission_keys(model):
+    '''Clears the permission graph caches first, so every call walks the
+    relationships as it did before they were cached.
+    '''
+    reset_permission_graph()
+    return get_permission_keys(model)
+
+def main():
+    models = build_hierarchy()
+    leaf = models[-1]
+    print 'depth=%d, %d keys for %s' % (
+        len(models), len(get_permission_keys(leaf)), leaf.__name__)
+    uncached = bench('uncached get_fks + normalize_key (leaf)',
+                     lambda: get_uncached_permission_keys(leaf), number=200)
+    cached = bench('get_fks + normalize_key (leaf)',
+                   lambda: get_permission_keys(leaf), number=200)
+    print 'leaf speedup: %.1fx' % (uncached / cached)
+    uncached = bench('uncached get_fks + normalize_key (all levels)',
+                     lambda: [get_uncached_permission_keys(m) for m in models],
+                     number=50)
+    cached = bench('get_fks + normalize_key (all levels)',
+                   lambda: [get_permission_keys(m) for m in models], number=50)
+    print 'all levels speedup: %.1fx' % (uncached / cached)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks dict serialization of query results: per-object
+``to_dict``, the bulk ``Model.to_dicts``, and ``to_dicts`` over Core rows.
+'''
+from sqlalchemy import Column, Integer, Unicode
+from sqlalchemy.orm import configure_mappers
+
+from baph.db.orm import ORM
+from tests.benchmarks import bench
+
+
+WIDTH = 20
+ROWS = 1000
+
+orm = ORM.get()
+Base = orm.Base
+
+
+def build_model(width=WIDTH):
+    attrs = {
+        '__module__': __name__,
+        '__tablename__': 'bench_to_dict',
+        'id': Column(Integer, primary_key=True),
+    }
+    for i in range(width):
+        attrs['col%d' % i] = Column(Unicode(20))
+    attrs['Meta'] = type('Meta', (), {'app_label': 'benchmarks'})
+    return type('BenchToDict', (Base,), attrs)
+
+def populate(model, count=ROWS, width=WIDTH):
+    table = model.__table__
+    table.create(orm.engine, checkfirst=True)
+    orm.engine.execute(table.delete())
+    rows = []
+    for i in range(count):
+        row = dict(('col%d' % j, u'value %d' % j) for j in range(width))
+        row['id'] = i + 1
+        rows.append(row)
+    orm.engine.execute(table.insert(), rows)
+
+def main():
+    model = build_model()
+    configure_mappers()
+    populate(model)
+    session = orm.sessionmaker()
+    objs = session.query(model).all()
+    rows = session.execute(model.__table__.select()).fetchall()
+    assert model.to_dicts(objs) == [obj.to_dict() for obj in objs]
+    assert model.to_dicts(rows, rows=True) == model.to_dicts(objs)
+
+    bench('[obj.to_dict() for obj in objs]',
+          lambda: [obj.to_dict() for obj in objs],
+          number=1, repeat=5, unit='batches')
+    bench('Model.to_dicts(objs)', lambda: model.to_dicts(objs),
+          number=1, repeat=5, unit='batches')
+    bench('Model.to_dicts(rows, rows=True)',
+          lambda: model.to_dicts(rows, rows=True),
+          number=1, repeat=5, unit='batches')
+    bench('query + to_dict',
+          lambda: [obj.to_dict() for obj in
+                   orm.sessionmaker().query(model).all()],
+          number=1, repeat=5, unit='batches')
+    bench('execute + to_dicts(rows=True)',
+          lambda: model.to_dicts(orm.sessionmaker().execute(
+              model.__table__.select()), rows=True),
+          number=1, repeat=5, unit='batches')
+    print '(%d rows x %d columns per batch)' % (ROWS, WIDTH + 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks bind and result processing for ``UUID`` and
+``TZAwareDateTime`` against the per-value dispatch used previously, for
+the sqlite and mysql dialects.
+'''
+import datetime
+import re
+import uuid
+
+from django.utils.timezone import is_naive, make_aware
+from sqlalchemy.dialects.mysql.base import MySQLDialect
+from sqlalchemy.dialects.sqlite.base import SQLiteDialect
+
+from baph.db.types import TZAwareDateTime, UUID, chain_processors
+from tests.benchmarks import bench
+
+
+ROWS = 10000
+TZ = 'America/Los_Angeles'
+
+
+def legacy_uuid_bind(value, dialect):
+    if value:
+        if isinstance(value, uuid.UUID):
+            if dialect.name == 'mysql':
+                return value.bytes
+            return str(value)
+        raise ValueError('value %s is not a valid uuid.UUID' % value)
+    return None
+
+def legacy_uuid_result(value, dialect):
+    if value:
+        if dialect.name == 'mysql':
+            return uuid.UUID(bytes=value)
+        return uuid.UUID(value)
+    return None
+
+def legacy_datetime_bind(tz, value):
+    if isinstance(value, basestring):
+        value = value.replace('T', ' ').replace('Z', '+00:00')
+        p = re.compile('([0-9: -]+)\.?([0-9]*)([\+-][0-9]{2}:?[0-9]{2})?')
+        dt, ms, offset = p.match(value).groups()
+        value = datetime.datetime.strptime(dt, '%Y-%m-%d %H:%M:%S')
+        if offset:
+            pol, h, m = offset[0], int(offset[1:3]), int(offset[-2:])
+            delta = datetime.timedelta(hours=h, minutes=m)
+            if pol == '+':
+                value -= delta
+            else:
+                value += delta
+    if is_naive(value):
+        value = make_aware(value, tz)
+    else:
+        value = value.replace(tzinfo=tz)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+def legacy_datetime_result(tz, value):
+    return tz.localize(value, is_dst=None)
+
+def make_datetimes(count=ROWS):
+    start = datetime.datetime(2015, 6, 1, 9, 0, 0)
+    return [start + datetime.timedelta(seconds=17 * i) for i in range(count)]
+
+def main():
+    uuids = [uuid.uuid4() for i in range(ROWS)]
+    datetimes = make_datetimes()
+    strings = [dt.strftime('%Y-%m-%dT%H:%M:%S+02:00') for dt in datetimes]
+    type_ = TZAwareDateTime(TZ)
+
+    for dialect in (SQLiteDialect(), MySQLDialect()):
+        uuid_type = UUID().dialect_impl(dialect)
+        bind = uuid_type.bind_processor(dialect)
+        result = uuid_type.result_processor(dialect, None)
+        legacy_bind = chain_processors(
+            lambda value: legacy_uuid_bind(value, dialect),
+            uuid_type.impl.bind_processor(dialect))
+        legacy_result = chain_processors(
+            uuid_type.impl.result_processor(dialect, None),
+            lambda value: legacy_uuid_result(value, dialect))
+        raw = [legacy_bind(u) for u in uuids]
+        assert [bind(u) for u in uuids] == raw
+        assert [result(r) for r in raw] == [legacy_result(r) for r in raw]
+        name = dialect.name
+        bench('legacy UUID bind (%s)' % name,
+              lambda: [legacy_bind(u) for u in uuids],
+              number=1, repeat=5, unit='batches')
+        bench('UUID bind (%s)' % name, lambda: [bind(u) for u in uuids],
+              number=1, repeat=5, unit='batches')
+        bench('legacy UUID result (%s)' % name,
+              lambda: [legacy_result(r) for r in raw],
+              number=1, repeat=5, unit='batches')
+        bench('UUID result (%s)' % name, lambda: [result(r) for r in raw],
+              number=1, repeat=5, unit='batches')
+
+    dialect = MySQLDialect()
+    bind = type_.dialect_impl(dialect).bind_processor(dialect)
+    result = type_.dialect_impl(dialect).result_processor(dialect, None)
+    tz = type_.tz
+    assert [bind(s) for s in strings] == \
+        [legacy_datetime_bind(tz, s) for s in strings]
+    assert [result(dt) for dt in datetimes] == \
+        [legacy_datetime_result(tz, dt) for dt in datetimes]
+    bench('legacy TZAwareDateTime bind (datetime)',
+          lambda: [legacy_datetime_bind(tz, dt) for dt in datetimes],
+          number=1, repeat=5, unit='batches')
+    bench('TZAwareDateTime bind (datetime)',
+          lambda: [bind(dt) for dt in datetimes],
+          number=1, repeat=5, unit='batches')
+    bench('legacy TZAwareDateTime bind (string)',
+          lambda: [legacy_datetime_bind(tz, s) for s in strings],
+          number=1, repeat=5, unit='batches')
+    bench('TZAwareDateTime bind (string)',
+          lambda: [bind(s) for s in strings],
+          number=1, repeat=5, unit='batches')
+    bench('legacy TZAwareDateTime result',
+          lambda: [legacy_datetime_result(tz, dt) for dt in datetimes],
+          number=1, repeat=5, unit='batches')
+    bench('TZAwareDateTime result',
+          lambda: [result(dt) for dt in datetimes],
+          number=1, repeat=5, unit='batches')
+    print '(%d rows per batch)' % ROWS
+
+if __name__ == '__main__':
+    main()
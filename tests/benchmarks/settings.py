@@ -0,0 +1,27 @@
+# Minimal settings for running the benchmarks against sqlite.
+
+import os
+import tempfile
+
+SECRET_KEY = 'benchmarks'
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.gettempdir(), 'baph-benchmarks.db'),
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+CACHE_ENABLED = False
+
+INSTALLED_APPS = ()
+
+SERIALIZATION_MODULES = {
+    'json': 'baph.core.serializers.json',
+}
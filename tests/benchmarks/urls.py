@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+'''A urlconf for the handler benchmarks, with enough patterns that
+resolving and reversing aren't trivial.
+'''
+from django.conf.urls import include, patterns, url
+from django.http import HttpResponse
+
+
+def view(request, *args, **kwargs):
+    return HttpResponse('ok')
+
+def proxy_view(request, *args, **kwargs):
+    return HttpResponse('proxied')
+
+
+nested = patterns('',
+    *[url(r'^section%d/(?P<pk>\d+)/$' % i, view, name='nested-%d' % i)
+      for i in range(20)]
+)
+
+urlpatterns = patterns('',
+    url(r'^nested/', include(nested)),
+    *[url(r'^page%d/(?P<pk>\d+)/$' % i, view, name='page-%d' % i)
+      for i in range(50)]
+)
@@ -0,0 +1,41 @@
+# Minimal settings for running the tests against sqlite, ie.
+#
+#     DJANGO_SETTINGS_MODULE=tests.settings python -m unittest tests.test_geo
+
+import os
+import tempfile
+
+SECRET_KEY = 'tests'
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.gettempdir(), 'baph-tests.db'),
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+CACHE_ENABLED = False
+
+INSTALLED_APPS = (
+    'baph.auth',
+    'baph.auth.registration',
+)
+
+AUTH_USER_FIELD_TYPE = 'Integer'
+EMAIL_FIELD_LENGTH = 255
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+DEFAULT_FROM_EMAIL = 'noreply@example.com'
+
+SERIALIZATION_MODULES = {
+    'json': 'baph.core.serializers.json',
+}
+
+ROOT_URLCONF = 'baph.auth.registration.urls'
+
+OAUTH_STORE = 'baph.contrib.oauth.store.ModelStore'
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from django.core.management.base import CommandError
+from django.test.utils import override_settings
+from sqlalchemy import Column, Integer, Unicode
+
+from baph.core.cache import utils as cache_utils
+from baph.core.cache.utils import (CacheNamespace, bump_cache_namespaces,
+                                   get_cache, get_uncovered_models)
+from baph.core.management.commands.loaddata import Command as LoadData
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class NamespacedItem(orm.Base):
+    '''Test model cached in a namespaced cache.'''
+    __tablename__ = 'test_baph_namespaced_item'
+
+    class Meta:
+        cache_alias = 'namespaced'
+        cache_timeout = 60
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(50))
+
+
+class PlainItem(orm.Base):
+    '''Test model cached in a cache without a namespace.'''
+    __tablename__ = 'test_baph_plain_item'
+
+    class Meta:
+        cache_alias = 'plain'
+        cache_timeout = 60
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(50))
+
+
+class UncachedItem(orm.Base):
+    '''Test model which isn't cached.'''
+    __tablename__ = 'test_baph_uncached_item'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(50))
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class FixedCacheNamespace(CacheNamespace):
+    '''A cache namespace which always uses the same cache instance.'''
+    cache = None
+
+
+class CacheNamespaceTestCase(TestCase):
+    '''Tests cache namespace invalidation, and its use by loaddata --bulk.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super(CacheNamespaceTestCase, cls).setUpClass()
+        for model in (NamespacedItem, PlainItem, UncachedItem):
+            model.__table__.create(orm.engine, checkfirst=True)
+
+    def setUp(self):
+        self.namespace = CacheNamespace('test_ns', 'id', default_value=1)
+        caches = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'default',
+            },
+            'namespaced': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'namespaced',
+                'KEY_PREFIX': self.namespace,
+            },
+            'plain': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'plain',
+            },
+        }
+        self.settings_override = override_settings(CACHES=caches,
+                                                   CACHE_ENABLED=True)
+        self.settings_override.enable()
+        self.cache = get_cache('default')
+        self.cache.clear()
+        self.fixture_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.fixture_dir)
+        self.settings_override.disable()
+        session = orm.sessionmaker()
+        for model in (NamespacedItem, PlainItem, UncachedItem):
+            session.query(model).delete()
+        session.commit()
+
+    def get_version(self):
+        return self.cache.get(self.namespace.version_key(1))
+
+    def test_incr_version(self):
+        version = self.namespace.incr_version()
+        self.assertEqual(self.get_version(), version)
+        self.assertEqual(self.namespace.incr_version(), version + 1)
+        self.assertEqual(self.get_version(), version + 1)
+
+    def test_incr_version_concurrent_add(self):
+        # another process creates the key between the failed incr and add
+        namespace = FixedCacheNamespace('test_ns', 'id', default_value=1)
+        namespace.cache = cache = get_cache('default')
+        key = namespace.version_key(1)
+        add = cache.add
+        def concurrent_add(*args, **kwargs):
+            add(key, 100)
+            return add(*args, **kwargs)
+        cache.add = concurrent_add
+        self.assertEqual(namespace.incr_version(), 101)
+        self.assertEqual(self.get_version(), 101)
+
+    def test_uncovered_models(self):
+        models = [NamespacedItem, PlainItem, UncachedItem]
+        self.assertEqual(get_uncovered_models(models), [PlainItem])
+        self.namespace.default_value = None
+        self.assertEqual(get_uncovered_models(models),
+                         [NamespacedItem, PlainItem])
+
+    def test_bump_cache_namespaces(self):
+        self.assertEqual(bump_cache_namespaces([UncachedItem]), [])
+        self.assertEqual(self.get_version(), None)
+        self.assertEqual(bump_cache_namespaces([NamespacedItem, PlainItem]),
+                         [self.namespace])
+        version = self.get_version()
+        self.assertNotEqual(version, None)
+        bump_cache_namespaces([NamespacedItem])
+        self.assertEqual(self.get_version(), version + 1)
+
+    def test_bump_cache_namespaces_logs_stale_models(self):
+        handler = RecordingHandler()
+        cache_utils.logger.addHandler(handler)
+        self.addCleanup(cache_utils.logger.removeHandler, handler)
+        bump_cache_namespaces([NamespacedItem, UncachedItem])
+        self.assertEqual(handler.messages, [])
+        bump_cache_namespaces([NamespacedItem, PlainItem])
+        self.assertEqual(len(handler.messages), 1)
+        self.assertTrue('PlainItem' in handler.messages[0])
+
+    def load_bulk(self, path):
+        command = LoadData()
+        options = command.create_parser('', 'loaddata') \
+            .parse_args([path, '--bulk', '--verbosity', '0'])
+        options = dict(options._get_kwargs())
+        args = options.pop('args')
+        command.execute(*args, **options)
+
+    def write_fixture(self, name, objects):
+        path = os.path.join(self.fixture_dir, '%s.json' % name)
+        with open(path, 'w') as fp:
+            json.dump(objects, fp)
+        return path
+
+    def test_bulk_load(self):
+        path = self.write_fixture('namespaced', [
+            {'__model__': 'NamespacedItem', 'id': 1, 'name': 'a'},
+            {'__model__': 'UncachedItem', 'id': 1, 'name': 'b'},
+            ])
+        self.load_bulk(path)
+        session = orm.sessionmaker()
+        self.assertEqual(session.query(NamespacedItem).count(), 1)
+        self.assertEqual(session.query(UncachedItem).count(), 1)
+        self.assertNotEqual(self.get_version(), None)
+
+    def test_bulk_load_refuses_uncovered_models(self):
+        path = self.write_fixture('plain', [
+            {'__model__': 'PlainItem', 'id': 1, 'name': 'a'},
+            ])
+        self.assertRaises(CommandError, self.load_bulk, path)
+        session = orm.sessionmaker()
+        self.assertEqual(session.query(PlainItem).count(), 0)
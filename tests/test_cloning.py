@@ -0,0 +1,169 @@
+from sqlalchemy import Column, ForeignKey, Integer, String, Unicode, event
+from sqlalchemy.orm import relationship
+
+from baph.db.models.cloning import CloneEngine, IdentityKey, clone_obj
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class CloneTree(orm.Base):
+    '''Test model at the root of the cloned tree.'''
+    __tablename__ = 'test_baph_clone_tree'
+    __cloning_rules__ = {
+        'CloneTree': {'relations': ['branches']},
+        'CloneTree.branches': {'relations': ['leaves']},
+        'CloneTree.branches.leaves': {'excludes': ['size']},
+        }
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(50))
+
+
+class CloneBranch(orm.Base):
+    '''Test model for the first level of the tree.'''
+    __tablename__ = 'test_baph_clone_branch'
+
+    id = Column(Integer, primary_key=True)
+    tree_id = Column(Integer, ForeignKey(CloneTree.id))
+    name = Column(Unicode(50))
+
+    tree = relationship(CloneTree, backref='branches')
+
+
+class CloneLeaf(orm.Base):
+    '''Test model for the second level of the tree.'''
+    __tablename__ = 'test_baph_clone_leaf'
+    __mapper_args__ = {'polymorphic_on': 'kind', 'polymorphic_identity': 'leaf'}
+
+    id = Column(Integer, primary_key=True)
+    branch_id = Column(Integer, ForeignKey(CloneBranch.id))
+    kind = Column(String(10))
+    name = Column(Unicode(50))
+    size = Column(Integer)
+
+    branch = relationship(CloneBranch, backref='leaves')
+
+
+class CloneFlower(CloneLeaf):
+    '''Test subclass of leaves.'''
+    __mapper_args__ = {'polymorphic_identity': 'flower'}
+
+    color = Column(Unicode(20))
+
+
+def summarize(tree):
+    '''Returns the cloned values of a tree, to compare clones.'''
+    return (tree.id, tree.name, [
+        (branch.id, branch.tree_id, branch.name, [
+            (type(leaf).__name__, leaf.id, leaf.branch_id, leaf.name,
+             leaf.size, getattr(leaf, 'color', None))
+            for leaf in branch.leaves])
+        for branch in tree.branches])
+
+
+class CloneEngineTestCase(TestCase):
+    '''Tests that bulk cloning matches cloning one object at a time.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super(CloneEngineTestCase, cls).setUpClass()
+        orm.Base.metadata.create_all(orm.engine)
+        session = orm.sessionmaker()
+        cls.tree_id = cls.create_tree(session, flowers=True)
+        cls.plain_tree_id = cls.create_tree(session, flowers=False)
+        session.close()
+
+    @classmethod
+    def create_tree(cls, session, flowers):
+        '''Creates a tree of 50 branches with 19 leaves each (a third of
+        them flowers, if flowers is True), and returns its id.
+        '''
+        tree = CloneTree(name=u'tree')
+        for i in range(50):
+            branch = CloneBranch(tree=tree, name=u'branch %d' % i)
+            for j in range(19):
+                if flowers and not j % 3:
+                    CloneFlower(branch=branch, name=u'flower %d' % j, size=j,
+                                color=u'red')
+                else:
+                    CloneLeaf(branch=branch, name=u'leaf %d' % j, size=j)
+        session.add(tree)
+        session.commit()
+        return tree.id
+
+    @classmethod
+    def tearDownClass(cls):
+        session = orm.sessionmaker()
+        for model in (CloneLeaf, CloneBranch, CloneTree):
+            session.query(model).delete()
+        session.commit()
+        session.close()
+        super(CloneEngineTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        self.session = orm.sessionmaker()
+        self.session.expunge_all()
+        self.addCleanup(self.session.close)
+        self.addCleanup(self.session.rollback)
+        self.statements = []
+        event.listen(orm.engine, 'before_cursor_execute', self.record)
+        self.addCleanup(event.remove, orm.engine, 'before_cursor_execute',
+                        self.record)
+
+    def record(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self.statements.append(statement)
+
+    def clone(self, bulk, tree_id=None):
+        self.session.expunge_all()
+        tree = self.session.query(CloneTree).get(tree_id or self.tree_id)
+        self.statements[:] = []
+        clone = clone_obj(tree, None, bulk=bulk)
+        return clone, len(self.statements)
+
+    def test_query_count(self):
+        # the branches, and the leaves of each branch
+        clone, count = self.clone(bulk=False, tree_id=self.plain_tree_id)
+        self.assertEqual(count, 51)
+        clone, count = self.clone(bulk=True, tree_id=self.plain_tree_id)
+        self.assertEqual(count, 2)
+
+    def test_polymorphic_query_count(self):
+        # the subclass columns of each flower are loaded separately
+        clone, count = self.clone(bulk=False)
+        self.assertEqual(count, 51 + 350)
+        clone, count = self.clone(bulk=True)
+        self.assertEqual(count, 2)
+
+    def test_plain_bulk_clone_matches(self):
+        expected = summarize(self.clone(False, self.plain_tree_id)[0])
+        self.assertEqual(summarize(self.clone(True, self.plain_tree_id)[0]),
+                         expected)
+
+    def test_bulk_clone_matches(self):
+        expected = summarize(self.clone(bulk=False)[0])
+        self.assertEqual(len(expected[2]), 50)
+        self.assertEqual(expected[2][0][3][0],
+                         ('CloneFlower', None, None, u'flower 0', None, u'red'))
+        self.assertEqual(summarize(self.clone(bulk=True)[0]), expected)
+
+    def test_clone_is_saved(self):
+        clone, count = self.clone(bulk=True)
+        self.session.add(clone)
+        self.session.flush()
+        self.assertEqual(self.session.query(CloneLeaf)
+                         .join(CloneLeaf.branch)
+                         .filter(CloneBranch.tree_id == clone.id).count(), 950)
+
+    def test_identity_key(self):
+        rules = {}
+        self.assertEqual(IdentityKey(rules), IdentityKey(rules))
+        self.assertNotEqual(IdentityKey(rules), IdentityKey({}))
+        # the key keeps the object alive, so its id can't be reused
+        engine = CloneEngine(bulk=True)
+        engine.memoize(('rules', IdentityKey({})), dict)
+        self.assertNotEqual(engine.memoize(('rules', IdentityKey({})), list),
+                            {})
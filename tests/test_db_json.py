@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pickle
+
+from sqlalchemy import Column, Integer
+
+from baph.db.orm import ORM
+from baph.db.types import (Json, LazyJson, MutableDict, MutableList,
+                           unwrap_json)
+from baph.test import TestCase
+
+orm = ORM.get()
+
+
+class LazyJsonDocument(orm.Base):
+    '''Test model for lazily decoded JSON columns.'''
+    __tablename__ = 'test_baph_lazy_json_document'
+
+    id = Column(Integer, primary_key=True)
+    data = Column(Json(lazy=True))
+
+
+class MutableJsonDocument(orm.Base):
+    '''Test model for mutable JSON columns.'''
+    __tablename__ = 'test_baph_mutable_json_document'
+
+    id = Column(Integer, primary_key=True)
+    data = Column(MutableDict.as_mutable(Json()))
+
+
+class LazyJsonTestCase(TestCase):
+    '''Tests the ``lazy`` option of the Json column type.'''
+
+    value = {u'name': u'document', u'tags': [u'a', u'b'], u'size': 3}
+
+    @classmethod
+    def setUpClass(cls):
+        super(LazyJsonTestCase, cls).setUpClass()
+        LazyJsonDocument.__table__.create(orm.engine, checkfirst=True)
+        MutableJsonDocument.__table__.create(orm.engine, checkfirst=True)
+
+    def setUp(self):
+        session = orm.sessionmaker()
+        session.add(LazyJsonDocument(id=1, data=self.value))
+        session.commit()
+        session.expunge_all()
+        self.session = session
+
+    def tearDown(self):
+        self.session.query(LazyJsonDocument).delete()
+        self.session.query(MutableJsonDocument).delete()
+        self.session.commit()
+        self.session.close()
+
+    def load(self):
+        self.session.expunge_all()
+        return self.session.query(LazyJsonDocument).get(1)
+
+    def test_loaded_value_is_lazy(self):
+        doc = self.load()
+        self.assertTrue(type(doc.data) is LazyJson)
+        self.assertFalse(doc.data.decoded)
+        self.assertEqual(doc.data, self.value)
+        # the proxy doesn't pose as the decoded type
+        self.assertFalse(isinstance(doc.data, dict))
+        self.assertTrue(type(unwrap_json(doc.data)) is dict)
+        self.assertEqual(pickle.loads(pickle.dumps(doc.data)), self.value)
+
+    def test_to_dict_round_trip(self):
+        doc = self.load()
+        data = doc.to_dict()
+        self.assertTrue(type(data['data']) is dict)
+        self.assertEqual(json.loads(json.dumps(data)),
+                         {u'id': 1, u'data': self.value})
+
+    def test_to_dicts_round_trip(self):
+        doc = self.load()
+        data = LazyJsonDocument.to_dicts([doc])
+        self.assertEqual(json.loads(json.dumps(data)),
+                         [{u'id': 1, u'data': self.value}])
+
+        rows = self.session.execute(LazyJsonDocument.__table__.select())
+        data = LazyJsonDocument.to_dicts(rows, rows=True)
+        self.assertEqual(json.loads(json.dumps(data)),
+                         [{u'id': 1, u'data': self.value}])
+
+    def test_undecoded_value_is_written_back(self):
+        doc = self.load()
+        self.session.add(LazyJsonDocument(id=2, data=doc.data))
+        self.session.commit()
+        self.assertFalse(doc.data.decoded)
+        self.session.expunge_all()
+        doc = self.session.query(LazyJsonDocument).get(2)
+        self.assertEqual(doc.data, self.value)
+
+    def test_mutable_types_reject_lazy(self):
+        self.assertRaises(ValueError, MutableDict.as_mutable,
+                          Json(lazy=True))
+        self.assertRaises(ValueError, MutableList.as_mutable,
+                          Json(lazy=True))
+
+    def test_mutable_types_coerce_lazy_values(self):
+        doc = self.load()
+        self.session.add(MutableJsonDocument(id=1, data=doc.data))
+        self.session.commit()
+        self.session.expunge_all()
+        doc = self.session.query(MutableJsonDocument).get(1)
+        self.assertTrue(type(doc.data) is MutableDict)
+        self.assertEqual(doc.data, self.value)
@@ -0,0 +1,142 @@
+from cStringIO import StringIO
+import json
+import os
+import shutil
+import tempfile
+
+from django.core import serializers
+from django.core.management.base import CommandError
+from sqlalchemy import Column, Integer, Unicode
+
+from baph.auth.registration.models import QueuedEmail, UserRegistration
+from baph.core.management.commands import dumpdata
+from baph.core.management.commands.loaddata import Command as LoadData
+from baph.core.serializers import register_builtin_serializers
+from baph.db.orm import ORM
+from baph.db.types import Json
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class DumpedItem(orm.Base):
+    '''Test model for fixture round trips.'''
+    __tablename__ = 'test_baph_dumped_item'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(50))
+    data = Column(Json)
+
+
+class DumpDataTestCase(TestCase):
+    '''Tests the streaming and parallel modes of the dumpdata command.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super(DumpDataTestCase, cls).setUpClass()
+        orm.Base.metadata.create_all(orm.engine)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        session = orm.sessionmaker()
+        session.add_all([
+            QueuedEmail(id=i, subject_template='subject.txt',
+                        message_template='message.txt',
+                        recipient='user%d@example.com' % i,
+                        context={'key': i})
+            for i in range(1, 6)])
+        session.commit()
+        session.close()
+
+    def tearDown(self):
+        session = orm.sessionmaker()
+        session.query(QueuedEmail).delete()
+        session.commit()
+        session.close()
+
+    def dump(self, *argv):
+        command = dumpdata.Command()
+        options, args = command.create_parser('', 'dumpdata') \
+            .parse_args(['baph.auth.registration'] + list(argv))
+        stdout = StringIO()
+        stderr = StringIO()
+        command.execute(*args, stdout=stdout, stderr=stderr,
+                        **options.__dict__)
+        return stdout.getvalue()
+
+    def read_lines(self, path):
+        with open(path) as fp:
+            return [json.loads(line) for line in fp]
+
+    def test_iter_objects(self):
+        # objects are fetched in chunks and expunged once yielded
+        session = orm.sessionmaker()
+        loaded = []
+        ids = []
+        for obj in dumpdata.iter_objects([UserRegistration, QueuedEmail],
+                                         chunk_size=2):
+            loaded.append(len(session.identity_map))
+            ids.append(obj.id)
+        self.assertEqual(ids, [1, 2, 3, 4, 5])
+        self.assertTrue(max(loaded) <= 2)
+        self.assertEqual(len(session.identity_map), 0)
+
+    def test_output_dir(self):
+        output_dir = os.path.join(self.tmp, 'dump')
+        self.assertEqual(self.dump('--format', 'jsonl',
+                                   '--output-dir', output_dir), '')
+        self.assertEqual(sorted(os.listdir(output_dir)),
+                         ['QueuedEmail.jsonl', 'UserRegistration.jsonl'])
+        rows = self.read_lines(os.path.join(output_dir, 'QueuedEmail.jsonl'))
+        self.assertEqual([row['id'] for row in rows], [1, 2, 3, 4, 5])
+        self.assertEqual(self.read_lines(
+            os.path.join(output_dir, 'UserRegistration.jsonl')), [])
+
+    def test_workers(self):
+        self.assertRaises(CommandError, self.dump, '--workers', '2')
+
+        serial_dir = os.path.join(self.tmp, 'serial')
+        parallel_dir = os.path.join(self.tmp, 'parallel')
+        self.dump('--format', 'jsonl', '--output-dir', serial_dir)
+        self.dump('--format', 'jsonl', '--output-dir', parallel_dir,
+                  '--workers', '2', '--chunk-size', '2')
+        for name in ('QueuedEmail.jsonl', 'UserRegistration.jsonl'):
+            self.assertEqual(
+                self.read_lines(os.path.join(parallel_dir, name)),
+                self.read_lines(os.path.join(serial_dir, name)))
+
+    def test_jsonl_round_trip(self):
+        register_builtin_serializers()
+        session = orm.sessionmaker()
+        session.add_all([DumpedItem(id=i, name=u'item \xe9 %d' % i,
+                                    data={'key': [i]})
+                         for i in range(1, 6)])
+        session.commit()
+        expected = [(item.id, item.name, item.data) for item in
+                    session.query(DumpedItem).order_by(DumpedItem.id)]
+
+        path = os.path.join(self.tmp, 'items.jsonl')
+        with open(path, 'w') as fp:
+            serializers.serialize('jsonl', dumpdata.iter_objects(
+                [DumpedItem], chunk_size=2), stream=fp)
+        with open(path) as fp:
+            self.assertEqual(len(fp.readlines()), 5)
+        session.query(DumpedItem).delete()
+        session.commit()
+        session.close()
+
+        command = LoadData()
+        options = command.create_parser('', 'loaddata') \
+            .parse_args([path, '--verbosity', '0'])
+        options = dict(options._get_kwargs())
+        args = options.pop('args')
+        command.execute(*args, **options)
+
+        session = orm.sessionmaker()
+        self.assertEqual([(item.id, item.name, item.data) for item in
+                          session.query(DumpedItem).order_by(DumpedItem.id)],
+                         expected)
+        session.query(DumpedItem).delete()
+        session.commit()
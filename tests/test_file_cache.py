@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import time
+
+from baph.core.cache.backends.filebased import ShardedFileCache
+from baph.test import TestCase
+
+
+class ShardedFileCacheTestCase(TestCase):
+    '''Tests :class:`baph.core.cache.backends.filebased.ShardedFileCache`.'''
+
+    options = {'CULL_INTERVAL': 0}
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = ShardedFileCache(self.dir, {
+            'TIMEOUT': 60,
+            'OPTIONS': self.options,
+            })
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_get_set(self):
+        self.assertEqual(self.cache.get('key'), None)
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+        self.cache.set('key', {'value': [1, 2, 3]})
+        self.assertEqual(self.cache.get('key'), {'value': [1, 2, 3]})
+        self.assertTrue(self.cache.has_key('key'))
+        self.cache.set('key', 'replaced')
+        self.assertEqual(self.cache.get('key'), 'replaced')
+
+    def test_versions(self):
+        self.cache.set('key', 1, version=1)
+        self.cache.set('key', 2, version=2)
+        self.assertEqual(self.cache.get('key', version=1), 1)
+        self.assertEqual(self.cache.get('key', version=2), 2)
+
+    def test_add(self):
+        self.assertTrue(self.cache.add('key', 'first'))
+        self.assertFalse(self.cache.add('key', 'second'))
+        self.assertEqual(self.cache.get('key'), 'first')
+        # the temp file is removed whether or not the add succeeds
+        self.assertEqual([name for name in self.cache._iter_files()
+                          if name.endswith('.tmp')], [])
+
+    def test_set_many(self):
+        self.cache.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c', 'd']),
+                         {'a': 1, 'b': 2, 'c': 3})
+
+    def test_delete(self):
+        self.cache.set('key', 'value')
+        self.cache.delete('key')
+        self.assertEqual(self.cache.get('key'), None)
+        # deleting a missing key is not an error
+        self.cache.delete('key')
+
+    def test_delete_many(self):
+        self.cache.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.cache.delete_many(['a', 'b'])
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'c': 3})
+
+    def test_expiry(self):
+        self.cache.set('expired', 'value', -1)
+        self.assertEqual(self.cache.get('expired'), None)
+        self.assertFalse(self.cache.has_key('expired'))
+        # the add succeeds, as the existing entry has expired
+        self.cache.set('expired', 'value', -1)
+        self.assertTrue(self.cache.add('expired', 'new'))
+        self.assertEqual(self.cache.get('expired'), 'new')
+
+        self.cache.set('forever', 'value', None)
+        self.assertEqual(self.cache.get('forever'), 'value')
+
+        self.cache.set('default', 'value')
+        fname = self.cache._key_to_file(self.cache.make_key('default'))
+        with open(fname, 'rb') as f:
+            expiry, flag = self.cache._read_header(f)
+        self.assertTrue(time.time() + 55 < expiry <= time.time() + 60)
+
+    def test_cull(self):
+        self.cache.set('expired', 'value', -1)
+        self.cache.set('live', 'value')
+        self.assertEqual(self.cache.cull(), 1)
+        self.assertEqual(self.cache.get('live'), 'value')
+
+    def test_clear(self):
+        self.cache.set('key', 'value')
+        self.cache.clear()
+        self.assertEqual(self.cache.get('key'), None)
+        self.assertFalse(os.path.exists(self.dir))
+
+    def test_close_stops_sweeper(self):
+        cache = ShardedFileCache(self.dir, {'OPTIONS': {'CULL_INTERVAL': 60}})
+        cache.set('key', 'value')
+        sweeper = ShardedFileCache._sweepers[cache._dir]
+        self.assertTrue(sweeper.is_alive())
+        # the request_finished signal leaves the sweeper running
+        cache.close(signal=None, sender=None)
+        self.assertTrue(sweeper.is_alive())
+        cache.close()
+        self.assertFalse(sweeper.is_alive())
+        self.assertNotIn(cache._dir, ShardedFileCache._sweepers)
+        # the next write starts a new sweeper
+        cache.add('other', 'value')
+        self.assertIsNot(ShardedFileCache._sweepers[cache._dir], sweeper)
+        cache.close()
+
+
+class CompressedFileCacheTestCase(ShardedFileCacheTestCase):
+    options = {'CULL_INTERVAL': 0,
+               'COMPRESSION': 'zlib',
+               'COMPRESS_MIN_LENGTH': 0}
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+from sqlalchemy import Column, Float, Integer, String
+
+from baph.db.models.mixins import GeoMixin
+from baph.db.orm import ORM
+from baph.test import TestCase
+from baph.utils import geo
+
+orm = ORM.get()
+
+
+class GeoPoint(orm.Base, GeoMixin):
+    '''Test model for proximity searches.'''
+    __tablename__ = 'test_baph_geo_point'
+
+    id = Column(Integer, primary_key=True)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    geohash = Column(String(12), index=True)
+
+    class Meta:
+        latlon_field_names = ('latitude', 'longitude')
+        geohash_field_name = 'geohash'
+
+
+def random_point(rng, lat, lon, spread):
+    return (max(-90.0, min(90.0, lat + rng.uniform(-spread, spread))),
+            geo.wrap_longitude(lon + rng.uniform(-spread, spread)))
+
+
+class GeoUtilsTestCase(TestCase):
+    '''Tests :mod:`baph.utils.geo`.'''
+
+    def test_encode_geohash(self):
+        self.assertEqual(geo.encode_geohash(57.64911, 10.40744, 11),
+                         'u4pruydqqvj')
+        self.assertEqual(geo.encode_geohash(0.0, 0.0, 5), 's0000')
+
+    def test_haversine(self):
+        # Los Angeles -> New York
+        distance = geo._haversine(34.0522, -118.2437, 40.7128, -74.0060)
+        self.assertAlmostEqual(distance, 2445, delta=5)
+        self.assertEqual(geo._haversine(1.0, 1.0, None, 1.0), float('inf'))
+
+    def test_haversine_vectorized(self):
+        rng = random.Random(1)
+        points = [random_point(rng, 40.0, -100.0, 30) for i in range(100)]
+        lats, lons = zip(*points)
+        expected = [geo._haversine(40.0, -100.0, lat, lon)
+                    for lat, lon in points]
+        distances = geo.haversine(40.0, -100.0, lats, lons)
+        for value, exp in zip(distances, expected):
+            self.assertAlmostEqual(value, exp, places=6)
+
+    def test_geohash_prefixes_cover_radius(self):
+        rng = random.Random(2)
+        centers = [(34.05, -118.24), (0.0, 0.0), (64.2, 179.9),
+                   (-33.9, 151.2), (51.5, -0.1)]
+        for lat, lon in centers:
+            for radius in (0.5, 5, 50, 500):
+                prefixes = geo.geohash_prefixes(lat, lon, radius)
+                self.assertTrue(prefixes)
+                spread = radius / 69.0 * 2
+                for i in range(200):
+                    point = random_point(rng, lat, lon, spread)
+                    if geo._haversine(lat, lon, *point) > radius:
+                        continue
+                    geohash = geo.encode_geohash(*point)
+                    self.assertTrue(
+                        any(geohash.startswith(p) for p in prefixes),
+                        '%r (%r from %r) not in %r'
+                        % (point, radius, (lat, lon), prefixes))
+
+    def test_geohash_prefixes_large_radius(self):
+        self.assertEqual(geo.geohash_prefixes(0.0, 0.0, 20000), None)
+
+
+class GeoMixinTestCase(TestCase):
+    '''Tests proximity searches with :class:`GeoMixin` on synthetic points.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super(GeoMixinTestCase, cls).setUpClass()
+        GeoPoint.__table__.create(orm.engine, checkfirst=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        GeoPoint.__table__.drop(orm.engine)
+        super(GeoMixinTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        self.session = orm.sessionmaker()
+        rng = random.Random(3)
+        self.points = []
+        for center in ((34.05, -118.24), (40.71, -74.0), (64.2, 179.95)):
+            for i in range(300):
+                self.points.append(random_point(rng, center[0], center[1], 2))
+        self.session.add_all([GeoPoint(latitude=lat, longitude=lon)
+                              for lat, lon in self.points])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.query(GeoPoint).delete()
+        self.session.commit()
+        self.session.close()
+
+    def brute_force(self, lat, lon, radius):
+        matches = []
+        for obj in self.session.query(GeoPoint):
+            distance = geo._haversine(lat, lon, obj.latitude, obj.longitude)
+            if distance <= radius:
+                matches.append(obj.id)
+        return sorted(matches)
+
+    def test_geohash_maintained_on_flush(self):
+        obj = self.session.query(GeoPoint).first()
+        self.assertEqual(obj.geohash,
+                         geo.encode_geohash(obj.latitude, obj.longitude))
+        obj.latitude = 10.0
+        obj.longitude = 20.0
+        self.session.commit()
+        self.assertEqual(obj.geohash, geo.encode_geohash(10.0, 20.0))
+        obj.latitude = None
+        self.session.commit()
+        self.assertEqual(obj.geohash, None)
+
+    def test_query_nearby(self):
+        for (lat, lon) in ((34.05, -118.24), (40.0, -74.5), (64.2, -179.9)):
+            for radius in (5, 25, 100):
+                results = GeoPoint.query_nearby(lat, lon, radius)
+                ids = sorted(obj.id for obj, distance in results)
+                self.assertEqual(ids, self.brute_force(lat, lon, radius))
+                distances = [distance for obj, distance in results]
+                self.assertEqual(distances, sorted(distances))
+                self.assertTrue(all(d <= radius for d in distances))
+
+    def test_query_nearby_without_geohash(self):
+        # rows inserted without the flush hook have no geohash
+        orm.engine.execute(GeoPoint.__table__.insert(), [
+            {'latitude': 34.06, 'longitude': -118.25},
+            {'latitude': 10.0, 'longitude': 10.0},
+            ])
+        for radius in (5, 25):
+            results = GeoPoint.query_nearby(34.05, -118.24, radius)
+            ids = sorted(obj.id for obj, distance in results)
+            self.assertEqual(ids, self.brute_force(34.05, -118.24, radius))
+            self.assertTrue(any(obj.geohash is None for obj, d in results))
+
+    def test_proximity_filters_narrow_by_geohash(self):
+        filters = GeoPoint.get_proximity_filters(34.05, -118.24, 10)
+        candidates = self.session.query(GeoPoint).filter(filters[0]).count()
+        self.assertTrue(0 < candidates < 300)
+
+    def test_rank_by_distance_pure_python(self):
+        objs = self.session.query(GeoPoint).all()
+        expected = GeoPoint.rank_by_distance(objs, 34.05, -118.24, 50)
+        numpy, geo.numpy = geo.numpy, None
+        try:
+            results = GeoPoint.rank_by_distance(objs, 34.05, -118.24, 50)
+        finally:
+            geo.numpy = numpy
+        self.assertEqual([obj for obj, d in results],
+                         [obj for obj, d in expected])
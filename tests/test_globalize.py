@@ -0,0 +1,329 @@
+from django.test.utils import override_settings
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, Unicode, event
+from sqlalchemy.orm import relationship
+
+from baph.db.models.utils import key_to_value
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class GlobFolder(orm.Base):
+    '''Test model with a self-referential cascade.'''
+    __tablename__ = 'test_baph_glob_folder'
+
+    class Meta:
+        global_column = 'is_global'
+        global_cascades = ['children', 'docs']
+        global_parents = ['parent']
+
+    id = Column(Integer, primary_key=True)
+    parent_id = Column(Integer, ForeignKey('test_baph_glob_folder.id'))
+    is_global = Column(Boolean, default=False, nullable=False)
+
+    parent = relationship('GlobFolder', remote_side=[id],
+                          backref='children')
+
+
+class GlobDoc(orm.Base):
+    '''Test model cascaded to from folders.'''
+    __tablename__ = 'test_baph_glob_doc'
+
+    class Meta:
+        global_column = 'is_global'
+        global_cascades = ['notes']
+        global_parents = ['folder']
+
+    id = Column(Integer, primary_key=True)
+    folder_id = Column(Integer, ForeignKey(GlobFolder.id))
+    is_global = Column(Boolean, default=False, nullable=False)
+
+    folder = relationship(GlobFolder, backref='docs')
+
+
+class GlobNote(orm.Base):
+    '''Test model at the end of the cascades.'''
+    __tablename__ = 'test_baph_glob_note'
+
+    class Meta:
+        global_column = 'is_global'
+        global_parents = ['doc']
+
+    id = Column(Integer, primary_key=True)
+    doc_id = Column(Integer, ForeignKey(GlobDoc.id))
+    is_global = Column(Boolean, default=False, nullable=False)
+
+    doc = relationship(GlobDoc, backref='notes')
+
+
+class GlobShelf(orm.Base):
+    '''Test model cascading to polymorphic and cached models.'''
+    __tablename__ = 'test_baph_glob_shelf'
+
+    class Meta:
+        global_column = 'is_global'
+        global_cascades = ['items', 'cards']
+
+    id = Column(Integer, primary_key=True)
+    is_global = Column(Boolean, default=False, nullable=False)
+
+
+class GlobItem(orm.Base):
+    '''Polymorphic test model without cascades of its own.'''
+    __tablename__ = 'test_baph_glob_item'
+    __mapper_args__ = {'polymorphic_on': 'kind', 'polymorphic_identity': 'item'}
+
+    class Meta:
+        global_column = 'is_global'
+        global_parents = ['shelf']
+
+    id = Column(Integer, primary_key=True)
+    shelf_id = Column(Integer, ForeignKey(GlobShelf.id))
+    kind = Column(Unicode(10))
+    is_global = Column(Boolean, default=False, nullable=False)
+
+    shelf = relationship(GlobShelf, backref='items')
+
+
+class GlobBox(GlobItem):
+    '''Polymorphic subclass declaring its own cascades.'''
+    __mapper_args__ = {'polymorphic_identity': 'box'}
+
+    class Meta:
+        global_column = 'is_global'
+        global_cascades = ['contents']
+        global_parents = ['shelf']
+
+
+class GlobContent(orm.Base):
+    '''Test model cascaded to from boxes only.'''
+    __tablename__ = 'test_baph_glob_content'
+
+    class Meta:
+        global_column = 'is_global'
+
+    id = Column(Integer, primary_key=True)
+    box_id = Column(Integer, ForeignKey(GlobItem.id))
+    is_global = Column(Boolean, default=False, nullable=False)
+
+    box = relationship(GlobBox, backref='contents')
+
+
+class GlobCard(orm.Base):
+    '''Cached test model which no cache namespace covers.'''
+    __tablename__ = 'test_baph_glob_card'
+
+    class Meta:
+        global_column = 'is_global'
+        cache_alias = 'default'
+        cache_timeout = 60
+        cache_detail_fields = ['id']
+
+    id = Column(Integer, primary_key=True)
+    shelf_id = Column(Integer, ForeignKey(GlobShelf.id))
+    is_global = Column(Boolean, default=False, nullable=False)
+
+    shelf = relationship(GlobShelf, backref='cards')
+
+
+MODELS = (GlobNote, GlobDoc, GlobFolder, GlobContent, GlobItem, GlobCard,
+          GlobShelf)
+
+
+def reference_global_status(objs):
+    '''Derives the global status of objs from their global_parents, one
+    object at a time, and returns the objects which become global.
+    '''
+    globalized = set()
+    changed = True
+    while changed:
+        changed = False
+        for obj in objs:
+            if obj.is_global or obj in globalized:
+                continue
+            for rel in obj._meta.global_parents:
+                parent = key_to_value(obj, rel, raw=True)
+                if parent is not None and (parent.is_global
+                                           or parent in globalized):
+                    globalized.add(obj)
+                    changed = True
+                    break
+    return globalized
+
+
+class GlobalizeTestCase(TestCase):
+    '''Tests that the bulk globalize paths match the per-object paths.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super(GlobalizeTestCase, cls).setUpClass()
+        orm.Base.metadata.create_all(orm.engine)
+
+    def setUp(self):
+        self.session = orm.sessionmaker()
+
+    def tearDown(self):
+        self.session.rollback()
+        for model in MODELS:
+            self.session.query(model).delete()
+        self.session.commit()
+        self.session.close()
+
+    def create_tree(self):
+        '''Creates two folder trees with docs and notes, and returns the
+        id of the first root.
+        '''
+        ids = iter(xrange(1, 1000))
+        def folder(parent_id, depth):
+            obj = GlobFolder(id=next(ids), parent_id=parent_id)
+            self.session.add(obj)
+            self.session.flush()
+            for i in range(2):
+                doc = GlobDoc(id=next(ids), folder_id=obj.id)
+                self.session.add(doc)
+                self.session.flush()
+                self.session.add(GlobNote(id=next(ids), doc_id=doc.id))
+            if depth:
+                for i in range(2):
+                    folder(obj.id, depth - 1)
+            return obj.id
+        root_id = folder(None, 2)
+        folder(None, 1)
+        self.session.commit()
+        self.session.expunge_all()
+        return root_id
+
+    def get_global_ids(self):
+        self.session.expire_all()
+        return dict((model.__name__, sorted(
+            obj.id for obj in self.session.query(model).filter_by(
+                is_global=True))) for model in MODELS)
+
+    def reset(self):
+        for model in MODELS:
+            self.session.query(model).update({'is_global': False})
+        self.session.commit()
+        self.session.expunge_all()
+
+    def test_bulk_cascades_match_per_object(self):
+        root_id = self.create_tree()
+
+        self.session.query(GlobFolder).get(root_id).globalize()
+        expected = self.get_global_ids()
+        self.assertEqual(len(expected['GlobFolder']), 7)
+        self.assertEqual(len(expected['GlobNote']), 14)
+
+        self.reset()
+        self.session.query(GlobFolder).get(root_id).globalize(bulk=True)
+        self.assertEqual(self.get_global_ids(), expected)
+
+    def test_bulk_cascades_in_chunks(self):
+        root_id = self.create_tree()
+
+        self.session.query(GlobFolder).get(root_id).globalize()
+        expected = self.get_global_ids()
+
+        self.reset()
+        root = self.session.query(GlobFolder).get(root_id)
+        root.is_global = True
+        GlobFolder.bulk_globalize_cascades(
+            self.session, GlobFolder.id == root_id, chunk_size=1)
+        self.session.commit()
+        self.assertEqual(self.get_global_ids(), expected)
+
+    def test_bulk_cascades_expire_loaded_objects(self):
+        root_id = self.create_tree()
+        docs = self.session.query(GlobDoc).all()
+        self.session.query(GlobFolder).get(root_id).globalize(bulk=True)
+        self.assertEqual(sorted(doc.id for doc in docs if doc.is_global),
+                         self.get_global_ids()['GlobDoc'])
+
+    def create_shelf(self):
+        '''Creates a shelf with a plain item, a box with contents and a
+        cached card, and returns its id.
+        '''
+        self.session.add_all([
+            GlobShelf(id=1),
+            GlobItem(id=2, shelf_id=1),
+            GlobBox(id=3, shelf_id=1),
+            GlobContent(id=4, box_id=3),
+            GlobContent(id=5, box_id=3),
+            GlobCard(id=6, shelf_id=1),
+            ])
+        self.session.commit()
+        self.session.expunge_all()
+        return 1
+
+    def test_bulk_cascades_polymorphic_targets(self):
+        # cascades declared on subclasses of the target are applied
+        shelf_id = self.create_shelf()
+        self.session.query(GlobShelf).get(shelf_id).globalize()
+        expected = self.get_global_ids()
+        self.assertEqual(expected['GlobContent'], [4, 5])
+
+        self.reset()
+        self.session.query(GlobShelf).get(shelf_id).globalize(bulk=True)
+        self.assertEqual(self.get_global_ids(), expected)
+
+    def test_bulk_cascades_uncovered_cached_targets(self):
+        # cached models no namespace covers are globalized per object, so
+        # their mapper events kill their cached entries
+        shelf_id = self.create_shelf()
+        updates = []
+        def record(mapper, connection, target):
+            updates.append(target.id)
+        event.listen(GlobCard, 'after_update', record)
+        self.addCleanup(event.remove, GlobCard, 'after_update', record)
+
+        updated = GlobShelf.bulk_globalize_cascades(
+            self.session, GlobShelf.id == shelf_id)
+        self.session.commit()
+        self.assertIn(GlobCard, updated)
+        self.assertEqual(updates, [])
+        self.assertEqual(self.get_global_ids()['GlobCard'], [6])
+
+        self.reset()
+        settings = override_settings(CACHE_ENABLED=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        updated = GlobShelf.bulk_globalize_cascades(
+            self.session, GlobShelf.id == shelf_id)
+        self.session.commit()
+        self.assertNotIn(GlobCard, updated)
+        self.assertEqual(updates, [6])
+        self.assertEqual(self.get_global_ids()['GlobCard'], [6])
+
+    def test_check_global_status_matches_per_object(self):
+        root_id = self.create_tree()
+        self.session.query(GlobFolder).get(root_id).globalize()
+        plain = self.session.query(GlobFolder) \
+            .filter_by(is_global=False).first()
+
+        new_folder = GlobFolder(id=500, is_global=True)
+        objs = [
+            # fk to a global folder
+            GlobDoc(id=501, folder_id=root_id),
+            # fk to a local folder
+            GlobDoc(id=502, folder_id=plain.id),
+            # relation to a new global folder
+            GlobDoc(id=503, folder=new_folder),
+            # no parent
+            GlobDoc(id=504),
+            # fk to a missing folder
+            GlobDoc(id=505, folder_id=999),
+            ]
+        # chains through objects created in the same flush
+        objs.append(GlobNote(id=506, doc=objs[0]))
+        objs.append(GlobNote(id=507, doc=objs[1]))
+        objs.append(GlobFolder(id=508, parent=new_folder))
+        objs.append(GlobDoc(id=509, folder=objs[-1]))
+        expected = reference_global_status(objs)
+        self.assertEqual(sorted(obj.id for obj in expected),
+                         [501, 503, 506, 508, 509])
+
+        self.session.add(new_folder)
+        self.session.add_all(objs)
+        self.session.flush()
+        self.assertEqual(set(obj for obj in objs if obj.is_global), expected)
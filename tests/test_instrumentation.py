@@ -0,0 +1,175 @@
+import logging
+
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from sqlalchemy.exc import OperationalError
+
+from baph.core import instrumentation
+from baph.core.cache.utils import get_cache
+from baph.core.instrumentation import (InstrumentedCache, RequestStats,
+                                       end_request_stats, get_request_stats,
+                                       start_request_stats)
+from baph.db.orm import ORM
+from baph.middleware.instrumentation import InstrumentationMiddleware
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class RecordingHandler(logging.Handler):
+    '''Collects the messages logged while it is attached.'''
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class RequestStatsTestCase(TestCase):
+    '''Tests :class:`baph.core.instrumentation.RequestStats`.'''
+
+    def test_record_statement(self):
+        stats = RequestStats()
+        stats.record_statement('SELECT 1', 0.25)
+        stats.record_statement('SELECT 2', 0.5)
+        stats.record_statement('SELECT 1', 0.25)
+        self.assertEqual(stats.sql_count, 3)
+        self.assertEqual(stats.sql_time, 1.0)
+        self.assertEqual(stats.get_repeated_statements(2), [('SELECT 1', 2)])
+        self.assertEqual(stats.get_repeated_statements(3), [])
+
+    def test_record_cache_op(self):
+        stats = RequestStats()
+        stats.record_cache_op('get', 0.5)
+        stats.record_cache_op('get', 0.25)
+        stats.record_cache_op('set', 0.25)
+        self.assertEqual(stats.cache_count, 3)
+        self.assertEqual(stats.cache_time, 1.0)
+        self.assertEqual(stats.cache_ops, {'get': 2, 'set': 1})
+
+    def test_exceeded_budgets(self):
+        stats = RequestStats()
+        stats.record_statement('SELECT 1', 0.5)
+        stats.record_statement('SELECT 1', 0.5)
+        self.assertEqual(
+            stats.get_exceeded_budgets({'sql_count': 1, 'sql_time': 1.0,
+                                        'cache_count': 0}),
+            [('sql_count', 2, 1)])
+
+    def test_server_timing(self):
+        stats = RequestStats()
+        stats.record_statement('SELECT 1', 0.0125)
+        stats.record_cache_op('get', 0.001)
+        stats.start = 10.0
+        stats.end = 10.5
+        self.assertEqual(stats.get_server_timing(),
+                         'db;dur=12.50;desc="1 queries", '
+                         'cache;dur=1.00;desc="1 ops", total;dur=500.00')
+
+
+class EngineListenersTestCase(TestCase):
+    '''Tests the statement counters of an instrumented request.'''
+
+    def setUp(self):
+        self.addCleanup(end_request_stats)
+        self.stats = start_request_stats()
+
+    def test_statements(self):
+        orm.engine.execute('SELECT 1')
+        orm.engine.execute('SELECT 1')
+        self.assertEqual(self.stats.sql_count, 2)
+        self.assertEqual(self.stats.statements['SELECT 1'], 2)
+
+    def test_failed_statements(self):
+        conn = orm.engine.connect()
+        self.addCleanup(conn.close)
+        for i in range(3):
+            self.assertRaises(OperationalError, conn.execute,
+                              'SELECT * FROM test_baph_missing')
+            self.assertNotIn('query_start_time', conn.info)
+        conn.execute('SELECT 1')
+        self.assertNotIn('query_start_time', conn.info)
+        self.assertEqual(self.stats.sql_count, 4)
+        self.assertEqual(
+            self.stats.statements['SELECT * FROM test_baph_missing'], 3)
+
+    def test_dbapi_error_fallback(self):
+        # the listener used instead of handle_error on SQLAlchemy < 0.9.7
+        conn = orm.engine.connect()
+        self.addCleanup(conn.close)
+        conn.info['query_start_time'] = 0
+        instrumentation.dbapi_error(conn, None, 'SELECT 2', (), None,
+                                    Exception())
+        self.assertNotIn('query_start_time', conn.info)
+        self.assertEqual(self.stats.statements['SELECT 2'], 1)
+
+    def test_not_instrumented(self):
+        self.assertIs(end_request_stats(), self.stats)
+        self.assertIsNone(get_request_stats())
+        conn = orm.engine.connect()
+        self.addCleanup(conn.close)
+        conn.execute('SELECT 1')
+        self.assertNotIn('query_start_time', conn.info)
+        self.assertEqual(self.stats.sql_count, 0)
+
+    def test_cache_operations(self):
+        cache = get_cache('default')
+        self.assertIsInstance(cache, InstrumentedCache)
+        cache.set('instrumented', 1)
+        cache.get('instrumented')
+        self.assertTrue('instrumented' in cache)
+        self.assertEqual(self.stats.cache_ops,
+                         {'set': 1, 'get': 1, 'has_key': 1})
+        end_request_stats()
+        self.assertNotIsInstance(get_cache('default'), InstrumentedCache)
+
+
+class InstrumentationMiddlewareTestCase(TestCase):
+    '''Tests :class:`baph.middleware.instrumentation.InstrumentationMiddleware`.'''
+
+    def setUp(self):
+        self.settings = override_settings(
+            BAPH_REQUEST_BUDGETS={'sql_count': 2},
+            BAPH_N_PLUS_ONE_THRESHOLD=3)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.handler = RecordingHandler()
+        logger = logging.getLogger('baph.middleware.instrumentation')
+        logger.addHandler(self.handler)
+        self.addCleanup(logger.removeHandler, self.handler)
+        self.request = RequestFactory().get('/stats/')
+
+    def get_response(self, queries):
+        def view(request):
+            for i in range(queries):
+                orm.engine.execute('SELECT 1')
+            get_cache('default').get('instrumented')
+            return HttpResponse()
+        return InstrumentationMiddleware(view)(self.request)
+
+    def test_within_budget(self):
+        response = self.get_response(2)
+        stats = self.request.stats
+        self.assertEqual(stats.sql_count, 2)
+        self.assertEqual(stats.cache_count, 1)
+        self.assertIsNotNone(stats.end)
+        self.assertEqual(response['Server-Timing'], stats.get_server_timing())
+        self.assertIsNone(get_request_stats())
+        self.assertEqual(self.handler.messages, [])
+
+    def test_exceeded_budget(self):
+        self.get_response(3)
+        self.assertEqual(self.handler.messages, [
+            'Request exceeded budget: GET /stats/ (sql_count=3 > 2)',
+            'Possible N+1 query: GET /stats/ executed 3 times: SELECT 1'])
+
+    def test_server_timing_disabled(self):
+        settings = override_settings(BAPH_SERVER_TIMING=False)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        response = self.get_response(0)
+        self.assertFalse(response.has_header('Server-Timing'))
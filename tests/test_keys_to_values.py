@@ -0,0 +1,155 @@
+from sqlalchemy import Column, ForeignKey, Integer, String, Unicode
+from sqlalchemy.orm import relationship
+
+from baph.db.models.utils import column_to_attr, key_to_value, keys_to_values
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class KeyCountry(orm.Base):
+    '''Test model at the top of the chain.'''
+    __tablename__ = 'test_baph_key_country'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(50))
+
+
+class KeyRegion(orm.Base):
+    '''Test model with an optional parent.'''
+    __tablename__ = 'test_baph_key_region'
+
+    id = Column(Integer, primary_key=True)
+    country_id = Column(Integer, ForeignKey(KeyCountry.id))
+    name = Column(Unicode(50))
+
+    country = relationship(KeyCountry)
+
+
+class KeySite(orm.Base):
+    '''Test model at the bottom of the chain.'''
+    __tablename__ = 'test_baph_key_site'
+
+    id = Column(Integer, primary_key=True)
+    region_id = Column(Integer, ForeignKey(KeyRegion.id))
+
+    region = relationship(KeyRegion)
+
+
+class KeyNode(orm.Base):
+    '''Test model whose primary key attribute isn't named after its column.'''
+    __tablename__ = 'test_baph_key_node'
+    __mapper_args__ = {'polymorphic_on': 'kind', 'polymorphic_identity': 'node'}
+
+    ident = Column('id', Integer, primary_key=True)
+    kind = Column(String(10))
+    name = Column(Unicode(50))
+
+
+class KeyLeaf(KeyNode):
+    '''Test subclass, its primary key attribute spans two columns.'''
+    __tablename__ = 'test_baph_key_leaf'
+    __mapper_args__ = {'polymorphic_identity': 'leaf'}
+
+    ident = Column('id', Integer, ForeignKey(KeyNode.ident), primary_key=True)
+
+
+class KeyTag(orm.Base):
+    '''Test model referencing the subclass.'''
+    __tablename__ = 'test_baph_key_tag'
+
+    id = Column(Integer, primary_key=True)
+    leaf_id = Column(Integer, ForeignKey(KeyLeaf.ident))
+
+    leaf = relationship(KeyLeaf)
+
+
+class KeysToValuesTestCase(TestCase):
+    '''Tests that :func:`keys_to_values` matches :func:`key_to_value`.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super(KeysToValuesTestCase, cls).setUpClass()
+        orm.Base.metadata.create_all(orm.engine)
+
+    def setUp(self):
+        self.session = orm.sessionmaker()
+        spain = KeyCountry(id=1, name=u'Spain')
+        self.session.add_all([
+            spain,
+            KeyRegion(id=1, country=spain, name=u'Galicia'),
+            KeyRegion(id=2, name=u'Nowhere'),
+            KeySite(id=1, region_id=1),
+            KeySite(id=2, region_id=1),
+            KeySite(id=3, region_id=2),
+            KeySite(id=4),
+            # the region doesn't exist
+            KeySite(id=5, region_id=99),
+            KeyLeaf(ident=1, name=u'Leaf'),
+            KeyTag(id=1, leaf_id=1),
+            KeyTag(id=2),
+            KeyTag(id=3, leaf_id=99),
+            ])
+        self.session.commit()
+        self.session.expunge_all()
+
+    def tearDown(self):
+        self.session.rollback()
+        for model in (KeyTag, KeyLeaf, KeyNode, KeySite, KeyRegion,
+                      KeyCountry):
+            self.session.query(model).delete()
+        self.session.commit()
+        self.session.close()
+
+    def assertMatches(self, objs, key, raw=False):
+        expected = [key_to_value(obj, key, raw=raw) for obj in objs]
+        self.session.expire_all()
+        self.assertEqual(keys_to_values(objs, key, raw=raw), expected)
+        return expected
+
+    def test_column_to_attr(self):
+        self.assertIs(column_to_attr(KeySite, KeySite.__table__.c.region_id),
+                      KeySite.region_id)
+        self.assertIs(column_to_attr(KeyLeaf, KeyLeaf.__table__.c.id),
+                      KeyLeaf.ident)
+        self.assertIsNone(column_to_attr(KeySite,
+                                         KeyRegion.__table__.c.country_id))
+
+    def test_chained(self):
+        sites = self.session.query(KeySite).order_by(KeySite.id).all()
+        self.assertEqual(self.assertMatches(sites, 'region.country.name'),
+                         ['Spain', 'Spain', None, None, None])
+
+    def test_single_hop(self):
+        sites = self.session.query(KeySite).order_by(KeySite.id).all()
+        self.assertEqual(self.assertMatches(sites, 'region.name'),
+                         ['Galicia', 'Galicia', 'Nowhere', None, None])
+
+    def test_raw(self):
+        sites = self.session.query(KeySite).order_by(KeySite.id).all()
+        regions = self.assertMatches(sites, 'region.country', raw=True)
+        self.assertEqual([c.id if c else None for c in regions],
+                         [1, 1, None, None, None])
+
+    def test_loaded_relations(self):
+        sites = self.session.query(KeySite).order_by(KeySite.id).all()
+        for site in sites:
+            site.region
+        self.assertMatches(sites, 'region.country.name')
+
+    def test_pending_objects(self):
+        # relations aren't loaded, only the fks are set
+        sites = [KeySite(region_id=1), KeySite(region_id=2), KeySite(),
+                 KeySite(region_id=99)]
+        self.assertMatches(sites, 'region.country.name')
+
+    def test_empty_objects(self):
+        self.assertEqual(keys_to_values([None], 'region.name'), [None])
+        self.assertEqual(keys_to_values([], 'region.name'), [])
+
+    def test_inherited_primary_key(self):
+        tags = self.session.query(KeyTag).order_by(KeyTag.id).all()
+        self.assertEqual(self.assertMatches(tags, 'leaf.name'),
+                         ['Leaf', None, None])
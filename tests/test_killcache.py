@@ -0,0 +1,175 @@
+from cStringIO import StringIO
+import os
+import shutil
+import sys
+import tempfile
+
+from django.core.cache import get_cache
+from django.test.utils import override_settings
+from sqlalchemy import Column, Integer, Unicode, event
+
+from baph.core.management.commands import killcache
+from baph.core.management.commands.killcache import (
+    Command, CommandError, increment_version_keys)
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class KilledItem(orm.Base):
+    '''Test model with detail and list cache keys.'''
+    __tablename__ = 'test_baph_killed_item'
+
+    class Meta:
+        cache_alias = 'default'
+        cache_timeout = 60
+        cache_detail_fields = ['id']
+        cache_list_fields = ['group']
+        cache_modes = ['detail', 'list']
+
+    id = Column(Integer, primary_key=True)
+    group = Column(Integer)
+    name = Column(Unicode(50))
+
+
+class KillCacheBulkTestCase(TestCase):
+    '''Tests the bulk mode of the killcache command.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super(KillCacheBulkTestCase, cls).setUpClass()
+        KilledItem.__table__.create(orm.engine, checkfirst=True)
+
+    def setUp(self):
+        self.settings_override = override_settings(CACHE_ENABLED=True)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.cache = get_cache('default')
+        self.cache.clear()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+        session = orm.sessionmaker()
+        session.add_all([KilledItem(id=i, group=i % 2, name=u'item %d' % i)
+                         for i in range(1, 11)])
+        session.commit()
+        self.items = session.query(KilledItem).order_by(KilledItem.id).all()
+        for item in self.items:
+            self.cache.set(item.cache_key, 'cached')
+        self.versions = dict((item.group, self.cache.get(
+            item.cache_list_version_key)) for item in self.items)
+        session.expunge_all()
+
+    def tearDown(self):
+        session = orm.sessionmaker()
+        session.query(KilledItem).delete()
+        session.commit()
+        session.close()
+
+    def kill(self, *argv):
+        command = Command()
+        options, args = command.create_parser('', 'killcache') \
+            .parse_args(['KilledItem'] + list(argv))
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            command.execute(*args, **options.__dict__)
+        finally:
+            sys.stdout = stdout
+
+    def get_killed(self):
+        return [item.id for item in self.items
+                if self.cache.get(item.cache_key) is None]
+
+    def get_version(self, group):
+        item = [item for item in self.items if item.group == group][0]
+        return self.cache.get(item.cache_list_version_key)
+
+    def test_ids(self):
+        self.kill('--bulk', '1', '2', '2')
+        self.assertEqual(self.get_killed(), [1, 2])
+        # each list version is bumped once
+        self.assertEqual(self.get_version(0), self.versions[0] + 1)
+        self.assertEqual(self.get_version(1), self.versions[1] + 1)
+
+    def test_filter(self):
+        self.kill('--filter', 'id > 8')
+        self.assertEqual(self.get_killed(), [9, 10])
+        self.assertEqual(self.get_version(0), self.versions[0] + 1)
+
+    def test_file(self):
+        path = os.path.join(self.tmp, 'ids.txt')
+        with open(path, 'w') as fp:
+            fp.write('# items to kill\n3\n\n5\n')
+        self.kill('--file', path)
+        self.assertEqual(self.get_killed(), [3, 5])
+        self.assertEqual(self.get_version(0), self.versions[0])
+        self.assertEqual(self.get_version(1), self.versions[1] + 1)
+
+    def test_chunk_size(self):
+        statements = []
+        def record(conn, cursor, statement, *args):
+            if 'test_baph_killed_item' in statement:
+                statements.append(statement)
+        event.listen(orm.engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, orm.engine, 'before_cursor_execute',
+                        record)
+        calls = []
+        delete_many = self.cache.delete_many
+        def record_delete_many(keys, *args, **kwargs):
+            calls.append(len(keys))
+            return delete_many(keys, *args, **kwargs)
+        self.cache.delete_many = record_delete_many
+        self.addCleanup(delattr, self.cache, 'delete_many')
+        orig_get_cache = killcache.get_cache
+        killcache.get_cache = lambda alias: self.cache
+        self.addCleanup(setattr, killcache, 'get_cache', orig_get_cache)
+
+        self.kill('--filter', 'id <= 7', '--chunk-size', '3')
+        self.assertEqual(self.get_killed(), range(1, 8))
+        # one query for the ids, then one per chunk
+        self.assertEqual(len(statements), 4)
+        self.assertEqual(calls, [3, 3, 1])
+
+    def test_sources(self):
+        self.assertRaises(CommandError, self.kill, '--bulk')
+        self.assertRaises(CommandError, self.kill, '1', '--filter', 'id = 1')
+
+    def test_increment_version_keys(self):
+        self.cache.set('version_a', 10)
+        increment_version_keys(self.cache, ['version_a', 'version_b'])
+        self.assertEqual(self.cache.get('version_a'), 11)
+        self.assertTrue(self.cache.get('version_b') > 11)
+
+    def test_increment_version_keys_concurrent(self):
+        # another process bumps the key during the bump
+        self.cache.set('version_a', 10)
+        incr = self.cache.incr
+        def concurrent_incr(key, *args, **kwargs):
+            incr(key)
+            return incr(key, *args, **kwargs)
+        self.cache.incr = concurrent_incr
+        self.addCleanup(delattr, self.cache, 'incr')
+        increment_version_keys(self.cache, ['version_a'])
+        self.assertEqual(self.cache.get('version_a'), 12)
+
+    def test_increment_version_keys_concurrent_add(self):
+        # another process creates the key between the failed incr and add
+        add = self.cache.add
+        def concurrent_add(key, *args, **kwargs):
+            add(key, 100)
+            return add(key, *args, **kwargs)
+        self.cache.add = concurrent_add
+        self.addCleanup(delattr, self.cache, 'add')
+        increment_version_keys(self.cache, ['version_b'])
+        self.assertEqual(self.cache.get('version_b'), 101)
+
+    def test_version_timeout(self):
+        # version keys keep the timeout they were created with
+        self.cache.set('version_a', 10, 1000)
+        key = self.cache.make_key('version_a')
+        expires = self.cache._expire_info[key]
+        increment_version_keys(self.cache, ['version_a'])
+        self.assertEqual(self.cache._expire_info[key], expires)
@@ -0,0 +1,121 @@
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+from baph.apps import lazy
+from baph.auth.management import get_registered_classes
+from baph.core.preconfig import index
+from baph.core.preconfig.index import PreconfigIndex
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+orm = ORM.get()
+counter = itertools.count()
+
+MODULE_TEMPLATE = '''
+from sqlalchemy import Column, Integer
+
+from baph.db.orm import ORM
+
+orm = ORM.get()
+
+
+class %(name)s(orm.Base):
+    __tablename__ = 'test_baph_%(module)s'
+    id = Column(Integer, primary_key=True)
+
+
+class %(shared)s(orm.Base):
+    __tablename__ = 'test_baph_%(module)s_shared'
+    id = Column(Integer, primary_key=True)
+'''
+
+
+class LazyModelsTestCase(TestCase):
+    '''Tests :mod:`baph.apps.lazy`.'''
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.orig_index = index._default_index
+        index._default_index = PreconfigIndex(
+            os.path.join(tempfile.mkdtemp(dir=self.tmp), index.INDEX_FILENAME))
+        self.orig_deferred = lazy.deferred_classes.copy()
+        lazy.deferred_classes.clear()
+        self.orig_path = sys.path[:]
+        sys.path.insert(0, self.tmp)
+        self.registry = orm.Base._decl_class_registry
+        # each test declares new classes, as mapped classes can't be removed
+        suffix = next(counter)
+        self.alpha, self.beta, self.shared = self.names = [
+            'Lazy%s%d' % (name, suffix) for name in ('Alpha', 'Beta', 'Shared')]
+        self.modules = ['lazy_alpha%d' % suffix, 'lazy_beta%d' % suffix]
+        for module, name in zip(self.modules, self.names):
+            with open(os.path.join(self.tmp, module + '.py'), 'w') as fp:
+                fp.write(MODULE_TEMPLATE % {
+                    'module': module, 'name': name, 'shared': self.shared})
+            self.assertTrue(lazy.defer_module(module))
+
+    def tearDown(self):
+        sys.path[:] = self.orig_path
+        lazy.deferred_classes.clear()
+        lazy.deferred_classes.update(self.orig_deferred)
+        index._default_index = self.orig_index
+        shutil.rmtree(self.tmp)
+
+    def assertImported(self, alpha, beta):
+        self.assertEqual(self.modules[0] in sys.modules, alpha)
+        self.assertEqual(self.modules[1] in sys.modules, beta)
+
+    def test_defer_module(self):
+        self.assertEqual(lazy.deferred_classes, {
+            self.alpha: self.modules[:1],
+            self.beta: self.modules[1:],
+            self.shared: self.modules,
+            })
+        self.assertImported(False, False)
+
+    def test_lookup_imports_defining_module(self):
+        self.assertIn(self.alpha, self.registry)
+        self.assertImported(True, False)
+        self.assertEqual(self.registry[self.alpha].__module__,
+                         self.modules[0])
+
+    def test_declaring_shared_name_imports_nothing_else(self):
+        # the first module declares the shared name, which the second
+        # module also defines
+        self.registry[self.alpha]
+        self.assertImported(True, False)
+        self.assertEqual(self.registry[self.shared].__module__,
+                         self.modules[0])
+        self.assertImported(True, False)
+
+    def test_lookup_shared_name_stops_once_found(self):
+        self.assertEqual(self.registry[self.shared].__module__,
+                         self.modules[0])
+        self.assertImported(True, False)
+        self.assertEqual(self.registry.get(self.beta).__module__,
+                         self.modules[1])
+        self.assertImported(True, True)
+
+    def test_missing_name(self):
+        self.assertNotIn('LazyMissing', self.registry)
+        self.assertIsNone(self.registry.get('LazyMissing'))
+        self.assertRaises(KeyError, lambda: self.registry['LazyMissing'])
+        self.assertImported(False, False)
+
+    def test_iteration_imports_all(self):
+        for method in ('keys', 'items', 'values', 'iterkeys', 'iteritems',
+                       'itervalues', '__iter__', '__len__', 'copy'):
+            self.tearDown()
+            self.setUp()
+            getattr(self.registry, method)()
+            self.assertEqual(lazy.deferred_classes, {}, method)
+            self.assertImported(True, True)
+            self.assertIn(self.beta, self.registry.keys())
+
+    def test_registered_classes(self):
+        names = set(cls.__name__ for cls in get_registered_classes())
+        self.assertTrue(set(self.names) <= names)
+        self.assertImported(True, True)
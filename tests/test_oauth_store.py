@@ -0,0 +1,181 @@
+import pickle
+import time
+
+# the oauth_provider store loads baph's store (see OAUTH_STORE)
+from oauth_provider.store import InvalidConsumerError, store as oauth_store
+from django.core.cache import get_cache
+from django.test.utils import override_settings
+from sqlalchemy import event
+
+from baph.auth.models import OAuthConsumer, Organization, User
+from baph.contrib.oauth import store
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class ModelStoreTestCase(TestCase):
+    '''Tests :class:`baph.contrib.oauth.store.ModelStore`.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super(ModelStoreTestCase, cls).setUpClass()
+        orm.Base.metadata.create_all(orm.engine)
+
+    def setUp(self):
+        self.settings = override_settings(OAUTH_CONSUMER_CACHE='default')
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        for name, value in (('CONSUMER_CACHE', 'default'),
+                            ('NONCE_CACHE', 'default'),
+                            ('NONCE_VALID_PERIOD', 300),
+                            ('NONCE_MAX_SKEW', 60)):
+            self.addCleanup(setattr, store, name, getattr(store, name))
+            setattr(store, name, value)
+        self.cache = get_cache('default')
+        self.cache.clear()
+
+        self.session = orm.sessionmaker()
+        self.addCleanup(self.cleanup)
+        self.org1 = Organization(name=u'org1')
+        self.org2 = Organization(name=u'org2')
+        self.user = User(email='alice@example.com', username='alice',
+                         password='sha1$secret$hash', organization=self.org1)
+        self.session.add_all([self.org1, self.org2, self.user])
+        self.session.flush()
+        self.consumer = OAuthConsumer(id=self.user.id, key='consumer-key',
+                                      secret='consumer-secret')
+        self.session.add(self.consumer)
+        self.session.commit()
+        self.current_org = self.org1
+        Organization.get_current = classmethod(lambda cls: self.current_org)
+        self.addCleanup(delattr, Organization, 'get_current')
+
+        self.store = store.ModelStore()
+        self.request = {'oauth_consumer_key': 'consumer-key',
+                        'oauth_nonce': 'nonce'}
+        self.cache_key = OAuthConsumer.get_cache_key('consumer-key')
+
+    def cleanup(self):
+        self.session.rollback()
+        for model in (OAuthConsumer, User, Organization):
+            self.session.query(model).delete()
+        self.session.commit()
+        self.session.close()
+
+    def get_consumer(self):
+        return self.store.get_consumer(None, self.request, 'consumer-key')
+
+    def test_store_setting(self):
+        self.assertIsInstance(oauth_store, store.ModelStore)
+
+    def test_cached_consumers(self):
+        self.assertEqual(self.get_consumer(), self.consumer)
+        self.assertEqual(self.cache.get(self.cache_key), [{
+            'id': self.user.id,
+            'org_id': self.org1.id,
+            'is_superuser': False,
+            }])
+        self.assertNotIn('sha1$secret$hash',
+                         pickle.dumps(self.cache.get(self.cache_key)))
+
+    def test_cached_lookup_skips_join(self):
+        self.get_consumer()
+        user_id = self.user.id
+        self.session.expunge_all()
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(orm.engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, orm.engine, 'before_cursor_execute',
+                        record)
+        self.assertEqual(self.get_consumer().id, user_id)
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('JOIN', statements[0])
+
+    def test_other_organization(self):
+        self.current_org = self.org2
+        self.assertRaises(InvalidConsumerError, self.get_consumer)
+
+    def test_superuser(self):
+        self.user.is_superuser = True
+        self.session.commit()
+        self.current_org = self.org2
+        self.assertEqual(self.get_consumer(), self.consumer)
+
+    def test_unknown_consumer(self):
+        self.request['oauth_consumer_key'] = 'unknown'
+        self.assertRaises(InvalidConsumerError, self.get_consumer)
+        self.assertEqual(
+            self.cache.get(OAuthConsumer.get_cache_key('unknown')), [])
+
+    def test_user_organization_change_expires_cache(self):
+        self.get_consumer()
+        self.user.organization = self.org2
+        self.session.commit()
+        self.assertIsNone(self.cache.get(self.cache_key))
+        self.assertRaises(InvalidConsumerError, self.get_consumer)
+
+    def test_user_superuser_change_expires_cache(self):
+        self.get_consumer()
+        self.user.is_superuser = True
+        self.session.commit()
+        self.assertIsNone(self.cache.get(self.cache_key))
+
+    def test_unrelated_user_change_keeps_cache(self):
+        self.get_consumer()
+        self.user.email = 'bob@example.com'
+        self.session.commit()
+        self.assertIsNotNone(self.cache.get(self.cache_key))
+
+    def test_user_delete_expires_cache(self):
+        self.get_consumer()
+        self.session.delete(self.user)
+        self.session.commit()
+        self.assertIsNone(self.cache.get(self.cache_key))
+
+    def test_consumer_change_expires_cache(self):
+        self.get_consumer()
+        self.consumer.secret = 'new-secret'
+        self.session.commit()
+        self.assertIsNone(self.cache.get(self.cache_key))
+
+    def check_nonce(self, offset, nonce='nonce'):
+        self.request['oauth_nonce'] = nonce
+        return self.store.check_nonce(None, self.request, nonce,
+                                      int(time.time()) + offset)
+
+    def test_check_nonce(self):
+        self.assertTrue(self.check_nonce(0))
+        # replayed nonces are rejected
+        self.assertFalse(self.check_nonce(0))
+        self.assertTrue(self.check_nonce(0, 'other'))
+
+    def test_check_nonce_expired(self):
+        self.assertFalse(self.check_nonce(-301))
+        self.assertTrue(self.check_nonce(-290))
+
+    def test_check_nonce_skew(self):
+        self.assertTrue(self.check_nonce(50))
+        self.assertFalse(self.check_nonce(3600, 'later'))
+        self.assertFalse(self.check_nonce(10 ** 9, 'never'))
+
+    def test_check_nonce_unlimited_skew(self):
+        store.NONCE_MAX_SKEW = None
+        self.assertTrue(self.check_nonce(3600, 'later'))
+
+    def test_nonce_audit_queue_is_bounded(self):
+        class Writer(store.NonceAuditWriter):
+            def start(self):
+                pass
+        writer = Writer(maxsize=2)
+        self.assertTrue(writer.put({'key': 1}))
+        self.assertTrue(writer.put({'key': 2}))
+        self.assertFalse(writer.put({'key': 3}))
+        self.assertFalse(writer.put({'key': 4}))
+        self.assertEqual(writer.dropped, 2)
+        self.assertEqual(writer.get_batch(), [{'key': 1}, {'key': 2}])
+        self.assertTrue(writer.put({'key': 5}))
+        self.assertEqual(writer.dropped, 0)
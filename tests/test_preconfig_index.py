@@ -0,0 +1,145 @@
+import os
+import shutil
+import sys
+import tempfile
+
+from baph.conf import Settings
+from baph.core.preconfig import index
+from baph.core.preconfig.index import (PreconfigIndex, cached_lookup,
+                                       get_environment, is_import_path)
+from baph.test import TestCase
+
+
+class PathSettings(Settings):
+    '''Settings with only the package path lookups.'''
+    def __init__(self):
+        self.package_paths = {}
+
+
+class PreconfigIndexTestCase(TestCase):
+    '''Tests :mod:`baph.core.preconfig.index`.'''
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.orig_index = index._default_index
+        index._default_index = PreconfigIndex(
+            os.path.join(tempfile.mkdtemp(dir=self.tmp), index.INDEX_FILENAME))
+        self.orig_path = sys.path[:]
+        self.orig_cwd = os.getcwd()
+
+    def tearDown(self):
+        os.chdir(self.orig_cwd)
+        sys.path[:] = self.orig_path
+        index._default_index = self.orig_index
+        shutil.rmtree(self.tmp)
+
+    def make_package(self, entry, name):
+        path = os.path.join(self.tmp, entry, name)
+        os.makedirs(path)
+        open(os.path.join(path, '__init__.py'), 'w').close()
+        return path
+
+    def test_environment(self):
+        env = get_environment()
+        sys.path.insert(0, self.tmp)
+        self.assertNotEqual(get_environment(), env)
+        sys.path.pop(0)
+        self.assertEqual(get_environment(), env)
+        os.chdir(self.tmp)
+        self.assertNotEqual(get_environment(), env)
+
+    def test_is_import_path(self):
+        first = self.make_package('first', 'baph_index_pkg')
+        second = self.make_package('second', 'baph_index_pkg')
+        sys.path.insert(0, os.path.join(self.tmp, 'second'))
+        self.assertTrue(is_import_path('baph_index_pkg', second))
+        self.assertFalse(is_import_path('baph_index_pkg', first))
+
+        # an earlier entry shadows the cached package
+        sys.path.insert(0, os.path.join(self.tmp, 'first'))
+        self.assertFalse(is_import_path('baph_index_pkg', second))
+        self.assertTrue(is_import_path('baph_index_pkg', first))
+
+        # and so does a module of the same name
+        mod_dir = os.path.join(self.tmp, 'module')
+        os.makedirs(mod_dir)
+        open(os.path.join(mod_dir, 'baph_index_pkg.py'), 'w').close()
+        sys.path.insert(0, mod_dir)
+        self.assertFalse(is_import_path('baph_index_pkg', first))
+
+    def test_cached_lookup_validates_hits(self):
+        calls = []
+        def lookup():
+            calls.append(1)
+            return len(calls)
+
+        key = ('test', 'value')
+        self.assertEqual(cached_lookup(key, [self.tmp], lookup), 1)
+        self.assertEqual(cached_lookup(key, [self.tmp], lookup), 1)
+        self.assertEqual(cached_lookup(key, [self.tmp], lookup,
+                                       lambda value: True), 1)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cached_lookup(key, [self.tmp], lookup,
+                                       lambda value: False), 2)
+        self.assertEqual(len(calls), 2)
+
+    def make_index_path(self):
+        # the index directory changes on each save, so lookups use another
+        return os.path.join(tempfile.mkdtemp(dir=self.tmp), 'shared.json')
+
+    def test_save_merges_entries(self):
+        path = self.make_index_path()
+        first = PreconfigIndex(path)
+        second = PreconfigIndex(path)
+        self.assertEqual(second.entries, {})
+        first.set('first', 1, [self.tmp])
+        second.set('second', 2, [self.tmp])
+        first.set('third', 3, [self.tmp])
+        self.assertEqual(sorted(PreconfigIndex(path).entries),
+                         ['first', 'second', 'third'])
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['shared.json'])
+
+    def test_save_prunes_entries(self):
+        path = self.make_index_path()
+        stale_dir = tempfile.mkdtemp(dir=self.tmp)
+        clock = iter(xrange(1000))
+        class Clock(object):
+            @staticmethod
+            def time():
+                return next(clock)
+        self.addCleanup(setattr, index, 'time', index.time)
+        index.time = Clock
+        self.addCleanup(setattr, index, 'MAX_ENTRIES', index.MAX_ENTRIES)
+        index.MAX_ENTRIES = 3
+
+        idx = PreconfigIndex(path)
+        idx.set('stale', 0, [stale_dir])
+        os.utime(stale_dir, (0, 0))
+        for i in range(4):
+            idx.set('key%d' % i, i, [self.tmp])
+        # stale entries are dropped first, then the oldest ones
+        self.assertEqual(sorted(PreconfigIndex(path).entries),
+                         ['key1', 'key2', 'key3'])
+
+    def test_package_path_follows_sys_path(self):
+        first = self.make_package('first', 'baph_index_pkg')
+        second = self.make_package('second', 'baph_index_pkg')
+        sys.path.insert(0, os.path.join(self.tmp, 'second'))
+
+        settings = PathSettings()
+        self.assertEqual(settings.get_package_path('baph_index_pkg'), second)
+
+        # a new process with a different sys.path finds the other package
+        sys.path.insert(0, os.path.join(self.tmp, 'first'))
+        settings = PathSettings()
+        self.assertEqual(settings.get_package_path('baph_index_pkg'), first)
+
+        # the same environment, with a new package earlier on sys.path
+        third_entry = os.path.join(self.tmp, 'third')
+        os.makedirs(third_entry)
+        sys.path[:] = [third_entry, os.path.join(self.tmp, 'second')]
+        settings = PathSettings()
+        self.assertEqual(settings.get_package_path('baph_index_pkg'), second)
+        third = self.make_package('third', 'baph_index_pkg')
+        settings = PathSettings()
+        self.assertEqual(settings.get_package_path('baph_index_pkg'), third)
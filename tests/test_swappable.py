@@ -0,0 +1,40 @@
+from sqlalchemy import Column, Integer
+
+from baph.auth.models import Organization
+from baph.auth.models.organization.base import BaseOrganization
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+
+orm = ORM.get()
+
+
+class BaseGizmo(orm.Base):
+    '''Test model with a swappable, unswapped subclass.'''
+    __tablename__ = 'test_baph_gizmo'
+    __requires_subclass__ = True
+
+    id = Column(Integer, primary_key=True)
+
+
+class Gizmo(BaseGizmo):
+    class Meta:
+        swappable = 'BAPH_GIZMO_MODEL'
+
+
+class SwappableModelTestCase(TestCase):
+    '''Tests swappable models which haven't been swapped out.'''
+
+    def test_alias(self):
+        # the subclass is an alias of its base, which takes its options
+        self.assertIs(Gizmo, BaseGizmo)
+        self.assertIs(Gizmo._meta.model, BaseGizmo)
+        self.assertEqual(Gizmo._meta.swappable, 'BAPH_GIZMO_MODEL')
+        self.assertIsNone(Gizmo._meta.swapped)
+        self.assertEqual(Gizmo._meta.model_name, 'gizmo')
+
+    def test_builtin_alias(self):
+        self.assertIs(Organization, BaseOrganization)
+        self.assertIs(Organization._meta.model, Organization)
+        self.assertEqual(Organization._meta.swappable,
+                         'BAPH_ORGANIZATION_MODEL')
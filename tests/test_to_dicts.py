@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import Column, Integer, Unicode
+from sqlalchemy.orm import column_property
+
+from baph.db.orm import ORM
+from baph.test import TestCase
+
+orm = ORM.get()
+
+
+class DictItem(orm.Base):
+    '''Test model with a ``column_property`` expression.'''
+    __tablename__ = 'test_baph_dict_item'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(50))
+    double_id = column_property(id * 2)
+
+
+class ToDictsTestCase(TestCase):
+    '''Tests :meth:`baph.db.models.base.Model.to_dicts`.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super(ToDictsTestCase, cls).setUpClass()
+        orm.Base.metadata.create_all(orm.engine)
+
+    def setUp(self):
+        self.session = orm.sessionmaker()
+        self.session.add_all([DictItem(id=1, name=u'one'),
+                              DictItem(id=2, name=u'two')])
+        self.session.commit()
+        self.addCleanup(self.cleanup)
+
+    def cleanup(self):
+        self.session.rollback()
+        self.session.query(DictItem).delete()
+        self.session.commit()
+        self.session.close()
+
+    def test_instances(self):
+        items = self.session.query(DictItem).order_by(DictItem.id).all()
+        self.assertEqual(DictItem.to_dicts(items),
+                         [{'id': 1, 'name': u'one', 'double_id': 2},
+                          {'id': 2, 'name': u'two', 'double_id': 4}])
+
+    def test_rows_skip_expressions(self):
+        rows = self.session.execute(
+            DictItem.__table__.select().order_by(DictItem.id))
+        self.assertEqual(DictItem.to_dicts(rows, rows=True),
+                         [{'id': 1, 'name': u'one'},
+                          {'id': 2, 'name': u'two'}])
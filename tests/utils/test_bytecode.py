@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+
+from baph.test import TestCase
+from baph.utils import bytecode
+from baph.utils.bytecode import (CACHE_ENV_VARIABLE, HEADER, exec_file,
+                                 get_cache_dir, get_cache_path, load_code)
+
+
+class BytecodeCacheTestCase(TestCase):
+    '''Tests :mod:`baph.utils.bytecode`.'''
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cache_dir = os.path.join(self.tmp, 'cache')
+        orig = os.environ.get(CACHE_ENV_VARIABLE)
+        os.environ[CACHE_ENV_VARIABLE] = self.cache_dir
+        self.addCleanup(self.restore_env, orig)
+        self.path = os.path.join(self.tmp, 'module.py')
+        self.write_source('value = 1\n')
+
+    def restore_env(self, value):
+        if value is None:
+            os.environ.pop(CACHE_ENV_VARIABLE, None)
+        else:
+            os.environ[CACHE_ENV_VARIABLE] = value
+
+    def write_source(self, source, mtime=1000000000):
+        with open(self.path, 'w') as fp:
+            fp.write(source)
+        os.utime(self.path, (mtime, mtime))
+
+    def run_code(self, code):
+        namespace = {}
+        exec code in namespace
+        return namespace['value']
+
+    def test_hit_and_miss(self):
+        code, cached = load_code(self.path)
+        self.assertFalse(cached)
+        self.assertEqual(self.run_code(code), 1)
+        self.assertTrue(os.path.exists(
+            get_cache_path(self.cache_dir, self.path)))
+        code, cached = load_code(self.path)
+        self.assertTrue(cached)
+        self.assertEqual(self.run_code(code), 1)
+
+    def test_disabled(self):
+        os.environ[CACHE_ENV_VARIABLE] = ''
+        self.assertIsNone(get_cache_dir())
+        self.assertFalse(load_code(self.path)[1])
+        self.assertFalse(load_code(self.path)[1])
+
+    def test_invalidated_by_mtime(self):
+        load_code(self.path)
+        self.write_source('value = 2\n', mtime=1000000001)
+        code, cached = load_code(self.path)
+        self.assertFalse(cached)
+        self.assertEqual(self.run_code(code), 2)
+
+    def test_invalidated_by_size(self):
+        load_code(self.path)
+        # same mtime, different size
+        self.write_source('value = 22\n')
+        code, cached = load_code(self.path)
+        self.assertFalse(cached)
+        self.assertEqual(self.run_code(code), 22)
+
+    def test_invalidated_by_magic(self):
+        load_code(self.path)
+        self.addCleanup(setattr, bytecode, 'MAGIC', bytecode.MAGIC)
+        bytecode.MAGIC = '\0\0\0\0'
+        self.assertFalse(load_code(self.path)[1])
+        self.assertTrue(load_code(self.path)[1])
+
+    def test_corrupt_cache_file(self):
+        load_code(self.path)
+        cache_path = get_cache_path(self.cache_dir, self.path)
+        st = os.stat(self.path)
+        for data in ('', 'garbage',
+                     HEADER.pack(bytecode.MAGIC, st.st_mtime, st.st_size)
+                     + 'garbage'):
+            with open(cache_path, 'wb') as fp:
+                fp.write(data)
+            code, cached = load_code(self.path)
+            self.assertFalse(cached)
+            self.assertEqual(self.run_code(code), 1)
+            # the cache file is rewritten
+            self.assertTrue(load_code(self.path)[1])
+
+    def test_refuses_foreign_cache_dir(self):
+        self.assertEqual(get_cache_dir(), self.cache_dir)
+        getuid = os.getuid
+        self.addCleanup(setattr, os, 'getuid', getuid)
+        os.getuid = lambda: getuid() + 1
+        self.assertIsNone(get_cache_dir())
+        # the code in it is never loaded
+        load_code(self.path)
+        self.assertFalse(load_code(self.path)[1])
+
+    def test_exec_file(self):
+        namespace = {}
+        timings = bytecode.load_timings[:]
+        def restore():
+            bytecode.load_timings[:] = timings
+        self.addCleanup(restore)
+        del bytecode.load_timings[:]
+        exec_file(self.path, namespace, label='module')
+        exec_file(self.path, namespace)
+        self.assertEqual(namespace['value'], 1)
+        self.assertEqual([(label, cached) for label, seconds, cached
+                          in bytecode.load_timings],
+                         [('module', False), (self.path, True)])
+        report = bytecode.get_timing_report()
+        self.assertIn('compiled', report)
+        self.assertIn('cache', report)